@@ -0,0 +1,200 @@
+# coding: utf-8
+"""
+命令行回测入口 - 无需 PyQt5 界面即可运行回测
+
+用法:
+    python khquant_backtest.py 配置文件.kh [策略文件.py ...] [--no-init-data] [--quiet] [--log-file 日志文件] [--resume]
+
+指定多个策略文件时，所有策略在同一次回测中共享一份行情数据，各自使用独立的
+账户，结果分别保存在 backtest_results/策略名_开始日期_结束日期 目录中。
+
+回测框架通过 trader_callback.gui 上报日志、进度和回测结果，GUI 模式下该对象是
+主窗口；命令行模式下使用 HeadlessSink 代替，可在服务器、定时任务和子进程中运行。
+"""
+
+import argparse
+import datetime
+import os
+import re
+import sys
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from khConfig import KhConfig
+
+# 从日志中解析回测进度，格式与 GUI 解析方式一致，如 "回测进度: 12.34%"
+_PROGRESS_PATTERN = re.compile(r"进度[:：]\s*([\d.]+)%")
+
+
+class _ProgressSignal:
+    """模拟 Qt 的 progress_signal，框架调用 emit(int) 上报进度"""
+
+    def __init__(self, sink: 'HeadlessSink'):
+        self._sink = sink
+
+    def emit(self, value):
+        self._sink.update_progress(float(value))
+
+
+class HeadlessSink:
+    """命令行回测的日志/进度/结果接收器，替代 GUI 主窗口
+
+    实现框架用到的 GUI 接口：log_message、progress_signal.emit、
+    on_strategy_finished、show_backtest_result 和 invoke。
+    """
+
+    def __init__(self, quiet: bool = False, log_file: Optional[str] = None,
+                 on_log: Optional[Callable[[str, str], None]] = None,
+                 on_progress: Optional[Callable[[float], None]] = None):
+        """初始化接收器
+
+        Args:
+            quiet: 为 True 时只输出警告、错误和进度
+            log_file: 日志文件路径，为 None 时不写文件
+            on_log: 日志回调 on_log(message, level)
+            on_progress: 进度回调 on_progress(percent)
+        """
+        self.quiet = quiet
+        self.on_log = on_log
+        self.on_progress = on_progress
+        self.progress_signal = _ProgressSignal(self)
+        self.progress = 0.0
+        self.result_dir = None      # 回测结果目录（show_backtest_result 收到的目录）
+        self.finished = False
+        self.error_count = 0
+        self._last_reported = -1
+        self._log_fp = open(log_file, 'a', encoding='utf-8') if log_file else None
+
+    def log_message(self, message, level="INFO"):
+        """接收框架日志"""
+        message = str(message)
+        if level == "ERROR":
+            self.error_count += 1
+        if self.on_log:
+            self.on_log(message, level)
+
+        match = _PROGRESS_PATTERN.search(message)
+        if match:
+            self.update_progress(float(match.group(1)))
+            return
+
+        line = f"{datetime.datetime.now().strftime('%H:%M:%S')} [{level}] {message}"
+        if self._log_fp:
+            self._log_fp.write(line + "\n")
+            self._log_fp.flush()
+        if not self.quiet or level in ("WARNING", "ERROR"):
+            print(line, flush=True)
+
+    def update_progress(self, percent: float):
+        """更新回测进度，每个整数百分比最多输出一次"""
+        self.progress = percent
+        if self.on_progress:
+            self.on_progress(percent)
+        if int(percent) != self._last_reported:
+            self._last_reported = int(percent)
+            if not self.quiet or self._last_reported % 10 == 0:
+                print(f"回测进度: {percent:.2f}%", flush=True)
+
+    def on_strategy_finished(self):
+        self.finished = True
+
+    def show_backtest_result(self, backtest_dir):
+        self.result_dir = backtest_dir
+
+    def invoke(self, func):
+        """GUI 模式下在主线程执行函数，命令行模式直接执行"""
+        return func()
+
+    def close(self):
+        if self._log_fp:
+            self._log_fp.close()
+            self._log_fp = None
+
+
+def run_backtest(config_path: str, strategy_file: Optional[Union[str, List[str]]] = None,
+                 sink: Optional[HeadlessSink] = None,
+                 init_data_enabled: Optional[bool] = None,
+                 data_provider=None,
+                 strategy_params: Optional[Dict[str, Any]] = None,
+                 resume: bool = False) -> Optional[str]:
+    """在当前进程中运行一次回测（不依赖 PyQt5）
+
+    Args:
+        config_path: .kh 配置文件路径
+        strategy_file: 策略文件路径，为 None 时使用配置文件中的 strategy_file；
+            传入列表时多个策略共享一次数据加载，第一个为主策略
+        sink: 日志接收器，为 None 时创建默认的 HeadlessSink
+        init_data_enabled: 是否初始化行情数据，None 表示按配置文件决定
+        data_provider: 指定的数据提供者实例，None 表示按配置文件创建
+        strategy_params: 策略参数，运行前设置为主策略模块的同名模块级变量
+        resume: 是否从回测目录中保存的断点继续
+
+    Returns:
+        Optional[str]: （主策略的）回测结果目录，回测未完成时返回 None
+    """
+    # 延迟导入，保证 --help 等不需要加载交易框架
+    from khFrame import KhQuantFramework, MyTraderCallback
+
+    if not strategy_file:
+        strategy_file = KhConfig(config_path).config_dict.get("strategy_file", "")
+    strategy_files = strategy_file if isinstance(strategy_file, (list, tuple)) else [strategy_file]
+    for path in strategy_files:
+        if not path or not os.path.exists(path):
+            raise FileNotFoundError(f"策略文件不存在: {path}")
+
+    sink = sink or HeadlessSink()
+    framework = KhQuantFramework(
+        config_path,
+        strategy_file,
+        trader_callback=MyTraderCallback(sink),
+        init_data_enabled=init_data_enabled,
+        data_provider=data_provider,
+        resume=resume
+    )
+    for name, value in (strategy_params or {}).items():
+        setattr(framework.strategy_module, name, value)
+    framework.run()
+    return sink.result_dir
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="khquant-backtest",
+        description="看海量化命令行回测（无需图形界面）"
+    )
+    parser.add_argument("config", help=".kh 配置文件路径")
+    parser.add_argument("strategy", nargs="*", default=None,
+                        help="策略文件路径，可指定多个（默认使用配置文件中的 strategy_file）")
+    parser.add_argument("--no-init-data", dest="init_data", action="store_false", default=None,
+                        help="跳过运行前的行情数据初始化")
+    parser.add_argument("--init-data", dest="init_data", action="store_true",
+                        help="强制在运行前初始化行情数据")
+    parser.add_argument("-q", "--quiet", action="store_true", help="只输出警告、错误和进度")
+    parser.add_argument("--log-file", default=None, help="日志文件路径")
+    parser.add_argument("--resume", action="store_true",
+                        help="从上次中断时保存的断点继续回测（断点间隔由配置 backtest.checkpoint_interval 设置，单位秒）")
+    return parser
+
+
+def main(argv=None) -> int:
+    """命令行入口
+
+    Returns:
+        int: 退出码，0 表示回测完成并生成了结果目录
+    """
+    args = build_arg_parser().parse_args(argv)
+    sink = HeadlessSink(quiet=args.quiet, log_file=args.log_file)
+    try:
+        strategy = args.strategy[0] if args.strategy and len(args.strategy) == 1 else args.strategy
+        result_dir = run_backtest(args.config, strategy, sink=sink, init_data_enabled=args.init_data,
+                                  resume=args.resume)
+    except Exception as e:
+        print(f"回测运行失败: {e}", file=sys.stderr)
+        return 1
+    finally:
+        sink.close()
+
+    if not result_dir:
+        print("回测未完成，没有生成回测结果", file=sys.stderr)
+        return 1
+    print(f"回测结果已保存到: {os.path.abspath(result_dir)}")
+    return 0
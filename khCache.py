@@ -0,0 +1,222 @@
+# coding: utf-8
+"""
+内存缓存 - 按占用字节数限制大小的 LRU 缓存，统计命中、未命中和淘汰次数
+
+khHistory 数据缓存、khHistory 预处理数据和 Mootdx 原始数据缓存都使用 LRUCache。
+缓存的 DataFrame 由 freeze_frame 转换为只读数组，命中时共享返回而不复制数据。
+总占用超过上限时，从最久未使用的条目开始淘汰；单个条目超过上限时仍保留最近写入的
+这一个条目，避免每次调用都重新获取数据。
+
+上限由 .kh 配置 system.cache_max_mb 设置（单位 MB，每个缓存分别计算，0 表示不限制），
+回测开始时由框架调用 configure_caches 应用，回测结束时输出各缓存的统计信息。
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# 默认每个缓存的内存上限（MB）
+DEFAULT_CACHE_MAX_MB = 1024
+
+_MISSING = object()
+
+
+def estimate_size(value: Any) -> int:
+    """估计对象占用的字节数
+
+    DataFrame、Series 和 ndarray 按数据缓冲区大小计算，字典、列表和元组递归累加，
+    定义了 nbytes 属性的对象使用 nbytes，其余对象使用 sys.getsizeof。
+    """
+    if value is None:
+        return 0
+    if isinstance(value, pd.DataFrame):
+        # 按行数和列类型估算（比 memory_usage 快一个数量级，对象列按指针大小计算）
+        row_bytes = sum(getattr(dtype, 'itemsize', 8) for dtype in value.dtypes)
+        return len(value) * row_bytes + int(value.index.nbytes)
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=False))
+    if isinstance(value, (np.ndarray, pd.Index)):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, (int, np.integer)):
+        return int(nbytes)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """按占用字节数限制大小的 LRU 缓存（线程安全）
+
+    Args:
+        name: 缓存名称，用于统计输出
+        max_bytes: 内存上限（字节），默认 DEFAULT_CACHE_MAX_MB，None 或 0 表示不限制
+        sizeof: 计算条目大小的函数，默认 estimate_size
+        register: 是否登记到全局缓存列表（由 configure_caches 和 cache_stats 统一管理）
+    """
+
+    def __init__(self, name: str, max_bytes: Optional[int] = DEFAULT_CACHE_MAX_MB * 2 ** 20,
+                 sizeof: Callable[[Any], int] = estimate_size, register: bool = True):
+        self.name = name
+        self.max_bytes = max_bytes or None
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()   # {键: (值, 大小)}
+        self._lock = threading.Lock()
+        if register:
+            _caches.append(self)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """是否包含 key（不计入命中统计，不改变使用顺序）"""
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """获取条目并标记为最近使用，不存在时返回 default"""
+        with self._lock:
+            item = self._entries.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """获取条目（不计入命中统计，不改变使用顺序）"""
+        item = self._entries.get(key, _MISSING)
+        return default if item is _MISSING else item[0]
+
+    def put(self, key: Hashable, value: Any):
+        """写入条目，超过内存上限时淘汰最久未使用的条目"""
+        size = self.sizeof(value)
+        with self._lock:
+            old = self._entries.pop(key, _MISSING)
+            if old is not _MISSING:
+                self.nbytes -= old[1]
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            self._evict()
+
+    def resize(self, key: Hashable):
+        """条目内容增长后（如追加了指标序列）重新计算其大小"""
+        with self._lock:
+            item = self._entries.get(key, _MISSING)
+            if item is _MISSING:
+                return
+            size = self.sizeof(item[0])
+            self.nbytes += size - item[1]
+            self._entries[key] = (item[0], size)
+            self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._entries.pop(key, _MISSING)
+            if item is _MISSING:
+                return default
+            self.nbytes -= item[1]
+            return item[0]
+
+    def clear(self):
+        """清空条目（保留统计计数）"""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def reset_stats(self):
+        self.hits = self.misses = self.evictions = 0
+
+    def set_max_bytes(self, max_bytes: Optional[int]):
+        """修改内存上限，超出部分立即淘汰"""
+        with self._lock:
+            self.max_bytes = max_bytes or None
+            self._evict()
+
+    def _evict(self):
+        # 至少保留最近写入的一个条目
+        if self.max_bytes is None:
+            return
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.nbytes -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计：条目数、占用大小、上限（不限制时为 None）、命中/未命中/淘汰次数和命中率"""
+        lookups = self.hits + self.misses
+        return {
+            'name': self.name,
+            'entries': len(self._entries),
+            'size_mb': round(self.nbytes / 2 ** 20, 2),
+            'max_mb': round(self.max_bytes / 2 ** 20, 3) if self.max_bytes else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def freeze_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """复制为各列都是只读 NumPy 数组的 DataFrame，作为缓存中共享的只读数据
+
+    命中缓存时用 frame.copy(deep=False) 返回（不复制数据）：调用方修改数值时 pandas 2.x
+    抛出 ValueError（assignment destination is read-only），pandas 3 的写时复制只修改调用方
+    自己的副本；增删列只影响调用方的 DataFrame 对象，缓存数据不会被改动。
+
+    列名重复或包含扩展类型列（category、string 等）时无法逐列冻结，返回普通的深复制。
+    """
+    if not df.columns.is_unique or not all(isinstance(dtype, np.dtype) for dtype in df.dtypes):
+        return df.copy()
+    columns = {}
+    for col in df.columns:
+        values = np.array(df[col].to_numpy(), copy=True)
+        values.flags.writeable = False
+        columns[col] = values
+    frozen = pd.DataFrame(columns, index=df.index, copy=False)
+    frozen.columns = df.columns
+    return frozen
+
+
+_caches: List[LRUCache] = []
+
+
+def configure_caches(max_mb: Optional[float] = None, reset_stats: bool = True):
+    """设置所有已登记缓存的内存上限
+
+    Args:
+        max_mb: 每个缓存的内存上限（MB），None 表示 DEFAULT_CACHE_MAX_MB，0 表示不限制
+        reset_stats: 是否同时清零统计计数（每次回测开始时清零）
+    """
+    if max_mb is None:
+        max_mb = DEFAULT_CACHE_MAX_MB
+    max_bytes = int(max_mb * 2 ** 20) if max_mb else None
+    for cache in _caches:
+        cache.set_max_bytes(max_bytes)
+        if reset_stats:
+            cache.reset_stats()
+
+
+def cache_stats() -> List[Dict[str, Any]]:
+    """所有已登记缓存的统计，每个缓存一项"""
+    return [cache.stats() for cache in _caches]
+
+
+def format_cache_stats() -> List[str]:
+    """每个缓存一行的统计文字，用于输出到日志"""
+    lines = []
+    for s in cache_stats():
+        limit = f"{s['max_mb']}MB" if s['max_mb'] is not None else "不限"
+        lines.append(f"{s['name']}: {s['entries']}条，{s['size_mb']}MB/{limit}，"
+                     f"命中 {s['hits']}，未命中 {s['misses']}（命中率 {s['hit_rate']:.2%}），淘汰 {s['evictions']}")
+    return lines
@@ -0,0 +1,58 @@
+# coding: utf-8
+"""
+回测断点 - 长时间回测定期保存进度，异常中断后可从最近的断点继续
+
+断点文件保存在回测结果目录中，写入时先写临时文件再原子替换，
+中途崩溃不会留下损坏的断点。断点内容：
+    - 回测循环的游标（数据段、段内位置、已处理的迭代时间点数、当前日期）
+    - 每个策略的交易管理器资产、持仓、委托和成交
+    - 回测记录和结果写入器的状态
+    - 策略状态（策略实现了 khSaveState / khLoadState 时）
+"""
+
+import os
+import pickle
+from typing import Any, Dict, Optional
+
+CHECKPOINT_FILE = "checkpoint.pkl"
+CHECKPOINT_VERSION = 3
+
+
+def checkpoint_path(backtest_dir: str) -> str:
+    return os.path.join(backtest_dir, CHECKPOINT_FILE)
+
+
+def save_checkpoint(path: str, state: Dict[str, Any]):
+    """原子写入断点文件
+
+    Args:
+        path: 断点文件路径
+        state: 断点内容（必须可以被 pickle 序列化）
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'version': CHECKPOINT_VERSION, **state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str) -> Optional[Dict[str, Any]]:
+    """读取断点文件
+
+    Returns:
+        Optional[Dict[str, Any]]: 断点内容，文件不存在或版本不一致时返回 None
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    if not isinstance(state, dict) or state.get('version') != CHECKPOINT_VERSION:
+        return None
+    return state
+
+
+def remove_checkpoint(path: str):
+    for p in (path, f"{path}.tmp"):
+        if os.path.exists(p):
+            os.remove(p)
@@ -23,6 +23,11 @@ class KhConfig:
         self.userdata_path = self.config_dict.get("system", {}).get("userdata_path", "")
         self.session_id = self.config_dict.get("system", {}).get("session_id", int(time.time()))
         self.check_interval = self.config_dict.get("system", {}).get("check_interval", 3)
+        # 每个内存缓存（khHistory 数据、Mootdx 原始数据等）的上限，单位 MB，0 表示不限制，未设置时使用默认值
+        self.cache_max_mb = self.config_dict.get("system", {}).get("cache_max_mb")
+        # 磁盘历史数据缓存（跨回测、跨进程复用行情数据），默认关闭，目录默认为 data/history_cache
+        self.disk_cache = self.config_dict.get("system", {}).get("disk_cache", False)
+        self.disk_cache_dir = self.config_dict.get("system", {}).get("disk_cache_dir", "")
         
         # 账户配置，设置默认值
         account_config = self.config_dict.get("account", {})
@@ -67,6 +72,9 @@ class KhConfig:
         self.mootdx_mode = provider_specific_config.get("mode", "online")  # online 或 offline
         self.mootdx_tdxdir = provider_specific_config.get("tdxdir", "")  # 通达信目录
         self.mootdx_use_cache = provider_specific_config.get("use_cache", True)
+        # 在线模式的行情服务器列表（"主机:端口"）和连接数，K线按连接数并发获取；未设置时使用 mootdx 默认服务器和 4 个连接
+        self.mootdx_servers = provider_specific_config.get("servers", [])
+        self.mootdx_pool_size = provider_specific_config.get("pool_size")
         self.use_xtquant_for_adjust = provider_specific_config.get("use_xtquant_for_adjust", True)  # 复权数据是否用 xtquant
         
     @property
@@ -10,15 +10,26 @@
 
 from abc import ABC, abstractmethod
 from typing import Dict, List, Optional, Union
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import logging
 import time
 
+from khCache import LRUCache, freeze_frame
+from khMootdxPool import MootdxConnectionPool
+
 logger = logging.getLogger(__name__)
 
-# Mootdx原始数据缓存 (模块级)
-_mootdx_raw_cache = {}
+# Mootdx原始数据缓存 (模块级)，超过内存上限（配置 system.cache_max_mb）时淘汰最久未使用的数据
+_mootdx_raw_cache = LRUCache("Mootdx原始数据")
+
+# Mootdx 单次请求最多返回的K线数，更长的范围按 start 分页获取
+MOOTDX_MAX_BARS = 800
+# 相邻两页重叠的K线数：分页请求之间产生新K线时各页整体后移，重叠部分保证拼接后不缺K线
+_MOOTDX_PAGE_OVERLAP = 10
+# 各周期（mootdx frequency）每个交易日的K线数，用于估计覆盖开始日期需要的页数
+_MOOTDX_BARS_PER_DAY = {7: 240, 0: 48, 1: 16, 2: 8, 3: 4, 9: 1, 5: 0.2, 6: 0.05}
 
 
 # ============================================================================
@@ -148,6 +159,64 @@ class DataProviderInterface(ABC):
         """
         pass
 
+    def get_last_ex_dates(self, stock_list: List[str], **kwargs) -> Dict[str, Optional[str]]:
+        """获取每只股票截至今天最近一次除权除息的日期
+
+        前复权数据在每次除权后整段变化，磁盘缓存据此判断缓存的前复权数据是否仍然有效。
+
+        Args:
+            stock_list: 股票代码列表
+
+        Returns:
+            Dict[str, Optional[str]]: {股票代码: 日期（YYYYMMDD）}，没有除权记录时为 ''，
+                无法获取（数据源不支持或请求失败）时为 None
+        """
+        return {code: None for code in stock_list}
+
+
+class DelegatingDataProvider(DataProviderInterface):
+    """把接口调用转发给内部数据提供者的基类（参数扫描的记录/回放、磁盘缓存等包装使用）"""
+
+    def __init__(self, inner: Optional[DataProviderInterface]):
+        self._inner = inner
+
+    @property
+    def inner(self) -> DataProviderInterface:
+        return self._inner
+
+    def download_history_data(self, stock_code, period='1d', start_time='', end_time='', **kwargs) -> bool:
+        return self.inner.download_history_data(stock_code, period, start_time, end_time, **kwargs)
+
+    def get_market_data(self, field_list, stock_list, period='1d', start_time='', end_time='',
+                        count=-1, dividend_type='none', **kwargs) -> Dict[str, pd.DataFrame]:
+        return self.inner.get_market_data(field_list, stock_list, period, start_time, end_time,
+                                          count, dividend_type, **kwargs)
+
+    def get_stock_list_in_sector(self, sector_name, **kwargs) -> List[str]:
+        return self.inner.get_stock_list_in_sector(sector_name, **kwargs)
+
+    def get_stock_list(self, market='stock', **kwargs) -> List[str]:
+        return self.inner.get_stock_list(market, **kwargs)
+
+    def normalize_stock_code(self, code: str) -> str:
+        return self.inner.normalize_stock_code(code)
+
+    def get_sector_list(self, **kwargs) -> List[str]:
+        return self.inner.get_sector_list(**kwargs)
+
+    def download_sector_data(self, **kwargs) -> bool:
+        return self.inner.download_sector_data(**kwargs)
+
+    def get_instrument_detail(self, stock_code, **kwargs) -> Optional[Dict]:
+        return self.inner.get_instrument_detail(stock_code, **kwargs)
+
+    def get_last_ex_dates(self, stock_list, **kwargs) -> Dict[str, Optional[str]]:
+        return self.inner.get_last_ex_dates(stock_list, **kwargs)
+
+    def __getattr__(self, name):
+        # 转发适配器特有的方法（如 clear_mootdx_cache）
+        return getattr(self.inner, name)
+
 
 # ============================================================================
 # XtQuant 适配器
@@ -273,6 +342,20 @@ class XtQuantAdapter(DataProviderInterface):
             logger.error(f"获取证券详情失败 {stock_code}: {e}")
             return None
 
+    def get_last_ex_dates(self, stock_list: List[str], **kwargs) -> Dict[str, Optional[str]]:
+        """从本地除权数据（get_divid_factors，索引为除权日期）获取最近一次除权除息日期"""
+        today = datetime.now().strftime('%Y%m%d')
+        result = {}
+        for code in stock_list:
+            try:
+                factors = self.xtdata.get_divid_factors(code)
+                dates = [str(d)[:8] for d in (factors.index if factors is not None else [])]
+                result[code] = max((d for d in dates if d <= today), default='')
+            except Exception as e:
+                logger.warning(f"获取除权数据失败 {code}: {e}")
+                result[code] = None
+        return result
+
     def normalize_stock_code(self, code: str) -> str:
         """XtQuant 使用 '代码.市场' 格式 (如 '600036.SH')"""
         if '.' in code:
@@ -294,12 +377,16 @@ class XtQuantAdapter(DataProviderInterface):
 class MootdxAdapter(DataProviderInterface):
     """Mootdx (通达信) 数据适配器"""
 
-    def __init__(self, mode: str = 'online', tdxdir: str = None):
+    def __init__(self, mode: str = 'online', tdxdir: str = None, servers: Optional[List] = None,
+                 pool_size: Optional[int] = None, client_factory=None):
         """初始化 Mootdx 适配器
 
         Args:
             mode: 模式 ('online' 在线, 'offline' 离线)
             tdxdir: 通达信数据目录（离线模式必需）
+            servers: 在线模式的行情服务器列表（"主机:端口"），为空时使用 mootdx 默认服务器
+            pool_size: 在线模式的连接数，多只股票的K线并发获取，None 表示默认值（4）
+            client_factory: 创建客户端的函数 client_factory(server)，默认使用 Quotes.factory
         """
         try:
             from mootdx.quotes import Quotes
@@ -311,14 +398,10 @@ class MootdxAdapter(DataProviderInterface):
             self.MARKET_SZ = MARKET_SZ
 
             if mode == 'online':
-                self.client = Quotes.factory(
-                    market='std',
-                    multithread=True,
-                    heartbeat=True,
-                    bestip=False,  # 关闭最优IP选择以提高速度
-                    timeout=15
-                )
-                logger.info("Mootdx 在线模式初始化成功")
+                # K线请求通过连接池并发获取；板块、股票列表等其他请求使用单独的客户端
+                self.pool = MootdxConnectionPool(servers, size=pool_size, client_factory=client_factory)
+                self.client = self.pool.client_factory(self.pool.health[0].server)
+                logger.info(f"Mootdx 在线模式初始化成功（{len(self.pool.health)}个服务器，{self.pool.size}个连接）")
             else:
                 if not tdxdir:
                     raise ValueError("离线模式需要指定 tdxdir 参数")
@@ -329,51 +412,157 @@ class MootdxAdapter(DataProviderInterface):
             logger.error(f"Mootdx 导入失败: {e}")
             raise RuntimeError("请先安装 mootdx: pip install mootdx")
 
-    def _call_mootdx_with_retry(self, is_index, clean_code, frequency, offset, adjust=None, max_retries=3):
-        """带缓存和重试的Mootdx调用"""
+    def _call_mootdx_with_retry(self, is_index, clean_code, frequency, offset, adjust=None, start=0):
+        """带缓存和重试的Mootdx调用（通过连接池，可在多个线程中同时调用）
+
+        start 为跳过的最新K线数，offset 为获取的K线数（不超过 MOOTDX_MAX_BARS）
+        """
         # 生成缓存键
-        cache_key = (clean_code, frequency, offset, adjust, is_index)
+        cache_key = (clean_code, frequency, offset, adjust, is_index, start)
 
-        # 检查缓存
-        global _mootdx_raw_cache
-        if cache_key in _mootdx_raw_cache:
+        # 检查缓存：缓存的是只读数据，浅复制后返回（不复制数据，修改数值会报错而不会改动缓存）
+        cached = _mootdx_raw_cache.get(cache_key)
+        if cached is not None:
             # logger.info(f"✅ [Mootdx缓存命中] {clean_code}")
-            return _mootdx_raw_cache[cache_key].copy()
+            return cached.copy(deep=False)
 
-        # 缓存未命中,网络请求 (带重试)
+        # 缓存未命中,网络请求 (连接池负责重试和切换服务器)
         logger.info(f"❌ [Mootdx缓存未命中] {clean_code}, 开始网络请求...")
 
-        for attempt in range(max_retries):
-            try:
-                start_time = time.time()
+        try:
+            start_time = time.time()
 
-                if is_index:
-                    df = self.client.index_bars(symbol=clean_code, frequency=frequency, offset=offset)
-                else:
-                    df = self.client.bars(symbol=clean_code, frequency=frequency, offset=offset, adjust=adjust)
+            if is_index:
+                df = self.pool.call('index_bars', symbol=clean_code, frequency=frequency, start=start, offset=offset)
+            else:
+                df = self.pool.call('bars', symbol=clean_code, frequency=frequency, start=start, offset=offset,
+                                    adjust=adjust)
 
-                elapsed = time.time() - start_time
+            elapsed = time.time() - start_time
 
-                if df is not None and not df.empty:
-                    _mootdx_raw_cache[cache_key] = df.copy()
-                    logger.info(f"💾 [Mootdx缓存已更新] {clean_code}, shape={df.shape}, 耗时={elapsed:.2f}秒")
-                    return df
-                elif df is not None:
-                    logger.warning(f"⚠️ [Mootdx返回空数据] {clean_code}")
-                    return df
+            if df is not None and not df.empty:
+                df = freeze_frame(df)
+                _mootdx_raw_cache.put(cache_key, df)
+                logger.info(f"💾 [Mootdx缓存已更新] {clean_code}, shape={df.shape}, 耗时={elapsed:.2f}秒")
+                return df.copy(deep=False)
+            elif df is not None:
+                logger.warning(f"⚠️ [Mootdx返回空数据] {clean_code}")
+                return df
 
-            except Exception as e:
-                logger.warning(f"Mootdx调用失败 (尝试{attempt+1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(2 ** attempt)  # 指数退避
+        except Exception as e:
+            logger.warning(f"Mootdx调用失败: {e}")
 
         logger.error(f"❌ [Mootdx调用最终失败] {clean_code}")
         return None
 
+    def _fetch_bars_paged(self, stock_list: List[str], frequency: int, adjust: str,
+                          count: int, start_time: str) -> Dict[str, Optional[pd.DataFrame]]:
+        """获取多只股票的K线，超过 MOOTDX_MAX_BARS 根时按 start 分页，各页通过连接池并发获取
+
+        count > 0 时获取最近 count 根K线；否则有 start_time 时一直获取到覆盖开始日期为止
+        （先取第一页，按其最早时间估计剩余页数后一次并发获取，仍不够时逐页补取），
+        都没有时只取最近一页。历史数据不足一页或某页获取失败时停止。
+
+        各页都按不复权获取（缓存的也是不复权的原始分页），拼接去重后再对整段数据复权一次：
+        mootdx 对每页单独复权时只使用该页日期范围内的复权因子，较早一页中最后一个除权日之后的
+        K线会保持不复权的价格。
+
+        Args:
+            adjust: 复权方式，'qfq' 前复权、'hfq' 后复权、'' 不复权（指数不复权）
+
+        Returns:
+            Dict[str, Optional[pd.DataFrame]]: {股票代码: 按时间升序、去除重复K线后的数据}，失败时为 None
+        """
+        step = MOOTDX_MAX_BARS - _MOOTDX_PAGE_OVERLAP
+        start_dt = pd.to_datetime(start_time, format='%Y%m%d') if count <= 0 and start_time else None
+        daily = frequency in (9, 5, 6)   # 日线、周线、月线
+        pages = {code: {} for code in stock_list}    # {股票代码: {页号: DataFrame 或 None}}
+
+        def page_offset(page):
+            if count > 0:
+                return min(MOOTDX_MAX_BARS, count - page * step)
+            return MOOTDX_MAX_BARS
+
+        def fetch_page(task):
+            code, page = task
+            return self._call_mootdx_with_retry(
+                is_index=self._is_index(code),
+                clean_code=self._clean_code(code),
+                frequency=frequency,
+                offset=page_offset(page),
+                adjust='',
+                start=page * step
+            )
+
+        if count > 0:
+            total_pages = 1 if count <= MOOTDX_MAX_BARS else 1 + -(-(count - MOOTDX_MAX_BARS) // step)
+            tasks = [(code, page) for code in stock_list for page in range(total_pages)]
+        else:
+            tasks = [(code, 0) for code in stock_list]
+
+        while tasks:
+            for (code, page), df in zip(tasks, self.pool.map(fetch_page, tasks)):
+                pages[code][page] = df
+            tasks = []
+            if start_dt is None:
+                break
+            for code in stock_list:
+                fetched = pages[code]
+                last = max(fetched)
+                df = fetched[last]
+                if df is None or len(df) < page_offset(last) or not isinstance(df.index, pd.DatetimeIndex):
+                    continue  # 获取失败或历史数据已取完
+                oldest = df.index.min()
+                # 分钟K线需要取到开始日期之前的K线，才能确定开始日期当天的K线都已取到
+                if oldest < start_dt or (daily and oldest.normalize() <= start_dt):
+                    continue
+                if len(fetched) == 1:
+                    # 按第一页的最早时间估计还需要的页数（按工作日计算，节假日使估计略偏多）
+                    days = np.busday_count(start_dt.date(), oldest.date()) + 1
+                    remaining = -(-int(days * _MOOTDX_BARS_PER_DAY.get(frequency, 1)) // step)
+                    tasks.extend((code, page) for page in range(1, 1 + max(1, remaining)))
+                else:
+                    tasks.append((code, last + 1))
+
+        result = {}
+        for code in stock_list:
+            fetched = pages[code]
+            frames = [fetched[page] for page in sorted(fetched, reverse=True)
+                      if fetched[page] is not None and not fetched[page].empty]
+            if any(fetched[page] is None for page in fetched if page > 0):
+                logger.warning(f"{code} 部分分页数据获取失败，数据可能不完整")
+            if not frames:
+                result[code] = fetched.get(0)
+            elif len(frames) == 1:
+                result[code] = frames[0]
+            else:
+                # 各页从旧到新拼接，重叠部分按时间去重（保留较新一页的数据）
+                combined = pd.concat(frames)
+                if isinstance(combined.index, pd.DatetimeIndex):
+                    combined = combined[~combined.index.duplicated(keep='last')].sort_index()
+                logger.info(f"{code} 分{len(frames)}页获取，共{len(combined)}条")
+                result[code] = combined
+
+        if adjust:
+            codes = [code for code in stock_list
+                     if not self._is_index(code) and result[code] is not None and not result[code].empty]
+            for code, df in zip(codes, self.pool.map(lambda code: self._adjust_bars(code, result[code], adjust),
+                                                     codes)):
+                result[code] = df
+        return result
+
+    def _adjust_bars(self, code: str, df: pd.DataFrame, adjust: str) -> Optional[pd.DataFrame]:
+        """用 mootdx 的复权因子对一只股票拼接后的完整K线复权，失败时返回 None"""
+        try:
+            from mootdx.utils.adjust import to_adjust
+            return to_adjust(df.copy(), symbol=self._clean_code(code), adjust=adjust)
+        except Exception as e:
+            logger.warning(f"{code} 复权失败（{adjust}）: {e}")
+            return None
+
     @classmethod
     def clear_mootdx_cache(cls):
         """清理缓存"""
-        global _mootdx_raw_cache
         count = len(_mootdx_raw_cache)
         _mootdx_raw_cache.clear()
         logger.info(f"已清理Mootdx缓存, 释放{count}条记录")
@@ -429,26 +618,18 @@ class MootdxAdapter(DataProviderInterface):
             }
             adjust = adjust_map.get(dividend_type, '')
 
-            # 计算需要获取的数量
-            offset = min(count if count > 0 else 800, 800)
+            # 在线模式一次获取所有股票的K线（超过单次上限时自动分页），各股票和各页并发请求
+            if self.mode == 'online':
+                raw_frames = self._fetch_bars_paged(stock_list, frequency, adjust, count, start_time)
 
-            for code in stock_list:
+            def fetch(code):
+                """标准化并按时间范围筛选一只股票的数据，失败时返回 None"""
                 clean_code = self._clean_code(code)
                 is_index = self._is_index(code)
-                logger.debug(f"正在获取 {code} ({clean_code}) 的数据, period={period}, frequency={frequency}, offset={offset}, is_index={is_index}")
+                logger.debug(f"正在获取 {code} ({clean_code}) 的数据, period={period}, frequency={frequency}, count={count}, is_index={is_index}")
 
                 if self.mode == 'online':
-                    # 在线模式 (使用带缓存的调用)
-                    df = self._call_mootdx_with_retry(
-                        is_index=is_index,
-                        clean_code=clean_code,
-                        frequency=frequency,
-                        offset=offset,
-                        adjust=adjust
-                    )
-                    # 移除冗余DEBUG日志
-                    # if df is not None and hasattr(df, 'shape'):
-                    #     logger.debug(f"Mootdx返回: shape={df.shape}")
+                    df = raw_frames.get(code)
                 else:
                     # 离线模式
                     if period == '1d':
@@ -457,7 +638,7 @@ class MootdxAdapter(DataProviderInterface):
                         df = self.reader.minute(symbol=clean_code)
                     else:
                         logger.warning(f"离线模式不支持周期: {period}")
-                        continue
+                        return None
 
                 if df is not None and not df.empty:
                     # 重命名列以匹配 xtquant 格式
@@ -473,12 +654,17 @@ class MootdxAdapter(DataProviderInterface):
                     if not df.empty:
                         # ✅ 性能优化：直接返回DataFrame格式，与XtQuant保持一致
                         # 不再转换为Dict格式，避免回测循环中的重复转化
-                        result[code] = df
                         logger.info(f"成功添加 {code} 数据到结果集 (DataFrame格式，{len(df)}行)")
-                    else:
-                        logger.warning(f"标准化后 {code} 数据为空")
+                        return df
+                    logger.warning(f"标准化后 {code} 数据为空")
                 else:
                     logger.warning(f"{code} 原始数据为空或None")
+                return None
+
+            for code in stock_list:
+                df = fetch(code)
+                if df is not None:
+                    result[code] = df
 
             return result
 
@@ -555,6 +741,28 @@ class MootdxAdapter(DataProviderInterface):
             logger.error(f"获取证券详情失败 {stock_code}: {e}")
             return None
 
+    def get_last_ex_dates(self, stock_list: List[str], **kwargs) -> Dict[str, Optional[str]]:
+        """通过连接池并发获取除权除息信息（xdxr），取截至今天最近一条记录的日期；指数没有除权，离线模式不支持"""
+        if self.mode != 'online':
+            return {code: None for code in stock_list}
+        today = datetime.now().strftime('%Y%m%d')
+
+        def last_ex_date(code):
+            if self._is_index(code):
+                return ''
+            try:
+                xdxr = self.pool.call('xdxr', symbol=self._clean_code(code))
+            except Exception as e:
+                logger.warning(f"获取除权数据失败 {code}: {e}")
+                return None
+            if xdxr is None or len(xdxr) == 0:
+                return ''
+            dates = (xdxr['year'].astype(int) * 10000 + xdxr['month'].astype(int) * 100
+                     + xdxr['day'].astype(int)).astype(str)
+            return max((d for d in dates if d <= today), default='')
+
+        return dict(zip(stock_list, self.pool.map(last_ex_date, stock_list)))
+
     def normalize_stock_code(self, code: str) -> str:
         """Mootdx 转换为 xtquant 格式 (添加市场后缀)"""
         # 去除已有后缀
@@ -605,7 +813,13 @@ class MootdxAdapter(DataProviderInterface):
 
         # 只保留需要的字段（不包括 time，因为它在索引中）
         available_fields = [f for f in field_list if f in df.columns]
-        return df[available_fields] if available_fields else df
+        if not available_fields:
+            return df
+        if (len(set(available_fields)) != len(available_fields) or not df.columns.is_unique
+                or not all(isinstance(df[f].dtype, np.dtype) for f in available_fields)):
+            return df[available_fields]
+        # 逐列取数组组装，不复制数据（缓存中的只读数据仍保持只读）
+        return pd.DataFrame({f: df[f].to_numpy() for f in available_fields}, index=df.index, copy=False)
 
     def _filter_by_time_range(self, df: pd.DataFrame, start_time: str, end_time: str) -> pd.DataFrame:
         """按时间范围筛选数据
@@ -633,8 +847,15 @@ class MootdxAdapter(DataProviderInterface):
                 logger.debug(f"请求筛选范围: {start_dt} ~ {end_dt}")
 
             # 筛选数据（包含起止日期）
-            mask = (df.index.date >= start_dt.date()) & (df.index.date <= end_dt.date())
-            filtered_df = df[mask]
+            index = df.index
+            if index.tz is None and not index.hasnans and index.is_monotonic_increasing:
+                # 时间已排序时二分查找起止位置并切片，返回视图而不复制数据
+                lo = index.searchsorted(start_dt.normalize(), side='left')
+                hi = index.searchsorted(end_dt.normalize() + pd.Timedelta(days=1), side='left')
+                filtered_df = df.iloc[lo:hi]
+            else:
+                mask = (index.date >= start_dt.date()) & (index.date <= end_dt.date())
+                filtered_df = df[mask]
 
             logger.info(f"时间筛选: {start_time} ~ {end_time}, 原始{len(df)}条 -> 筛选后{len(filtered_df)}条")
             return filtered_df
@@ -696,6 +917,9 @@ class DataProviderFactory:
             **kwargs: 初始化参数
                 - mode: Mootdx 模式 ('online', 'offline')
                 - tdxdir: 通达信目录 (Mootdx 离线模式必需)
+                - servers: Mootdx 在线模式的服务器列表 ("主机:端口")
+                - pool_size: Mootdx 在线模式的连接数
+                - client_factory: 创建 Mootdx 客户端的函数 client_factory(server)
 
         Returns:
             DataProviderInterface: 数据提供者实例
@@ -727,7 +951,10 @@ class DataProviderFactory:
         elif provider_type.lower() == 'mootdx':
             mode = kwargs.get('mode', 'online')
             tdxdir = kwargs.get('tdxdir', None)
-            cls._provider = MootdxAdapter(mode=mode, tdxdir=tdxdir)
+            cls._provider = MootdxAdapter(mode=mode, tdxdir=tdxdir,
+                                          servers=kwargs.get('servers'),
+                                          pool_size=kwargs.get('pool_size'),
+                                          client_factory=kwargs.get('client_factory'))
         else:
             raise ValueError(f"不支持的数据提供者类型: {provider_type}")
 
@@ -0,0 +1,417 @@
+# coding: utf-8
+"""
+磁盘历史数据缓存 - 按 (股票代码, 周期, 复权方式) 把行情数据保存为内存映射的列式文件，跨回测、跨进程复用
+
+目录结构（默认 data/history_cache，由 .kh 配置 system.disk_cache_dir 修改）：
+    <周期>/<复权方式>/<股票代码>/meta.json         数据范围、获取日期、最后时间戳、列名和类型
+    <周期>/<复权方式>/<股票代码>/data-<版本>.bin    索引和各列数据依次排列（按 64 字节对齐）
+
+读取时整个数据文件只做一次只读内存映射，各列都是映射上的只读视图，多个进程同时读取同一文件
+共享操作系统的页缓存。写入时先写新版本的数据文件，再原子替换 meta.json，读取方看到的
+总是完整的某一个版本；旧版本文件在之后的写入中删除（删除失败时忽略，下次写入时再清理）。
+任何读取失败都按未命中处理，回退到真实的数据提供者。
+
+缓存条目在以下范围内有效：
+    - 开始日期不早于缓存的开始日期；
+    - 结束日期（不晚于当天）不晚于缓存的完整日期：获取时请求的结束日期和获取时已收盘的最后一天中
+      较早的一个；收盘（15:30）前获取时当天的行情还不完整，只有之前的日期视为完整；
+    - 请求的字段都已获取过（数据源不提供的字段也记录在 meta.json 中，不会反复请求）。
+不满足时重新获取该股票的数据并覆盖缓存，因此只要完整日期之后有新的行情，就会自动更新。
+
+前复权（front、front_ratio）数据在每次除权后整段变化，缓存条目同时记录获取时该股票最近一次除权除息的
+日期（数据提供者的 get_last_ex_dates）：当天获取的条目直接使用，之前获取的条目在最近除权日期不变时使用，
+有新的除权或无法获取除权日期时重新获取。除权日期在每个进程中每天只查询一次。
+其他复权方式下已缓存日期范围内的数据不会再次获取，需要时删除缓存目录或调用 DiskHistoryCache.clear()。
+
+只缓存按日期范围（YYYYMMDD）获取的请求，按条数（count）获取、时间格式不同或数据类型
+无法保存（如对象列）的请求直接转发给真实的数据提供者。
+
+默认关闭，.kh 配置 system.disk_cache 为 true 时启用。
+"""
+
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from khDataProvider import DataProviderInterface, DelegatingDataProvider
+
+DISK_CACHE_DIR = os.path.join("data", "history_cache")
+# 版本 2：mootdx 超过 800 根K线时分页获取，版本 1 中可能被截断的数据重新获取
+# 版本 3：获取时间精确到秒，版本 2 中收盘前获取的当天不完整数据重新获取
+DISK_CACHE_VERSION = 3
+DISK_CACHE_META_FILE = "meta.json"
+
+# 数据文件中每个数组的对齐字节数
+_ALIGNMENT = 64
+# 读取时数据文件恰好被其他进程替换，重新读取 meta.json 的次数
+_LOAD_ATTEMPTS = 3
+# 未被 meta.json 引用的旧数据文件超过该时间（秒）后删除
+_STALE_SECONDS = 60
+# xtquant 的 time 列是 UTC 毫秒时间戳，换算为北京时间的日期
+_BEIJING_OFFSET_MS = 8 * 3600 * 1000
+# 当天行情完整的时间（含科创板、创业板盘后固定价格交易），之前获取的当天数据可能不完整
+_DAY_COMPLETE_TIME = "153000"
+# 除权后历史价格整段变化的复权方式，缓存条目按最近一次除权日期判断是否有效
+_FRONT_DIVIDEND_TYPES = ('front', 'front_ratio')
+
+logger = logging.getLogger(__name__)
+
+
+def _is_date(value: Any) -> bool:
+    return isinstance(value, str) and len(value) == 8 and value.isdigit()
+
+
+def _encode_array(values: np.ndarray) -> Optional[Tuple[np.ndarray, bool]]:
+    """转换为可写入数据文件的定长数组，返回 (数组, 是否为字符串列)，无法保存时返回 None"""
+    if not isinstance(values, np.ndarray):
+        return None
+    if values.dtype.kind in 'biufmM':
+        return np.ascontiguousarray(values), False
+    if values.dtype.kind == 'O' and all(isinstance(v, str) for v in values):
+        return np.array(values, dtype=str) if len(values) else np.array([], dtype='U1'), True
+    return None
+
+
+def _complete_date(fetched: str) -> str:
+    """获取数据时行情已经完整的最后一天（YYYYMMDD）
+
+    收盘后或周末获取时为获取当天，否则为前一天。
+    """
+    day, _, clock = fetched.partition(' ')
+    date = datetime.strptime(day, '%Y%m%d')
+    if clock >= _DAY_COMPLETE_TIME or date.weekday() >= 5:
+        return day
+    return (date - timedelta(days=1)).strftime('%Y%m%d')
+
+
+def _row_dates(frame: pd.DataFrame) -> Optional[np.ndarray]:
+    """每行数据的日期（datetime64[D]），无法确定时返回 None"""
+    if isinstance(frame.index, pd.DatetimeIndex):
+        if frame.index.tz is not None:
+            return None
+        return frame.index.values.astype('datetime64[D]')
+    if 'time' in frame.columns and frame['time'].dtype.kind in 'iuf':
+        ms = frame['time'].to_numpy()
+        if ms.dtype.kind == 'f' and np.isnan(ms).any():
+            return None
+        return (ms.astype(np.int64) + _BEIJING_OFFSET_MS).astype('datetime64[ms]').astype('datetime64[D]')
+    return None
+
+
+class HistoryEntry:
+    """一只股票某个周期、复权方式的缓存数据
+
+    Args:
+        frame: 行情数据（索引为时间或包含 time 列）
+        dates: 每行数据的日期
+        start_time: 获取数据时请求的开始日期，'' 表示从最早的数据开始
+        end_time: 获取数据时请求的结束日期
+        fetched: 获取数据的时间（YYYYMMDD HHMMSS）
+        requested_fields: 获取数据时请求的字段（数据源不提供的字段不在 frame 中，也视为已获取）
+        ex_date: 前复权数据获取时最近一次除权除息的日期（YYYYMMDD，没有除权记录时为 ''），其他复权方式为 None
+    """
+
+    __slots__ = ('frame', 'dates', 'start_time', 'end_time', 'fetched', 'requested_fields', 'fields', 'ex_date')
+
+    def __init__(self, frame: pd.DataFrame, dates: np.ndarray, start_time: str, end_time: str, fetched: str,
+                 requested_fields: List[str], ex_date: Optional[str] = None):
+        self.frame = frame
+        self.dates = dates
+        self.start_time = start_time
+        self.end_time = end_time
+        self.fetched = fetched
+        self.requested_fields = list(requested_fields)
+        self.fields = set(frame.columns)
+        self.ex_date = ex_date
+
+    @property
+    def last_date(self) -> str:
+        if len(self.dates) == 0:
+            return ''
+        return str(self.dates.max()).replace('-', '')
+
+    def covers(self, fields: List[str], start_time: str, end_time: str, today: str) -> bool:
+        """是否包含 [start_time, end_time] 范围内 fields 字段的全部数据"""
+        if self.start_time > start_time or not self.fields.union(self.requested_fields).issuperset(fields):
+            return False
+        complete_end = min(self.end_time, _complete_date(self.fetched))
+        return min(end_time, today) <= complete_end
+
+    def select(self, fields: List[str], start_time: str, end_time: str) -> pd.DataFrame:
+        """取出 [start_time, end_time] 范围内的 fields 字段（包含 time 列时 time 列在最前）
+
+        日期有序时按位置切片，各列都是缓存数据的只读视图。
+        """
+        frame = self.frame
+        columns = (['time'] if 'time' in self.fields else []) + [f for f in fields if f in self.fields]
+        lo_date, hi_date = np.datetime64(pd.Timestamp(start_time).date()), np.datetime64(pd.Timestamp(end_time).date())
+        dates = self.dates
+        if len(dates) > 1 and not (dates[1:] >= dates[:-1]).all():
+            mask = (dates >= lo_date) & (dates <= hi_date)
+            return frame.loc[mask, columns]
+        lo, hi = np.searchsorted(dates, lo_date, 'left'), np.searchsorted(dates, hi_date, 'right')
+        data = {col: frame[col].to_numpy()[lo:hi] for col in columns}
+        return pd.DataFrame(data, index=frame.index[lo:hi], columns=columns, copy=False)
+
+
+class DiskHistoryCache:
+    """磁盘历史数据缓存目录
+
+    Args:
+        directory: 缓存根目录，默认 DISK_CACHE_DIR
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or DISK_CACHE_DIR
+
+    def entry_dir(self, stock_code: str, period: str, dividend_type: str) -> str:
+        return os.path.join(self.directory, str(period), str(dividend_type), str(stock_code))
+
+    def load(self, stock_code: str, period: str, dividend_type: str) -> Optional[HistoryEntry]:
+        """读取缓存条目，不存在或读取失败时返回 None"""
+        path = self.entry_dir(stock_code, period, dividend_type)
+        for _ in range(_LOAD_ATTEMPTS):
+            try:
+                return self._load(path)
+            except FileNotFoundError:
+                # meta.json 不存在，或读取 meta.json 后其他进程写入了新版本并删除了旧的数据文件
+                continue
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning(f"读取磁盘缓存失败 {path}: {e}")
+                return None
+        return None
+
+    @staticmethod
+    def _load(path: str) -> Optional[HistoryEntry]:
+        with open(os.path.join(path, DISK_CACHE_META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != DISK_CACHE_VERSION:
+            return None
+        buffer = np.memmap(os.path.join(path, meta['data_file']), dtype=np.uint8, mode='r')
+        rows = meta['rows']
+
+        def read(spec):
+            dtype = np.dtype(spec['dtype'])
+            values = buffer[spec['offset']:spec['offset'] + rows * dtype.itemsize].view(dtype)
+            return values.astype(object) if spec.get('str') else values
+
+        index_spec = meta['index']
+        if index_spec['kind'] == 'range':
+            index = pd.RangeIndex(index_spec['start'], index_spec['start'] + rows * index_spec['step'],
+                                  index_spec['step'], name=index_spec['name'])
+        elif index_spec['kind'] == 'datetime':
+            index = pd.DatetimeIndex(read(index_spec), name=index_spec['name'])
+        else:
+            index = pd.Index(read(index_spec), name=index_spec['name'])
+        columns = {spec['name']: read(spec) for spec in meta['columns']}
+        frame = pd.DataFrame(columns, index=index, copy=False)
+        dates = _row_dates(frame)
+        if dates is None:
+            return None
+        return HistoryEntry(frame, dates, meta['start_time'], meta['end_time'], meta['fetched'],
+                            meta['requested_fields'], meta.get('ex_date'))
+
+    def store(self, stock_code: str, period: str, dividend_type: str, entry: HistoryEntry) -> bool:
+        """写入缓存条目（覆盖原有条目），数据类型无法保存或写入失败时返回 False"""
+        frame = entry.frame
+        if not frame.columns.is_unique or not all(isinstance(c, str) for c in frame.columns):
+            return False
+
+        arrays = []     # [(元数据, 数组)]
+        index = frame.index
+        if isinstance(index, pd.RangeIndex):
+            index_spec = {'kind': 'range', 'start': index.start, 'step': index.step}
+        else:
+            encoded = _encode_array(index.to_numpy())
+            if encoded is None:
+                return False
+            kind = 'datetime' if isinstance(index, pd.DatetimeIndex) else 'values'
+            index_spec = {'kind': kind, 'str': encoded[1]}
+            arrays.append((index_spec, encoded[0]))
+        index_spec['name'] = index.name if isinstance(index.name, str) else None
+
+        column_specs = []
+        for col in frame.columns:
+            encoded = _encode_array(frame[col].to_numpy())
+            if encoded is None:
+                return False
+            spec = {'name': col, 'str': encoded[1]}
+            column_specs.append(spec)
+            arrays.append((spec, encoded[0]))
+
+        path = self.entry_dir(stock_code, period, dividend_type)
+        version = f"{time.time_ns()}-{os.getpid()}"
+        data_file = f"data-{version}.bin"
+        try:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, data_file), 'wb') as f:
+                offset = 0
+                for spec, values in arrays:
+                    padding = -offset % _ALIGNMENT
+                    f.write(b'\0' * padding)
+                    offset += padding
+                    spec['dtype'] = values.dtype.str
+                    spec['offset'] = offset
+                    f.write(values.tobytes())
+                    offset += values.nbytes
+            meta = {
+                'version': DISK_CACHE_VERSION,
+                'stock_code': stock_code,
+                'period': period,
+                'dividend_type': dividend_type,
+                'start_time': entry.start_time,
+                'end_time': entry.end_time,
+                'fetched': entry.fetched,
+                'requested_fields': entry.requested_fields,
+                'ex_date': entry.ex_date,
+                'last_date': entry.last_date,
+                'rows': len(frame),
+                'data_file': data_file,
+                'index': index_spec,
+                'columns': column_specs,
+            }
+            tmp_meta = os.path.join(path, f"{DISK_CACHE_META_FILE}.{version}.tmp")
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_meta, os.path.join(path, DISK_CACHE_META_FILE))
+        except OSError as e:
+            logger.warning(f"写入磁盘缓存失败 {path}: {e}")
+            return False
+        self._remove_old_versions(path)
+        return True
+
+    @staticmethod
+    def _remove_old_versions(path: str):
+        # 保留 meta.json 当前引用的文件，以及其他进程可能正在写入或读取的新近文件；
+        # 其他进程仍映射着的旧文件在 Windows 下无法删除，失败时忽略
+        try:
+            with open(os.path.join(path, DISK_CACHE_META_FILE), encoding='utf-8') as f:
+                current = json.load(f).get('data_file')
+        except (OSError, ValueError):
+            return
+        expire = time.time() - _STALE_SECONDS
+        for name in os.listdir(path):
+            if not (name.startswith('data-') and name.endswith('.bin')) or name == current:
+                continue
+            file_path = os.path.join(path, name)
+            try:
+                if os.path.getmtime(file_path) < expire:
+                    os.remove(file_path)
+            except OSError:
+                pass
+
+    def clear(self):
+        """删除整个缓存目录"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class DiskCachedDataProvider(DelegatingDataProvider):
+    """优先从磁盘缓存读取历史行情的数据提供者包装
+
+    缓存未命中的股票合并为一次请求（覆盖所有未命中股票的日期范围和字段）向真实数据提供者获取，
+    获取到的数据写入磁盘缓存后按请求的日期范围和字段返回。前复权请求另外按最近除权日期判断缓存是否有效。
+
+    Args:
+        inner: 真实的数据提供者
+        cache: 磁盘缓存，默认使用 DISK_CACHE_DIR
+    """
+
+    def __init__(self, inner: DataProviderInterface, cache: Optional[DiskHistoryCache] = None):
+        super().__init__(inner)
+        self.cache = cache or DiskHistoryCache()
+        self.hits = 0
+        self.misses = 0
+        self._ex_dates = {}   # {(股票代码, 查询日期): 最近除权日期}，每个进程每天只查询一次
+
+    def _last_ex_dates(self, stock_list: List[str], today: str) -> Dict[str, Optional[str]]:
+        """最近一次除权除息的日期，无法获取的股票为 None（下次调用时重新查询）"""
+        unknown = [code for code in stock_list if (code, today) not in self._ex_dates]
+        if unknown:
+            try:
+                fetched = self.inner.get_last_ex_dates(unknown) or {}
+            except Exception as e:
+                logger.warning(f"获取除权日期失败: {e}")
+                fetched = {}
+            for code in unknown:
+                if fetched.get(code) is not None:
+                    self._ex_dates[(code, today)] = fetched[code]
+        return {code: self._ex_dates.get((code, today)) for code in stock_list}
+
+    def get_market_data(self, field_list, stock_list, period='1d', start_time='', end_time='',
+                        count=-1, dividend_type='none', **kwargs) -> Dict[str, pd.DataFrame]:
+        if (count is not None and count > 0) or not _is_date(start_time) or not _is_date(end_time):
+            return self.inner.get_market_data(field_list, stock_list, period, start_time, end_time,
+                                              count, dividend_type, **kwargs)
+
+        fields = [f for f in dict.fromkeys(field_list or []) if f != 'time']
+        now = datetime.now()
+        today = now.strftime('%Y%m%d')
+        codes = list(dict.fromkeys(stock_list or []))
+        cached = {code: self.cache.load(code, period, dividend_type) for code in codes}
+        covered = {code for code, entry in cached.items()
+                   if entry is not None and entry.covers(fields, start_time, end_time, today)}
+        ex_dates = {}
+        if dividend_type in _FRONT_DIVIDEND_TYPES:
+            # 当天获取的前复权数据直接使用，其余股票（包括需要获取的）查询最近除权日期，除权日期变化时重新获取
+            ex_dates = self._last_ex_dates(
+                [code for code in codes if code not in covered or cached[code].fetched[:8] != today], today)
+            covered -= {code for code, ex_date in ex_dates.items()
+                        if ex_date is None or cached[code] is None or cached[code].ex_date != ex_date}
+
+        entries = {}
+        missing = []
+        fetch_start, fetch_end, fetch_fields = start_time, end_time, list(fields)
+        for code in codes:
+            entry = cached[code]
+            if code in covered:
+                entries[code] = entry
+                continue
+            missing.append(code)
+            if entry is not None:
+                # 重新获取时保留缓存中已有的日期范围和字段
+                fetch_start = min(fetch_start, entry.start_time)
+                fetch_end = max(fetch_end, entry.end_time)
+                fetch_fields += [f for f in entry.requested_fields if f not in fetch_fields]
+        self.hits += len(entries)
+        self.misses += len(missing)
+
+        fetched = {}
+        if missing:
+            fetched = self.inner.get_market_data(['time'] + fetch_fields, missing, period, fetch_start, fetch_end,
+                                                 count, dividend_type, **kwargs) or {}
+        result = {}
+        for code in dict.fromkeys(stock_list or []):
+            entry = entries.get(code)
+            if entry is None:
+                df = fetched.get(code)
+                if df is None:
+                    continue
+                dates = _row_dates(df) if isinstance(df, pd.DataFrame) and len(df) else None
+                if dates is None:
+                    # 空数据或无法确定日期的数据不缓存，原样返回
+                    result[code] = df
+                    continue
+                entry = HistoryEntry(df, dates, fetch_start, fetch_end, now.strftime('%Y%m%d %H%M%S'), fetch_fields,
+                                     ex_dates.get(code))
+                if dividend_type not in _FRONT_DIVIDEND_TYPES or entry.ex_date is not None:
+                    # 无法获取除权日期的前复权数据不缓存
+                    self.cache.store(code, period, dividend_type, entry)
+            result[code] = entry.select(fields, start_time, end_time)
+        return result
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """磁盘缓存的命中和未命中股票数"""
+        lookups = self.hits + self.misses
+        return {
+            'directory': self.cache.directory,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
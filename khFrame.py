@@ -10,24 +10,47 @@ import shutil
 from types import SimpleNamespace
 import threading
 
-from xtquant import xtdata  # 保留用于实盘交易
-from xtquant.xttrader import XtQuantTrader, XtQuantTraderCallback
-from xtquant.xttype import StockAccount
-from xtquant import xtconstant
+# 未安装 xtquant 时使用 khXtCompat 提供的常量，命令行回测（mootdx）不依赖 xtquant
+from khXtCompat import xtdata, xtconstant, XtQuantTrader, XtQuantTraderCallback, StockAccount
 
 from khTrade import KhTradeManager
 from khRisk import KhRiskManager
-from khQTTools import KhQuTools, set_data_provider, get_data_provider
+from khQTTools import (
+    KhQuTools, set_data_provider, get_data_provider, clear_history_requirements,
+    collect_history_requirements, preload_history, set_aligned_timeframes
+)
 from khConfig import KhConfig
 from khDataProvider import DataProviderFactory
+from khResults import BacktestResultWriter
+from khCheckpoint import CHECKPOINT_FILE, checkpoint_path, save_checkpoint, load_checkpoint, remove_checkpoint
+from khStream import DayStreamLoader
+from khProfiler import Profiler, PROFILED_HELPERS, set_profiler, instrument_functions, restore_functions
+from khRunCache import RunCache, strategy_fingerprint, config_fingerprint, data_fingerprint, run_cache_key
+from khCache import configure_caches, format_cache_stats
+from khDiskCache import DiskCachedDataProvider, DiskHistoryCache
+from khMarketData import (
+    MarketDataPanel, BarView, TimelineMeta, DailyCloseMatrix, AlignedTimeframes, build_timeline, local_time_parts
+)
 
 import numpy as np
-from PyQt5.QtCore import Qt, QMetaObject, Q_ARG
-from PyQt5.QtWidgets import QMessageBox
+try:
+    from PyQt5.QtCore import Qt, QMetaObject, Q_ARG, QObject
+    from PyQt5.QtWidgets import QMessageBox
+except ImportError:
+    # 命令行（无界面）回测不依赖 PyQt5
+    Qt = QMetaObject = Q_ARG = QObject = QMessageBox = None
 import pandas as pd
 import os
 import holidays
 
+
+def is_qt_gui(gui) -> bool:
+    """判断回调中的界面对象是否为 Qt 对象（需要通过 QMetaObject 跨线程调用）
+    
+    命令行回测使用普通的日志接收器代替 GUI，此时直接调用其方法。
+    """
+    return QObject is not None and isinstance(gui, QObject)
+
 # 触发器基类
 class TriggerBase:
     """触发器基类，定义触发机制的通用接口"""
@@ -56,6 +79,20 @@ class TriggerBase:
         """
         return False
         
+    def plan(self, timeline: np.ndarray, meta: Optional[TimelineMeta] = None) -> np.ndarray:
+        """在回测循环开始前一次性计算触发计划
+        
+        默认逐个时间点调用 should_trigger，子类应提供向量化实现。
+        
+        Args:
+            timeline: int64 统一时间轴（秒级或毫秒级时间戳）
+            meta: 时间轴的时间元数据，为 None 时按需计算
+            
+        Returns:
+            np.ndarray: 与时间轴等长的 bool 数组，True 表示该时间点触发策略
+        """
+        return np.array([bool(self.should_trigger(t, None)) for t in timeline], dtype=bool)
+        
     def get_data_period(self):
         """获取数据周期，用于数据加载
         
@@ -81,6 +118,10 @@ class TickTrigger(TriggerBase):
         # Tick触发方式下，每个Tick都触发
         return True
         
+    def plan(self, timeline: np.ndarray, meta: Optional[TimelineMeta] = None) -> np.ndarray:
+        """Tick触发方式下，所有时间点都触发"""
+        return np.ones(len(timeline), dtype=bool)
+        
     def get_data_period(self):
         """获取数据周期
         
@@ -149,6 +190,33 @@ class KLineTrigger(TriggerBase):
             
         return False
         
+    def plan(self, timeline: np.ndarray, meta: Optional[TimelineMeta] = None) -> np.ndarray:
+        """向量化计算K线触发计划，规则与 should_trigger 一致
+        
+        Args:
+            timeline: int64 统一时间轴
+            meta: 时间轴的时间元数据，为 None 时按需计算
+            
+        Returns:
+            np.ndarray: bool 触发掩码
+        """
+        if meta is None:
+            days, seconds_of_day = local_time_parts(timeline)
+        else:
+            days, seconds_of_day = meta.day_index, meta.seconds_of_day
+        
+        if self.period == "1m":
+            return seconds_of_day % 60 == 0
+        elif self.period == "5m":
+            return seconds_of_day % 300 == 0
+        elif self.period == "1d":
+            # 每个交易日的第一个时间点触发
+            mask = np.ones(len(timeline), dtype=bool)
+            mask[1:] = days[1:] != days[:-1]
+            return mask
+            
+        return np.zeros(len(timeline), dtype=bool)
+        
     def get_data_period(self):
         """获取数据周期
         
@@ -213,6 +281,43 @@ class CustomTimeTrigger(TriggerBase):
                 
         return False
         
+    def plan(self, timeline: np.ndarray, meta: Optional[TimelineMeta] = None) -> np.ndarray:
+        """向量化计算自定义定时触发计划，规则与 should_trigger 一致（允许5秒误差）
+        
+        Args:
+            timeline: int64 统一时间轴
+            meta: 时间轴的时间元数据，为 None 时按需计算
+            
+        Returns:
+            np.ndarray: bool 触发掩码
+        """
+        return self.near_trigger_times(timeline, 5, meta=meta)
+        
+    def near_trigger_times(self, timeline: np.ndarray, tolerance: float, inclusive: bool = False,
+                           meta: Optional[TimelineMeta] = None) -> np.ndarray:
+        """判断时间轴上的每个时间点是否接近任一触发时间点
+        
+        Args:
+            timeline: int64 时间戳数组
+            tolerance: 允许误差（秒）
+            inclusive: 误差是否包含边界（<= 而不是 <）
+            meta: 时间轴的时间元数据，为 None 时按需计算
+            
+        Returns:
+            np.ndarray: bool 数组
+        """
+        mask = np.zeros(len(timeline), dtype=bool)
+        if len(timeline) == 0 or not self.trigger_seconds:
+            return mask
+        if meta is None:
+            _, seconds_of_day = local_time_parts(timeline)
+        else:
+            seconds_of_day = meta.seconds_of_day
+        for trigger_second in self.trigger_seconds:
+            distance = np.abs(seconds_of_day - trigger_second)
+            mask |= (distance <= tolerance) if inclusive else (distance < tolerance)
+        return mask
+        
     def get_data_period(self):
         """获取数据周期
         
@@ -463,18 +568,51 @@ class MyTraderCallback(XtQuantTraderCallback):
             self.gui.log_message(f"处理资金变动时出错: {str(e)}", "ERROR")
             '''
 
+class StrategySlot:
+    """多策略回测中单个策略的运行状态
+    
+    同一次回测中的多个策略共享行情数据、时间轴和触发计划，
+    各自拥有独立的交易账户、回测记录和结果目录。
+    """
+    
+    def __init__(self, name: str, strategy_file: str, strategy_module, trade_mgr: KhTradeManager):
+        """初始化策略槽位
+        
+        Args:
+            name: 策略名称，用作回测结果目录名前缀
+            strategy_file: 策略文件路径
+            strategy_module: 策略模块
+            trade_mgr: 该策略独立的交易管理器
+        """
+        self.name = name
+        self.strategy_file = strategy_file
+        self.strategy_module = strategy_module
+        self.trade_mgr = trade_mgr
+        self.backtest_records = {}  # 回测记录
+        self.results_writer = None  # 回测结果流式写入器
+        self.backtest_dir = None    # 回测结果目录
+
+
 class KhQuantFramework:
     """量化交易框架主类"""
     
-    def __init__(self, config_path: str, strategy_file: str, trader_callback=None):
+    def __init__(self, config_path: str, strategy_file: Union[str, List[Any]], trader_callback=None,
+                 init_data_enabled: Optional[bool] = None, data_provider=None, resume: bool = False):
         """初始化框架
         
         Args:
             config_path: 配置文件路径
-            strategy_file: 策略文件路径
+            strategy_file: 策略文件路径；传入策略文件路径或策略模块的列表时，
+                多个策略在同一次回测中共享一份行情数据，各自使用独立的账户和结果目录
             trader_callback: 交易回调函数
+            init_data_enabled: 是否在运行前初始化行情数据，None 表示按配置文件/界面设置决定
+            data_provider: 指定的数据提供者实例，None 表示按配置文件创建
+            resume: 回测模式下是否从上次保存的断点继续
         """
         self.config_path = config_path
+        self.init_data_enabled = init_data_enabled
+        self.data_provider = data_provider
+        self.resume = resume
         self.config = KhConfig(config_path)
         self.is_running = False  # 运行状态标识
         self.qmt_path = self.config.config_dict.get("qmt", {}).get("path", "") # QMT客户端路径
@@ -485,21 +623,26 @@ class KhQuantFramework:
         self.risk_mgr = KhRiskManager(self.config)  # 风险管理器
         self.tools = KhQuTools()  # 工具类
         self.backtest_records = {}  # 回测记录
-        self.daily_price_cache = {}  # 日线价格缓存，用于存储所有股票的日线数据
-        self._cached_benchmark_close = {}  # 基准指数收盘价缓存
+        self.daily_closes = None  # 回测区间内的日线收盘价矩阵（DailyCloseMatrix）
+        self.timeframes = None  # 策略声明的其他周期数据及其在主时间轴上的游标（AlignedTimeframes）
+        self.profiler = None  # 性能分析器，None 表示回测时创建默认的 khProfiler.Profiler
         
         # 添加运行时间记录变量
         self.start_time = None  # 策略开始运行时间
         self.end_time = None    # 策略结束运行时间
         self.total_runtime = 0  # 总运行时间（秒）
         
-        # 加载策略模块
-        self.strategy_module = self.load_strategy(strategy_file)
+        # 加载策略模块（第一个策略为主策略）
+        strategy_files = list(strategy_file) if isinstance(strategy_file, (list, tuple)) else [strategy_file]
+        strategy_modules = [self.load_strategy(f) if isinstance(f, str) else f for f in strategy_files]
+        self.strategy_module = strategy_modules[0]
         
         # 当前运行模式
         self.run_mode = self.config.run_mode
         
         self.trader_callback = trader_callback  # 保存交易回调函数
+        # 没有 Qt 界面时（命令行回测）不弹窗、不等待界面停止
+        self.headless = not (trader_callback is not None and is_qt_gui(getattr(trader_callback, 'gui', None)))
         
         # 创建触发器
         self.trigger = TriggerFactory.create_trigger(self, self.config.config_dict)
@@ -524,17 +667,29 @@ class KhQuantFramework:
         # 初始化交易管理器
         self.trade_mgr = KhTradeManager(self.config, self)
         
+        # 每个策略一个槽位，主策略使用框架自身的交易管理器
+        self.strategy_slots = []
+        used_names = set()
+        for i, (path, module) in enumerate(zip(strategy_files, strategy_modules)):
+            path = path if isinstance(path, str) else getattr(module, '__file__', '') or ''
+            if i == 0:
+                # 主策略沿用配置文件中的策略文件名作为结果目录名
+                path = self.config.config_dict.get("strategy_file", "") or path
+            name = os.path.splitext(os.path.basename(path))[0] if path else "unknown"
+            if name in used_names:
+                name = f"{name}_{i + 1}"
+            used_names.add(name)
+            trade_mgr = self.trade_mgr if i == 0 else KhTradeManager(self.config, self)
+            self.strategy_slots.append(StrategySlot(name, path, module, trade_mgr))
+        
         # 清除 khHistory 缓存，确保每次运行都是干净的状态
         from khQTTools import clear_khHistory_cache
         clear_khHistory_cache()
 
         # 清除可能存在的历史数据缓存，确保每次运行都是干净的状态
-        if hasattr(self, 'historical_data_ref'):
-            delattr(self, 'historical_data_ref')
-        if hasattr(self, 'time_field_cache'):
-            delattr(self, 'time_field_cache')
-        if hasattr(self, 'time_idx_cache'):
-            delattr(self, 'time_idx_cache')
+        if hasattr(self, 'market_panel'):
+            delattr(self, 'market_panel')
+        self.timeline_meta = None
         
         # 初始化风控管理器
         self.risk_mgr = KhRiskManager(self.config)
@@ -544,6 +699,11 @@ class KhQuantFramework:
 
     def _init_data_provider(self):
         """初始化数据提供者（根据配置）"""
+        if self.data_provider is not None:
+            # 使用外部指定的数据提供者（如参数扫描时的共享行情数据）
+            set_data_provider(self.data_provider)
+            return
+        
         try:
             provider_type = self.config.data_provider_type
 
@@ -553,7 +713,9 @@ class KhQuantFramework:
                     provider_type='mootdx',
                     mode=self.config.mootdx_mode,
                     tdxdir=self.config.mootdx_tdxdir,
-                    use_cache=self.config.mootdx_use_cache
+                    use_cache=self.config.mootdx_use_cache,
+                    servers=self.config.mootdx_servers,
+                    pool_size=self.config.mootdx_pool_size
                 )
                 print(f"数据提供者已设置为: mootdx (模式: {self.config.mootdx_mode})")
             else:
@@ -567,6 +729,11 @@ class KhQuantFramework:
             set_data_provider(provider_type='xtquant')
             print("已回退到默认数据提供者: xtquant")
 
+        if self.config.disk_cache:
+            # 历史行情优先从磁盘缓存读取，第二次及以后的回测不再向数据源请求
+            cache = DiskHistoryCache(self.config.disk_cache_dir or None)
+            set_data_provider(DiskCachedDataProvider(get_data_provider(), cache))
+
     def load_strategy(self, strategy_file: str):
         """动态加载策略模块
         
@@ -583,11 +750,25 @@ class KhQuantFramework:
         
     def init_trader_and_account(self):
         """初始化交易接口和账户"""
-        # 固定为回测模式，只进行虚拟账户初始化
-        self._init_virtual_account()
-        # 在回测模式下也设置回调
-        if self.trader_callback:
-            self.trade_mgr.callback = self.trader_callback
+        # 固定为回测模式，只进行虚拟账户初始化，每个策略一个独立账户
+        for slot in self.strategy_slots:
+            self._use_slot(slot)
+            self._init_virtual_account()
+            # 在回测模式下也设置回调
+            if self.trader_callback:
+                self.trade_mgr.callback = self.trader_callback
+        self._use_slot(self.strategy_slots[0])
+    
+    def _use_slot(self, slot: StrategySlot):
+        """切换当前策略槽位
+        
+        回测循环、record_results 等通过 self.strategy_module / self.trade_mgr /
+        self.backtest_records / self.results_writer 访问当前策略的状态。
+        """
+        self.strategy_module = slot.strategy_module
+        self.trade_mgr = slot.trade_mgr
+        self.backtest_records = slot.backtest_records
+        self.results_writer = slot.results_writer
         
     def _init_virtual_account(self):
         """初始化虚拟账户"""
@@ -869,14 +1050,8 @@ class KhQuantFramework:
             if self.trader_callback:
                 self.trader_callback.gui.log_message(f"交易接口初始化耗时: {init_time:.2f}秒", "INFO")
             
-            # 初始化缓存
-            self.daily_price_cache = {}
-            self._cached_benchmark_close = {}
-            
-            # 直接从设置界面读取是否初始化数据的配置
-            from PyQt5.QtCore import QSettings
-            settings = QSettings('KHQuant', 'StockAnalyzer')
-            init_data_enabled = settings.value('init_data_enabled', True, type=bool)
+            # 读取是否初始化数据的配置（参数 > 配置文件 > 设置界面）
+            init_data_enabled = self._get_init_data_enabled()
             
             if self.trader_callback:
                 self.trader_callback.gui.log_message(f"数据初始化设置: {'启用' if init_data_enabled else '禁用'}", "INFO")
@@ -902,23 +1077,30 @@ class KhQuantFramework:
             if self.trader_callback:
                 self.trader_callback.gui.log_message(f"股票列表加载耗时: {stock_list_time:.2f}秒", "INFO")
             
-            # 准备初始化数据结构，包含时间、账户、持仓、股票池等信息
-            init_data = {
-                "__current_time__": {
-                    "timestamp": int(time.time()),
-                    "datetime": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "date": datetime.datetime.now().strftime("%Y-%m-%d"),
-                    "time": datetime.datetime.now().strftime("%H:%M:%S")
-                },
-                "__account__": self.trade_mgr.assets,
-                "__positions__": self.trade_mgr.positions,
-                "__stock_list__": stock_codes,
-                "__framework__": self
-            }
+            # 策略参数在策略初始化之前记录，作为回测结果缓存键的一部分
+            self._strategy_fingerprints = self._collect_strategy_fingerprints()
             
-            # 调用策略初始化函数，并传递完整数据结构
+            # 调用每个策略的初始化函数，并传递完整数据结构
             strategy_init_start = time.time()
-            self.strategy_module.init(stock_codes, init_data)
+            # 策略在 init 中通过 khRequire 重新声明历史数据需求
+            clear_history_requirements()
+            for slot in self.strategy_slots:
+                self._use_slot(slot)
+                # 准备初始化数据结构，包含时间、账户、持仓、股票池等信息
+                init_data = {
+                    "__current_time__": {
+                        "timestamp": int(time.time()),
+                        "datetime": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        "date": datetime.datetime.now().strftime("%Y-%m-%d"),
+                        "time": datetime.datetime.now().strftime("%H:%M:%S")
+                    },
+                    "__account__": self.trade_mgr.assets,
+                    "__positions__": self.trade_mgr.positions,
+                    "__stock_list__": stock_codes,
+                    "__framework__": self
+                }
+                self.strategy_module.init(stock_codes, init_data)
+            self._use_slot(self.strategy_slots[0])
             strategy_init_time = time.time() - strategy_init_start
             
             if self.trader_callback:
@@ -940,8 +1122,8 @@ class KhQuantFramework:
             if self.trader_callback:
                 self.trader_callback.gui.log_message(f"策略主逻辑执行耗时: {strategy_time:.2f}秒", "INFO")
                 
-            # 保持程序运行
-            while self.is_running:
+            # 保持程序运行（GUI模式下由界面停止；命令行模式回测结束即退出）
+            while self.is_running and not self.headless:
                 time.sleep(1)
                 
         except Exception as e:
@@ -976,6 +1158,29 @@ class KhQuantFramework:
             
             self.stop()
 
+    def _get_init_data_enabled(self) -> bool:
+        """获取是否在运行前初始化行情数据
+        
+        优先使用构造参数，其次使用配置文件 system.init_data_enabled，
+        最后读取设置界面保存的 QSettings（无 PyQt5 时默认启用）。
+        
+        Returns:
+            bool: 是否初始化行情数据
+        """
+        if self.init_data_enabled is not None:
+            return bool(self.init_data_enabled)
+        
+        system_config = self.config.config_dict.get("system", {})
+        if "init_data_enabled" in system_config:
+            return bool(system_config["init_data_enabled"])
+        
+        try:
+            from PyQt5.QtCore import QSettings
+        except ImportError:
+            return True
+        settings = QSettings('KHQuant', 'StockAnalyzer')
+        return settings.value('init_data_enabled', True, type=bool)
+
     def get_stock_list(self):
         """获取股票列表"""
         stock_codes = []
@@ -1073,7 +1278,7 @@ class KhQuantFramework:
 是否继续运行回测？"""
 
                 # 使用QMetaObject.invokeMethod在主线程中显示弹窗
-                if self.trader_callback and hasattr(self.trader_callback, 'gui'):
+                if self.trader_callback and hasattr(self.trader_callback, 'gui') and not self.headless:
                     # 创建一个标志变量来存储用户选择
                     user_choice = [None]  # 使用列表以便在lambda中修改
                     
@@ -1112,6 +1317,9 @@ class KhQuantFramework:
                         # 用户选择继续运行，记录警告
                         if self.trader_callback:
                             self.trader_callback.gui.log_message(f"警告：继续运行不匹配配置 - 数据周期:{data_name}, 触发类型:{trigger_name}", "WARNING")
+                elif self.trader_callback:
+                    # 命令行模式无法弹窗，记录警告后继续运行
+                    self.trader_callback.gui.log_message(f"警告：数据周期({data_name})与触发类型({trigger_name})不匹配，建议数据周期为{expected_name}", "WARNING")
                 else:
                     # 没有GUI回调的情况，直接在日志中记录警告
                     print(f"警告：数据周期({data_period})与触发类型({trigger_type})不匹配")
@@ -1125,22 +1333,20 @@ class KhQuantFramework:
         
     def _run_backtest(self):
         """回测模式"""
+        profile_enabled = bool(self.config.config_dict["backtest"].get("profile", False))
+        instrumented = []
         try:
             # 检查数据周期和触发周期的一致性
             self._check_period_consistency()
-            
-            # 初始化回测记录字典
-            self.backtest_records = {
-                'trades': [],  # 交易记录
-                'daily_stats': [],  # 每日统计数据
-                'benchmark_data': [],  # 基准指数数据
-                'start_time': self.config.backtest_start,
-                'end_time': self.config.backtest_end,
-                'init_capital': self.config.config_dict["backtest"]["init_capital"]
-            }
+
+            # 应用内存缓存上限，缓存统计从本次回测开始计数
+            configure_caches(self.config.cache_max_mb)
             
             if self.trader_callback:
                 self.trader_callback.gui.log_message("开始回测...", "INFO")
+                if len(self.strategy_slots) > 1:
+                    self.trader_callback.gui.log_message(
+                        f"多策略回测: {', '.join(slot.name for slot in self.strategy_slots)}，共享同一份行情数据", "INFO")
                 
             # 获取股票列表
             stock_codes = self.get_stock_list()
@@ -1148,46 +1354,76 @@ class KhQuantFramework:
             # 单独处理基准指数数据
             benchmark_code = self.config.config_dict["backtest"]["benchmark"]
 
-            # 获取策略文件名（不含路径和扩展名）
-            strategy_file = self.config.config_dict.get("strategy_file", "")
-            strategy_name = os.path.splitext(os.path.basename(strategy_file))[0] if strategy_file else "unknown"
-
-            # 生成回测目录名（使用策略名称和回测时间范围）
-            backtest_dir_name = f"{strategy_name}_{self.config.backtest_start}_{self.config.backtest_end}"
-
-            # 构建回测结果目录路径
-            backtest_dir = os.path.join(
-                "backtest_results",
-                backtest_dir_name
-            )
-
-            # 确保目录存在
-            if not os.path.exists(backtest_dir):
-                os.makedirs(backtest_dir)
-
+            for slot in self.strategy_slots:
+                # 初始化回测记录字典
+                # 交易记录、每日统计和持仓明细由 results_writer 在回测过程中分块写盘
+                slot.backtest_records = {
+                    'benchmark_data': [],  # 基准指数数据
+                    'start_time': self.config.backtest_start,
+                    'end_time': self.config.backtest_end,
+                    'init_capital': self.config.config_dict["backtest"]["init_capital"]
+                }
+                
+                # 生成回测目录名（使用策略名称和回测时间范围）
+                backtest_dir_name = f"{slot.name}_{self.config.backtest_start}_{self.config.backtest_end}"
+                slot.backtest_dir = os.path.join("backtest_results", backtest_dir_name)
+                
+                # 确保目录存在
+                if not os.path.exists(slot.backtest_dir):
+                    os.makedirs(slot.backtest_dir)
+                
+                # 回测结果流式写入器，回测过程中分块写入临时目录，结束后导出到回测目录
+                slot.results_writer = BacktestResultWriter(
+                    os.path.join("backtest_results", f"{backtest_dir_name}.partial"),
+                    clear=not self.resume
+                )
+            if self.strategy_slots[0].results_writer.file_format != 'parquet':
+                # 未安装 pyarrow 时回退为 CSV 分块，写入和导出都更慢
+                message = "未安装 pyarrow，回测记录改用 CSV 分块写入（较慢），安装后使用 Parquet：pip install pyarrow"
+                if self.trader_callback:
+                    self.trader_callback.gui.log_message(message, "WARNING")
+                logging.warning(message)
+            self._use_slot(self.strategy_slots[0])
+            
+            # 主策略的回测目录，保存基准数据和回测断点
+            backtest_dir = self.strategy_slots[0].backtest_dir
             benchmark_file = os.path.join(backtest_dir, "benchmark.csv")
 
             if not os.path.exists(benchmark_file):
                 if self.trader_callback:
                     self.trader_callback.gui.log_message(f"开始获取基准指数 {benchmark_code} 的每日数据", "INFO")
-                
                 try:
-                    # 使用数据提供者获取基准数据
-                    provider = get_data_provider()
-                    provider.download_history_data(
+                    get_data_provider().download_history_data(
                         stock_code=benchmark_code,
                         period="1d",
                         start_time=self.config.backtest_start,
                         end_time=self.config.backtest_end,
                     )
-
-                    benchmark_data = provider.get_market_data(
-                        field_list=['time', 'close'],
-                        stock_list=[benchmark_code],
-                        period='1d',
-                        start_time=self.config.backtest_start,
-                        end_time=self.config.backtest_end
+                except Exception as e:
+                    logging.error(f"下载基准指数数据失败: {str(e)}", exc_info=True)
+            
+            # 一次性预加载股票池和基准指数在回测区间内的日线收盘价，
+            # 每日市值结算和基准曲线都从这份数据中取值
+            self.daily_closes = None
+            self._daily_close_requested = set()
+            try:
+                daily_close_data = self._load_daily_closes(list(dict.fromkeys(stock_codes + [benchmark_code])))
+                if self.trader_callback:
+                    self.trader_callback.gui.log_message(
+                        f"已预加载日线收盘价: {len(self.daily_closes.codes)}只股票 × {len(self.daily_closes.day_numbers)}个交易日",
+                        "INFO"
                     )
+            except Exception as e:
+                daily_close_data = {}
+                if self.trader_callback:
+                    self.trader_callback.gui.log_message(f"预加载日线收盘价失败: {str(e)}", "ERROR")
+                logging.error(f"预加载日线收盘价失败: {str(e)}", exc_info=True)
+            
+            if not os.path.exists(benchmark_file):
+                try:
+                    benchmark_data = {
+                        code: df for code, df in daily_close_data.items() if code == benchmark_code
+                    }
                     
                     if self.trader_callback:
                         self.trader_callback.gui.log_message(
@@ -1238,260 +1474,68 @@ class KhQuantFramework:
                                             f"基准指数数据已保存到 {benchmark_file}, 共 {len(result_df)} 条记录",
                                             "INFO"
                                         )
-                                        
-                                    # 预先缓存所有基准指数数据，提高性能
-                                    for _, row in result_df.iterrows():
-                                        date_str = row['date'].strftime('%Y%m%d')
-                                        cache_key = f"benchmark_{date_str}_{benchmark_code}"
-                                        self._cached_benchmark_close[cache_key] = row['close']
-                                    
-                                    if self.trader_callback:
-                                        self.trader_callback.gui.log_message(
-                                            f"已预缓存 {len(self._cached_benchmark_close)} 条基准指数数据",
-                                            "INFO"
-                                        )
                 except Exception as e:
                     if self.trader_callback:
                         self.trader_callback.gui.log_message(f"获取和保存基准指数数据失败: {str(e)}", "ERROR")
                     logging.error(f"获取和保存基准指数数据失败: {str(e)}", exc_info=True)
             
             # 获取数据周期
-            data_period = self.trigger.get_data_period()
-            
-            # 一次性加载所有股票的历史数据
-            historical_data = {}
-            for code in stock_codes:
-                if not self.is_running:
-                    break
-                    
-                # 确保field_list中包含time和close字段
-                field_list = self.config.config_dict["data"]["fields"]
-                if "time" not in field_list:
-                    field_list = ["time"] + field_list
-                if "close" not in field_list:
-                    field_list.append("close")
-                    
-                if self.trader_callback:
-                    self.trader_callback.gui.log_message(f"加载{code}的历史数据...", "INFO")
-                    
-                # 根据触发器的数据周期加载对应的历史数据
-                period = data_period
-                if period == "1s":
-                    # 对于自定义定时触发，检查时间点是否都是整分钟
-                    if isinstance(self.trigger, CustomTimeTrigger):
-                        # 检查所有触发时间点是否都是整分钟（秒数为0）
-                        all_whole_minutes = True
-                        for seconds in self.trigger.trigger_seconds:
-                            # 计算秒数部分
-                            seconds_part = seconds % 60
-                            if seconds_part != 0:
-                                all_whole_minutes = False
-                                break
-                        
-                        if all_whole_minutes:
-                            # 如果所有时间点都是整分钟，使用1m数据
-                            period = "1m"
-                            if self.trader_callback:
-                                self.trader_callback.gui.log_message(f"所有自定义时间点都是整分钟，使用1分钟K线数据", "INFO")
-                        else:
-                            # 如果有不是整分钟的时间点，使用tick数据
-                            period = "tick"
-                            if self.trader_callback:
-                                self.trader_callback.gui.log_message(f"存在非整分钟的自定义时间点，使用tick数据", "INFO")
-                    else:
-                        # 默认使用tick数据
-                        period = "tick"
-                
-                # 使用数据提供者获取市场数据
-                provider = get_data_provider()
-                data = provider.get_market_data(
-                    field_list=field_list,
-                    stock_list=[code],
-                    period=period,
-                    start_time=self.config.backtest_start,
-                    end_time=self.config.backtest_end,
-                    dividend_type=self.config.config_dict["data"]["dividend_type"],
-                    fill_data=True
-                )
-                if data and code in data:
-                    # 判断是否为自定义时间触发
-                    if isinstance(self.trigger, CustomTimeTrigger):
-                        # 对于自定义时间触发，只保留触发时间点附近的数据
-                        df = data[code]
-                        if 'time' in df.columns:
-                            # 获取所有时间戳
-                            all_timestamps = df['time'].values
-                            # 转换为秒级时间戳进行比较
-                            filtered_rows = []
-                            
-                            for ts in all_timestamps:
-                                # 转换时间戳为秒级
-                                ts_seconds = float(ts) / 1000 if float(ts) > 1e10 else float(ts)
-                                ts_dt = datetime.datetime.fromtimestamp(ts_seconds)
-                                
-                                # 计算当前时间点的秒数（从午夜开始）
-                                current_seconds = ts_dt.hour * 3600 + ts_dt.minute * 60 + ts_dt.second
-                                
-                                # 检查是否接近任一触发时间点（允许1秒误差）
-                                for trigger_second in self.trigger.trigger_seconds:
-                                    if abs(current_seconds - trigger_second) <= 1:
-                                        filtered_rows.append(ts)
-                                        break
-                            
-                            # 只保留触发时间点附近的数据
-                            if filtered_rows:
-                                filtered_df = df[df['time'].isin(filtered_rows)]
-                                historical_data[code] = filtered_df
-                                if self.trader_callback:
-                                    self.trader_callback.gui.log_message(
-                                        f"自定义时间触发: {code}过滤后保留{len(filtered_df)}个时间点，原始数据有{len(df)}个时间点", 
-                                        "INFO"
-                                    )
-                            else:
-                                # 如果没有找到匹配的时间点，仍然保存原始数据
-                                historical_data[code] = df
-                                if self.trader_callback:
-                                    self.trader_callback.gui.log_message(
-                                        f"警告: {code}没有找到匹配的自定义时间点，使用原始数据", 
-                                        "WARNING"
-                                    )
-                        else:
-                            # 如果没有time列，使用原始数据
-                            historical_data[code] = data[code]
-                            if self.trader_callback:
-                                self.trader_callback.gui.log_message(
-                                    f"警告: {code}的数据中没有time列，无法按自定义时间过滤", 
-                                    "WARNING"
-                                )
-                    else:
-                        # 非自定义时间触发，直接存储DataFrame
-                        historical_data[code] = data[code]
+            data_period = self._resolve_data_period(self.trigger.get_data_period())
             
-            if not self.is_running:
-                if self.trader_callback:
-                    self.trader_callback.gui.log_message("回测被中止", "WARNING")
-                return
-                    
-            # 获取所有时间点
-            all_times = []
-
-            # 对于自定义时间触发，使用不同的方式获取时间点
-            if isinstance(self.trigger, CustomTimeTrigger):
-                # 获取回测日期范围内的所有交易日
-                start_date = datetime.datetime.strptime(self.config.backtest_start, "%Y%m%d").date()
-                end_date = datetime.datetime.strptime(self.config.backtest_end, "%Y%m%d").date()
-                
-                # 获取交易日历（使用KhQuTools的真实交易日判断）
-                current_date = start_date
-                trading_days = []
-                while current_date <= end_date:
-                    # 使用KhQuTools判断是否为真实交易日（排除节假日）
-                    date_str = current_date.strftime("%Y-%m-%d")
-                    if self.tools.is_trade_day(date_str):
-                        trading_days.append(current_date)
-                    current_date += datetime.timedelta(days=1)
-                
+            # 流式模式：每次只加载一个交易日的全部股票数据，后台线程预取下一交易日，
+            # 内存占用只与一到两个交易日的数据量有关
+            streaming = bool(self.config.config_dict["backtest"].get("streaming", False))
+            if streaming:
+                stream_days = self._trading_days_between(self.config.backtest_start, self.config.backtest_end)
                 if self.trader_callback:
-                    self.trader_callback.gui.log_message(f"回测期间共有{len(trading_days)}个交易日", "INFO")
+                    self.trader_callback.gui.log_message(
+                        f"流式回测模式：回测期间共有{len(stream_days)}个交易日，按交易日逐日加载数据", "INFO")
+                timeline_key = ('stream', len(stream_days),
+                                *(day.strftime("%Y%m%d") for day in stream_days[:1] + stream_days[-1:]))
+                period_fingerprint = None
+            else:
+                # 一次性加载所有股票的历史数据
+                historical_data = self._load_historical_data(
+                    stock_codes, data_period, self.config.backtest_start, self.config.backtest_end)
                 
-                # 为每个交易日生成自定义触发时间点
-                for day in trading_days:
-                    for seconds in self.trigger.trigger_seconds:
-                        # 将秒数转换为时分秒
-                        h = seconds // 3600
-                        m = (seconds % 3600) // 60
-                        s = seconds % 60
-                        
-                        # 创建完整的datetime对象
-                        dt = datetime.datetime.combine(day, datetime.time(h, m, s))
-                        
-                        # 转换为时间戳（秒级）
-                        timestamp = int(dt.timestamp())
-                        all_times.append(timestamp)
+                if not self.is_running:
+                    if self.trader_callback:
+                        self.trader_callback.gui.log_message("回测被中止", "WARNING")
+                    return
                 
-                if self.trader_callback:
-                    self.trader_callback.gui.log_message(f"自定义时间触发模式：生成了{len(all_times)}个时间点", "INFO")
-            else:
-                # 非自定义时间触发模式，使用原来的方式获取时间点
-                for code, df in historical_data.items():
+                # 对于自定义时间触发，按交易日历生成触发时间点作为时间轴
+                custom_timeline = None
+                if isinstance(self.trigger, CustomTimeTrigger):
+                    trading_days = self._trading_days_between(self.config.backtest_start, self.config.backtest_end)
                     if self.trader_callback:
-                        self.trader_callback.gui.log_message(f"处理{code}的数据...", "INFO")
-                    
-                    # 检查数据结构
-                    if isinstance(df, pd.DataFrame):
-                        # DataFrame结构处理
-                        if 'time' in df.columns:
-                            times = df['time'].values
-                            all_times.extend(times)
-                            if self.trader_callback:
-                                self.trader_callback.gui.log_message(f"从{code}的DataFrame中提取了{len(times)}个时间点", "INFO")
-                        else:
-                            # 尝试使用其他可能的时间字段
-                            time_field = None
-                            for field in ['timestamp', 'date', 'datetime']:
-                                if field in df.columns:
-                                    time_field = field
-                                    break
-                            
-                            if time_field is None:
-                                # 如果没有找到任何时间字段，尝试使用索引
-                                if isinstance(df.index, pd.DatetimeIndex):
-                                    times = df.index.astype(np.int64) // 10**9  # 转换为秒级时间戳
-                                    all_times.extend(times)
-                                    if self.trader_callback:
-                                        self.trader_callback.gui.log_message(f"从{code}的DataFrame索引中提取了{len(times)}个时间点", "INFO")
-                                else:
-                                    # 如果没有找到任何时间字段，跳过这个股票
-                                    if self.trader_callback:
-                                        self.trader_callback.gui.log_message(f"错误: {code}的数据中没有找到任何时间字段，跳过该股票", "ERROR")
-                                    continue
-                            else:
-                                times = df[time_field].values
-                                all_times.extend(times)
-                                if self.trader_callback:
-                                    self.trader_callback.gui.log_message(f"从{code}的DataFrame的{time_field}字段中提取了{len(times)}个时间点", "INFO")
-                    elif isinstance(df, dict):
-                        # 字典结构处理（Mootdx格式）
-                        if 'time' in df:
-                            times = df['time']
-                            all_times.extend(times)
-                            if self.trader_callback:
-                                self.trader_callback.gui.log_message(f"从{code}的字典数据中提取了{len(times)}个时间点", "INFO")
-                        else:
-                            if self.trader_callback:
-                                self.trader_callback.gui.log_message(f"错误: {code}的字典数据中没有找到time字段，跳过该股票", "ERROR")
-                            continue
-                    else:
-                        # 处理其他可能的数据结构
-                        if self.trader_callback:
-                            self.trader_callback.gui.log_message(f"警告: {code}的数据格式未知(类型: {type(df)})，跳过该股票", "WARNING")
-                        continue
-            
-            # 去重并排序
-            all_times = sorted(list(set(all_times)))
+                        self.trader_callback.gui.log_message(f"回测期间共有{len(trading_days)}个交易日", "INFO")
+                    custom_timeline = self._custom_timeline(trading_days)
+                    if self.trader_callback:
+                        self.trader_callback.gui.log_message(f"自定义时间触发模式：生成了{len(custom_timeline)}个时间点", "INFO")
+                
+                # 构建统一时间轴、行情面板和触发计划，数据已复制到面板中，原始 DataFrame 可以释放
+                period_fingerprint = data_fingerprint(historical_data)
+                segment = self._build_segment(historical_data, custom_timeline)
+                del historical_data
+                if segment is None:
+                    return
+                timeline_key = (len(segment.all_times), int(segment.all_times[0]), int(segment.all_times[-1]))
             
-            if len(all_times) == 0:
-                if self.trader_callback:
-                    self.trader_callback.gui.log_message("错误: 没有找到任何有效的时间点，无法进行回测", "ERROR")
+            # 按策略声明的数据需求一次性预加载历史数据，回测循环中不再请求数据源；
+            # 声明的各周期数据对齐到主时间轴，供 khBar / khBars 按时间点查表
+            self.timeframes = None
+            self._preload_history(stock_codes)
+            timeframes = self.timeframes
+            if not self.is_running:
                 return
             
-            if self.trader_callback:
-                self.trader_callback.gui.log_message(f"共找到{len(all_times)}个时间点", "INFO")
-                self.trader_callback.gui.log_message(f"第一个时间点: {all_times[0]}", "INFO")
-                self.trader_callback.gui.log_message(f"最后一个时间点: {all_times[-1]}", "INFO")
-            
-            # 保存所有时间点到实例变量，供record_results使用
-            self.all_times = all_times
-            
-            total_times = len(all_times)
+            # 回测结果缓存：策略、配置和实际加载的各周期行情数据都未变化时直接复用上一次的回测结果
+            run_keys = self._run_cache_keys(stock_codes, daily_close_data, data_period, period_fingerprint)
+            # 性能分析需要实际运行回测，不读取缓存
+            if run_keys and not self.resume and not profile_enabled and self._restore_cached_results(run_keys):
+                return
+
             processed_times = 0
-            
-            # 计算进度显示增量（至少为1，最多为总数/100向上取整）
-            if total_times > 100:
-                progress_increment = max(1, int(total_times / 100))
-            else:
-                # 如果时间点太少，则每处理一个点都显示一次进度
-                progress_increment = 1
                 
             # 显示开始进度
             if self.trader_callback:
@@ -1499,89 +1543,9 @@ class KhQuantFramework:
                 # 强制发送0%进度信号，确保进度条立即显示
                 self.trader_callback.gui.progress_signal.emit(0)
                 # 刷新界面
-                from PyQt5.QtWidgets import QApplication
-                QApplication.processEvents()
-            
-            # 预先构建数据缓存（避免在循环中重复构建）
-            if not hasattr(self, 'historical_data_ref'):
-                if self.trader_callback:
-                    self.trader_callback.gui.log_message("首次运行，正在构建数据缓存...", "INFO")
-                
-                # 创建包含原始DataFrame引用的字典
-                self.historical_data_ref = {}
-                
-                # 创建时间字段到索引的映射，用于快速查找
-                self.time_field_cache = {}
-                self.time_idx_cache = {}
-                
-                # 创建基于当前时间点的数据引用
-                for code, df in historical_data.items():
-                    # 找到时间字段：优先检查索引，然后检查列
-                    time_field_found = False
-
-                    if isinstance(df, pd.DataFrame):
-                        # DataFrame 格式处理（XtQuant）
-                        # 首先检查索引是否为时间索引
-                        if isinstance(df.index, pd.DatetimeIndex) or df.index.name in ['time', 'timestamp', 'date', 'datetime']:
-                            # 使用索引作为时间字段
-                            self.time_field_cache[code] = '__index__'  # 特殊标记表示使用索引
-                            self.historical_data_ref[code] = df
-
-                            # 预先创建时间值到索引的映射
-                            time_idx_map = {}
-                            for i, tv in enumerate(df.index):
-                                # 将 Timestamp 转换为秒级时间戳
-                                if hasattr(tv, 'timestamp'):
-                                    timestamp_sec = int(tv.timestamp())
-                                    time_idx_map[timestamp_sec] = i
-                                time_idx_map[tv] = i  # 也保存原始值
-                            self.time_idx_cache[code] = time_idx_map
-                            time_field_found = True
-
-                        else:
-                            # 然后检查列
-                            for field in ['time', 'timestamp', 'date', 'datetime']:
-                                if field in df.columns:
-                                    self.time_field_cache[code] = field
-                                    self.historical_data_ref[code] = df
-
-                                    # 预先创建时间值到索引的映射
-                                    time_values = df[field].values
-                                    time_idx_map = {}
-                                    for i, tv in enumerate(time_values):
-                                        time_idx_map[tv] = i
-                                    self.time_idx_cache[code] = time_idx_map
-                                    time_field_found = True
-                                    break
-
-                    elif isinstance(df, dict):
-                        # 字典格式处理（Mootdx）
-                        if 'time' in df:
-                            self.time_field_cache[code] = 'time'
-                            self.historical_data_ref[code] = df
-
-                            # 预先创建时间值到索引的映射
-                            time_values = df['time']
-                            time_idx_map = {}
-                            for i, tv in enumerate(time_values):
-                                time_idx_map[tv] = i
-                                # 同时处理毫秒/秒的转换
-                                if isinstance(tv, (int, float)):
-                                    if tv > 1e10:  # 毫秒级
-                                        time_idx_map[tv // 1000] = i  # 也存储秒级
-                                    else:  # 秒级
-                                        time_idx_map[tv * 1000] = i  # 也存储毫秒级
-                            self.time_idx_cache[code] = time_idx_map
-                            time_field_found = True
-
-                    if not time_field_found and self.trader_callback:
-                        self.trader_callback.gui.log_message(
-                            f"警告: {code} 未找到时间字段，数据可能无法正确加载",
-                            "WARNING"
-                        )
-                
-                if self.trader_callback:
-                    self.trader_callback.gui.log_message("数据缓存构建完成", "INFO")
+                if not self.headless:
+                    from PyQt5.QtWidgets import QApplication
+                    QApplication.processEvents()
             
             # 按时间顺序模拟
             current_date = None
@@ -1605,182 +1569,108 @@ class KhQuantFramework:
                 if not hasattr(self.strategy_module, 'khPostMarket'):
                     self.trader_callback.gui.log_message("警告: 策略模块未实现 khPostMarket 方法，盘后回调将不会执行", "WARNING")
             
-            # 获取唯一的交易日列表
-            trading_days = set()
-            for time_point in all_times:
-                try:
-                    timestamp = int(time_point)
-                    # 判断时间戳精度（秒级或毫秒级）
-                    if timestamp > 1e10:  # 毫秒级时间戳
-                        dt = datetime.datetime.fromtimestamp(timestamp / 1000)
-                    else:  # 秒级时间戳
-                        dt = datetime.datetime.fromtimestamp(timestamp)
-                    trading_days.add(dt.strftime("%Y-%m-%d"))
-                except:
-                    pass
-            
-            trading_days = sorted(list(trading_days))
-            if self.trader_callback:
-                self.trader_callback.gui.log_message(f"回测期间共有 {len(trading_days)} 个交易日", "INFO")
-            
-            # 初始化时间统计变量
-            time_stats = {
-                "构造数据": 0,
-                "构造时间信息": 0,
-                "检查新日期": 0,
-                "盘后回调": 0,
-                "盘前回调": 0,
-                "触发器检查": 0,
-                "风控检查": 0,
-                "策略处理": 0,
-                "处理信号": 0,
-                "交易指令": 0,
-                "记录结果": 0,
-                "总时间": 0
-            }
-            
-            for current_time in all_times:
-                loop_start_time = time.time()
+            # 性能分析：回测循环各阶段记录为层级区间，统计调用次数和分位数；
+            # backtest.profile 开启时还统计 khHistory 等辅助函数和 process_signals 的调用，
+            # 并在回测目录中导出 Chrome trace 和汇总表
+            profiler = self.profiler or Profiler(trace=profile_enabled)
+            set_profiler(profiler)
+            if profile_enabled:
+                instrumented = instrument_functions(
+                    profiler,
+                    [m for m in (sys.modules.get('khQTTools'), sys.modules.get('khQuantImport')) if m is not None]
+                    + [slot.strategy_module for slot in self.strategy_slots],
+                    list(PROFILED_HELPERS)
+                )
+                instrumented += instrument_functions(
+                    profiler, [slot.trade_mgr for slot in self.strategy_slots], ["process_signals"])
+            
+            # 断点续跑：恢复最近一次断点保存的回测状态
+            checkpoint_file = checkpoint_path(backtest_dir)
+            checkpoint_interval = float(self.config.config_dict["backtest"].get("checkpoint_interval", 300))
+            fingerprint = self._checkpoint_fingerprint(stock_codes, timeline_key)
+            start_segment = None
+            start_position = 0
+            if self.resume:
+                checkpoint = self._load_backtest_checkpoint(checkpoint_file, fingerprint)
+                if checkpoint is not None:
+                    start_segment = checkpoint['segment']
+                    start_position = checkpoint['position']
+                    processed_times = checkpoint['processed_times']
+                    current_date = checkpoint['current_date']
+                    day_start_time = checkpoint['day_start_time']
+                    # 前一交易日最后一个时间点的数据，供盘后回调使用
+                    day_data = checkpoint['day_data']
+                    if checkpoint['day_data_has_framework']:
+                        day_data["__framework__"] = self
+            start_processed = processed_times
+            
+            if streaming:
+                first_day = 0
+                if start_segment is not None:
+                    first_day = next((i for i, day in enumerate(stream_days)
+                                      if day.strftime("%Y%m%d") >= start_segment), len(stream_days))
+                stream_loader = DayStreamLoader(
+                    stream_days[first_day:],
+                    lambda day: self._load_day_segment(stock_codes, data_period, day),
+                    prefetch=bool(self.config.config_dict["backtest"].get("stream_prefetch", True))
+                )
+                segments = self._iter_stream_segments(stream_loader, first_day, len(stream_days))
+            else:
+                segments = [segment]
+                del segment
+            last_checkpoint_time = time.time()
+            active_segment = None
+            
+            for segment, position, time_index in self._iter_segment_bars(segments, start_position):
+                if segment is not active_segment:
+                    # 切换到新的数据段（流式模式下为新的交易日）。上一交易日的数据仍被 day_data 引用，
+                    # 在盘后回调执行、day_data 指向新交易日后释放
+                    active_segment = segment
+                    all_times, timeline_meta, trigger_mask = self._activate_segment(segment)
+                current_time = all_times[time_index]
+                if timeframes is not None:
+                    timeframes.position = time_index
                 
                 if not self.is_running:
                     if self.trader_callback:
                         self.trader_callback.gui.log_message("回测被中止", "WARNING")
                     break
+                profiler.begin("回测循环")
+                
+                # 每隔 checkpoint_interval 秒，在新交易日开始前保存一次断点
+                if (checkpoint_interval > 0 and timeline_meta.is_day_start[time_index]
+                        and processed_times > start_processed
+                        and time.time() - last_checkpoint_time >= checkpoint_interval):
+                    self._save_backtest_checkpoint(checkpoint_file, fingerprint, segment.key, position,
+                                                   processed_times, current_date, day_start_time, day_data)
+                    last_checkpoint_time = time.time()
                     
                 processed_times += 1
+                segment_total = len(segment.iteration_indices)
                 # 根据计算的增量显示进度，但确保前几次都显示
                 should_show_progress = False
                 if processed_times <= 5:  # 前5次都显示
                     should_show_progress = True
-                elif processed_times % progress_increment == 0:  # 按增量显示
+                elif (position + 1) % segment.progress_increment == 0:  # 按增量显示
                     should_show_progress = True
-                elif processed_times == total_times:  # 最后一次也显示
+                elif position + 1 == segment_total:  # 最后一次也显示
                     should_show_progress = True
                 
                 if should_show_progress and self.trader_callback:
-                    progress = (processed_times / total_times) * 100
+                    # 流式模式下按交易日折算整体进度
+                    progress = ((segment.offset + (position + 1) / segment_total) / segment.count) * 100
                     self.trader_callback.gui.log_message(f"回测进度: {progress:.2f}%", "INFO")
                 
                 # 进一步优化的构造数据代码
-                data_start_time = time.time()
-                
-                # 创建包含__current_time__的字典结构
-                try:
-                    timestamp = int(current_time)
-                    # 判断时间戳精度（秒级或毫秒级）
-                    if timestamp > 1e10:  # 毫秒级时间戳
-                        dt = datetime.datetime.fromtimestamp(timestamp / 1000)
-                    else:  # 秒级时间戳
-                        dt = datetime.datetime.fromtimestamp(timestamp)
-                        
-                    time_info = {
-                        "timestamp": timestamp,
-                        "datetime": dt.strftime("%Y-%m-%d %H:%M:%S"),
-                        "date": dt.strftime("%Y-%m-%d"),
-                        "time": dt.strftime("%H:%M:%S"),
-                        "raw_time": current_time
-                    }
-                except Exception as e:
-                    # 如果转换失败，使用原始时间戳
-                    time_info = {
-                        "timestamp": current_time,
-                        "datetime": str(current_time),
-                        "date": str(current_time),
-                        "time": str(current_time),
-                        "raw_time": current_time
-                    }
+                data_start_time = profiler.now()
                 
                 # 创建当前时间点的数据视图
-                current_data = {"__current_time__": time_info}
+                current_data = {}
                 
-                # 直接添加数据引用，而不是转换为字典
-                for code in self.historical_data_ref:
-                    if code in self.time_field_cache and code in self.time_idx_cache:
-                        time_field = self.time_field_cache[code]
-                        time_idx_map = self.time_idx_cache[code]
-                        df = self.historical_data_ref[code]
-
-                        # ✅ 性能优化：统一使用DataFrame格式（V2.2.3）
-                        # XtQuant和Mootdx都返回DataFrame，简化处理逻辑
-                        if isinstance(df, pd.DataFrame):
-                            # DataFrame 格式处理（统一格式）
-                            # 尝试直接匹配当前时间
-                            if current_time in time_idx_map:
-                                idx = time_idx_map[current_time]
-                                # ✅ 直接切片，零转化
-                                current_data[code] = df.iloc[idx]
-                            else:
-                                # 尝试处理精度不一致问题
-                                matched = False
-                                idx = -1
-
-                                if isinstance(current_time, (int, float)):
-                                    # 处理毫秒/秒的转换
-                                    if current_time > 1e10:  # 毫秒级
-                                        sec_time = current_time // 1000
-                                        if sec_time in time_idx_map:
-                                            idx = time_idx_map[sec_time]
-                                            matched = True
-                                    else:  # 秒级
-                                        ms_time = current_time * 1000
-                                        if ms_time in time_idx_map:
-                                            idx = time_idx_map[ms_time]
-                                            matched = True
-
-                                if matched:
-                                    # 直接切片
-                                    current_data[code] = df.iloc[idx]
-                                else:
-                                    # 没有匹配的数据，存储空Series
-                                    current_data[code] = pd.Series({})
-                        elif isinstance(df, dict):
-                            # ⚠️ 兼容性处理：旧版本Dict格式（将在未来版本移除）
-                            # 正常情况下不应该走到这里，如果走到这里说明使用了旧格式
-                            logger.warning(f"⚠️ 检测到旧Dict格式数据: {code}，建议升级数据提供者")
-                            if current_time in time_idx_map:
-                                idx = time_idx_map[current_time]
-                                # 从字典中提取对应索引的数据
-                                row_data = {}
-                                for key, values in df.items():
-                                    if isinstance(values, list) and len(values) > idx:
-                                        row_data[key] = values[idx]
-                                current_data[code] = pd.Series(row_data)
-                            else:
-                                # 尝试处理精度不一致问题
-                                matched = False
-                                idx = -1
-
-                                if isinstance(current_time, (int, float)):
-                                    # 处理毫秒/秒的转换
-                                    if current_time > 1e10:  # 毫秒级
-                                        sec_time = current_time // 1000
-                                        if sec_time in time_idx_map:
-                                            idx = time_idx_map[sec_time]
-                                            matched = True
-                                    else:  # 秒级
-                                        ms_time = current_time * 1000
-                                        if ms_time in time_idx_map:
-                                            idx = time_idx_map[ms_time]
-                                            matched = True
-
-                                if matched:
-                                    # 从字典中提取对应索引的数据
-                                    row_data = {}
-                                    for key, values in df.items():
-                                        if isinstance(values, list) and len(values) > idx:
-                                            row_data[key] = values[idx]
-                                    current_data[code] = pd.Series(row_data)
-                                else:
-                                    # 没有匹配的数据，存储空Series
-                                    current_data[code] = pd.Series({})
-                        else:
-                            # 未知格式
-                            current_data[code] = pd.Series({})
-                    else:
-                        # 没有时间字段的情况
-                        current_data[code] = pd.Series({})
+                # 直接添加面板中的行情视图，零拷贝
+                current_data.update(self.market_panel.snapshot(time_index))
                 
-                time_stats["构造数据"] += time.time() - data_start_time
+                profiler.record("构造数据", data_start_time)
                 
                 # 添加日志，显示第一个股票的数据示例
                 if processed_times == 1 and self.trader_callback and current_data:
@@ -1803,562 +1693,798 @@ class KhQuantFramework:
                                 count += 1
                         if sample_str:
                             self.trader_callback.gui.log_message(f"部分字段值: {sample_str[:-2]}", "INFO")
+                        # 样例数据引用第一个数据段的行情面板，用完即释放
+                        sample_data = None
                 
-                # 构造时间信息
-                time_info_start = time.time()
-                try:
-                    timestamp = int(current_time)
-                    # 判断时间戳精度（秒级或毫秒级）
-                    if timestamp > 1e10:  # 毫秒级时间戳
-                        dt = datetime.datetime.fromtimestamp(timestamp / 1000)
-                    else:  # 秒级时间戳
-                        dt = datetime.datetime.fromtimestamp(timestamp)
-                        
-                    time_info = {
-                        "timestamp": timestamp,
-                        "datetime": dt.strftime("%Y-%m-%d %H:%M:%S"),
-                        "date": dt.strftime("%Y-%m-%d"),
-                        "time": dt.strftime("%H:%M:%S"),
-                        "raw_time": current_time
-                    }
-                except Exception as e:
-                    # 如果转换失败，使用原始时间戳
-                    time_info = {
-                        "timestamp": current_time,
-                        "datetime": str(current_time),
-                        "date": str(current_time),
-                        "time": str(current_time),
-                        "raw_time": current_time
-                    }
+                # 构造时间信息（查预先计算的时间元数据）
+                time_info_start = profiler.now()
+                time_info = timeline_meta.time_info(time_index)
                 
-                # 添加当前时间信息到数据中
                 # 添加时间信息到数据中
                 current_data["__current_time__"] = time_info
-                time_stats["构造时间信息"] += time.time() - time_info_start
-                
-                # 添加账户和持仓信息到数据字典
-                account_data = {
-                    "__account__": self.trade_mgr.assets
-                }
-                # 添加持仓信息
-                positions_data = {
-                    "__positions__": self.trade_mgr.positions
-                }
-                # 添加股票池信息
-                stock_list_data = {
-                    "__stock_list__": stock_codes
-                }
-                # 合并所有信息
-                current_data.update(account_data)
-                current_data.update(positions_data)
-                current_data.update(stock_list_data)
-                
-                # 检查是否是新的一天
-                new_day_start = time.time()
-                if current_date != time_info["date"]:
-                    # 如果有前一天的数据，执行盘后回调
-                    post_market_start = time.time()
-                    if current_date is not None and post_market_enabled and hasattr(self.strategy_module, 'khPostMarket'):
-                        # 执行盘后回调
-                        try:
-                            if self.trader_callback:
-                                self.trader_callback.gui.log_message(f"执行盘后回调 - 日期: {current_date}", "INFO")
-                            
-                            # 设置时间信息为盘后时间
-                            post_time_info = time_info.copy()
-                            post_time_info["time"] = post_market_time
-                            post_time_info["datetime"] = f"{current_date} {post_market_time}"
-                            
-                            # 使用最后一个时间点的数据或创建一个完整的数据结构
-                            post_data = day_data.copy() if day_data else {}
-                            post_data["__current_time__"] = post_time_info
-                            
-                            # 添加账户和持仓信息到数据字典
-                            post_data["__account__"] = self.trade_mgr.assets
-                            post_data["__positions__"] = self.trade_mgr.positions
-                            post_data["__stock_list__"] = stock_codes
-                            
-                            # 添加框架实例到数据字典
-                            post_data["__framework__"] = self
-                            
-                            # 执行盘后回调
-                            post_signals = self.strategy_module.khPostMarket(post_data)
-                            
-                            # 处理盘后回调产生的信号
-                            if post_signals:
-                                for signal in post_signals:
-                                    if 'price' in signal:
-                                        signal['price'] = round(float(signal['price']), 2)
-                                    signal['timestamp'] = time_info["timestamp"]
-                                
-                                # 发送交易指令
-                                self.trade_mgr.process_signals(post_signals)
-                        except Exception as e:
-                            if self.trader_callback:
-                                self.trader_callback.gui.log_message(f"执行盘后回调时出错: {str(e)}", "ERROR")
-                    time_stats["盘后回调"] += time.time() - post_market_start
-                    
+                profiler.record("构造时间信息", time_info_start)
+                
+                # 检查是否是新的一天（每日第一个时间点一定在迭代下标中）
+                is_new_day = timeline_meta.is_day_start[time_index]
+                if is_new_day:
+                    prev_date = current_date
+                    # 上一交易日最后一个时间点的数据，供盘后回调使用
+                    prev_day_data = day_data
                     # 更新当前日期
                     current_date = time_info["date"]
                     day_start_time = time_info["timestamp"]
-                    day_data = current_data
+                # 更新当天的数据
+                day_data = current_data
+                
+                # 所有策略共享同一份行情数据，依次驱动每个策略
+                bar_data = current_data
+                for slot in self.strategy_slots:
+                    self._use_slot(slot)
+                    # 每个策略的阶段耗时记录在各自的轨道上
+                    profiler.track = slot.name
+                    # 多策略时每个策略使用独立的浅拷贝，避免策略修改数据字典相互影响
+                    current_data = bar_data if len(self.strategy_slots) == 1 else bar_data.copy()
                     
-                    # 检查是否需要执行盘前回调
-                    pre_market_start = time.time()
-                    if pre_market_enabled and hasattr(self.strategy_module, 'khPreMarket'):
-                        # 执行盘前回调
-                        try:
-                            if self.trader_callback:
-                                self.trader_callback.gui.log_message(f"执行盘前回调 - 日期: {current_date}", "INFO")
-                            
-                            # 设置时间信息为盘前时间
-                            pre_time_info = time_info.copy()
-                            pre_time_info["time"] = pre_market_time
-                            pre_time_info["datetime"] = f"{current_date} {pre_market_time}"
-                            
-                            # 使用当前时间点的数据或创建一个完整的数据结构
-                            pre_data = current_data.copy()
-                            pre_data["__current_time__"] = pre_time_info
-                            
-                            # 确保包含账户和持仓信息
-                            pre_data["__account__"] = self.trade_mgr.assets
-                            pre_data["__positions__"] = self.trade_mgr.positions
-                            pre_data["__stock_list__"] = stock_codes
-                            
-                            # 添加框架实例到数据字典
-                            pre_data["__framework__"] = self
-                            
-                            # 执行盘前回调
-                            pre_signals = self.strategy_module.khPreMarket(pre_data)
-                            
-                            # 处理盘前回调产生的信号
-                            if pre_signals:
-                                for signal in pre_signals:
-                                    if 'price' in signal:
-                                        signal['price'] = round(float(signal['price']), 2)
-                                    signal['timestamp'] = time_info["timestamp"]
-                                
-                                # 发送交易指令
-                                self.trade_mgr.process_signals(pre_signals)
-                        except Exception as e:
-                            if self.trader_callback:
-                                self.trader_callback.gui.log_message(f"执行盘前回调时出错: {str(e)}", "ERROR")
-                    time_stats["盘前回调"] += time.time() - pre_market_start
-                else:
-                    # 更新当天的数据
-                    day_data = current_data
-                time_stats["检查新日期"] += time.time() - new_day_start
-                
-                # 使用触发器判断是否应该触发策略
-                trigger_start = time.time()
-                if not self.trigger.should_trigger(current_time, current_data):
-                    time_stats["触发器检查"] += time.time() - trigger_start
-                    continue
-                time_stats["触发器检查"] += time.time() - trigger_start
-                
-                # 风控检查
-                risk_start = time.time()
-                if not self.risk_mgr.check_risk(current_data):
-                    time_stats["风控检查"] += time.time() - risk_start
-                    continue
-                time_stats["风控检查"] += time.time() - risk_start
-                
-                # 检查是否是交易日
-                current_date_str = current_data.get("__current_time__", {}).get("date", "")
-                if current_date_str and not self.tools.is_trade_day(current_date_str):
-                    # 如果不是交易日，跳过策略调用
-                    continue
-                
-                # 添加框架实例到数据字典
-                current_data["__framework__"] = self
-                
-                # 检查股票数据是否为空
-                stock_data_empty = True
-                empty_stocks = []
-                for key, value in current_data.items():
-                    # 跳过框架内部字段
-                    if key.startswith("__"):
+                    # 添加账户和持仓信息到数据字典
+                    account_data = {
+                        "__account__": self.trade_mgr.assets
+                    }
+                    # 添加持仓信息
+                    positions_data = {
+                        "__positions__": self.trade_mgr.positions
+                    }
+                    # 添加股票池信息
+                    stock_list_data = {
+                        "__stock_list__": stock_codes
+                    }
+                    # 合并所有信息
+                    current_data.update(account_data)
+                    current_data.update(positions_data)
+                    current_data.update(stock_list_data)
+                    
+                    # 新的一天：先执行上一交易日的盘后回调，再执行当日的盘前回调
+                    profiler.begin("检查新日期")
+                    if is_new_day:
+                        if timeframes is not None:
+                            # 盘后和盘前回调只能看到当日第一个时间点之前已完成的K线
+                            timeframes.position = time_index - 1
+                        # 如果有前一天的数据，执行盘后回调
+                        profiler.begin("盘后回调")
+                        if prev_date is not None and post_market_enabled and hasattr(self.strategy_module, 'khPostMarket'):
+                            # 执行盘后回调
+                            try:
+                                if self.trader_callback:
+                                    self.trader_callback.gui.log_message(f"执行盘后回调 - 日期: {prev_date}", "INFO")
+                    
+                                # 设置时间信息为盘后时间
+                                post_time_info = time_info.copy()
+                                post_time_info["time"] = post_market_time
+                                post_time_info["datetime"] = f"{prev_date} {post_market_time}"
+                    
+                                # 使用最后一个时间点的数据或创建一个完整的数据结构
+                                post_data = prev_day_data.copy() if prev_day_data else {}
+                                post_data["__current_time__"] = post_time_info
+                    
+                                # 添加账户和持仓信息到数据字典
+                                post_data["__account__"] = self.trade_mgr.assets
+                                post_data["__positions__"] = self.trade_mgr.positions
+                                post_data["__stock_list__"] = stock_codes
+                    
+                                # 添加框架实例到数据字典
+                                post_data["__framework__"] = self
+                    
+                                # 执行盘后回调
+                                post_signals = self.strategy_module.khPostMarket(post_data)
+                    
+                                # 处理盘后回调产生的信号
+                                if post_signals:
+                                    for signal in post_signals:
+                                        if 'price' in signal:
+                                            signal['price'] = round(float(signal['price']), 2)
+                                        signal['timestamp'] = time_info["timestamp"]
+                    
+                                    # 发送交易指令
+                                    self.trade_mgr.process_signals(post_signals)
+                            except Exception as e:
+                                if self.trader_callback:
+                                    self.trader_callback.gui.log_message(f"执行盘后回调时出错: {str(e)}", "ERROR")
+                        profiler.end()
+                        # 盘后回调执行完毕，释放对上一交易日数据的引用
+                        post_data = None
+                    
+                        # 检查是否需要执行盘前回调
+                        profiler.begin("盘前回调")
+                        if pre_market_enabled and hasattr(self.strategy_module, 'khPreMarket'):
+                            # 执行盘前回调
+                            try:
+                                if self.trader_callback:
+                                    self.trader_callback.gui.log_message(f"执行盘前回调 - 日期: {current_date}", "INFO")
+                    
+                                # 设置时间信息为盘前时间
+                                pre_time_info = time_info.copy()
+                                pre_time_info["time"] = pre_market_time
+                                pre_time_info["datetime"] = f"{current_date} {pre_market_time}"
+                    
+                                # 使用当前时间点的数据或创建一个完整的数据结构
+                                pre_data = current_data.copy()
+                                pre_data["__current_time__"] = pre_time_info
+                    
+                                # 确保包含账户和持仓信息
+                                pre_data["__account__"] = self.trade_mgr.assets
+                                pre_data["__positions__"] = self.trade_mgr.positions
+                                pre_data["__stock_list__"] = stock_codes
+                    
+                                # 添加框架实例到数据字典
+                                pre_data["__framework__"] = self
+                    
+                                # 执行盘前回调
+                                pre_signals = self.strategy_module.khPreMarket(pre_data)
+                    
+                                # 处理盘前回调产生的信号
+                                if pre_signals:
+                                    for signal in pre_signals:
+                                        if 'price' in signal:
+                                            signal['price'] = round(float(signal['price']), 2)
+                                        signal['timestamp'] = time_info["timestamp"]
+                    
+                                    # 发送交易指令
+                                    self.trade_mgr.process_signals(pre_signals)
+                            except Exception as e:
+                                if self.trader_callback:
+                                    self.trader_callback.gui.log_message(f"执行盘前回调时出错: {str(e)}", "ERROR")
+                        profiler.end()
+                        if timeframes is not None:
+                            timeframes.position = time_index
+                    profiler.end()
+                    
+                    # 使用触发计划判断是否应该触发策略
+                    trigger_start = profiler.now()
+                    if not trigger_mask[time_index]:
+                        profiler.record("触发器检查", trigger_start)
                         continue
+                    profiler.record("触发器检查", trigger_start)
+                    
+                    # 风控检查
+                    risk_start = profiler.now()
+                    if not self.risk_mgr.check_risk(current_data):
+                        profiler.record("风控检查", risk_start)
+                        continue
+                    profiler.record("风控检查", risk_start)
+                    
+                    # 检查是否是交易日
+                    if not self.trade_day_flags[timeline_meta.day_index[time_index]]:
+                        # 如果不是交易日，跳过策略调用
+                        continue
+                    
+                    # 添加框架实例到数据字典
+                    current_data["__framework__"] = self
+                    
                     # 检查股票数据是否为空
-                    if isinstance(value, pd.Series) and not value.empty:
-                        stock_data_empty = False
-                    elif isinstance(value, pd.Series) and value.empty:
-                        empty_stocks.append(key)
-                    elif not value:  # 处理其他空值情况
-                        empty_stocks.append(key)
-                
-                # 如果所有股票数据都为空，记录错误并跳过策略调用
-                if stock_data_empty:
-                    current_time_str = current_data.get("__current_time__", {}).get("datetime", str(current_time))
-                    if self.trader_callback:
-                        self.trader_callback.gui.log_message(
-                            f"警告: 时间点 {current_time_str} 的所有股票数据为空，跳过策略调用", 
-                            "WARNING"
-                        )
-                        if empty_stocks:
+                    stock_data_empty = True
+                    empty_stocks = []
+                    for key, value in current_data.items():
+                        # 跳过框架内部字段
+                        if key.startswith("__"):
+                            continue
+                        # 检查股票数据是否为空
+                        if isinstance(value, (pd.Series, BarView)) and not value.empty:
+                            stock_data_empty = False
+                        elif isinstance(value, (pd.Series, BarView)) and value.empty:
+                            empty_stocks.append(key)
+                        elif not value:  # 处理其他空值情况
+                            empty_stocks.append(key)
+                    
+                    # 如果所有股票数据都为空，记录错误并跳过策略调用
+                    if stock_data_empty:
+                        current_time_str = current_data.get("__current_time__", {}).get("datetime", str(current_time))
+                        if self.trader_callback:
                             self.trader_callback.gui.log_message(
-                                f"空数据股票列表: {', '.join(empty_stocks[:10])}" + 
-                                (f" 等{len(empty_stocks)}只股票" if len(empty_stocks) > 10 else ""),
+                                f"警告: 时间点 {current_time_str} 的所有股票数据为空，跳过策略调用", 
                                 "WARNING"
                             )
-                    continue
-                
-                # 如果有部分股票数据为空，记录警告但继续执行
-                if empty_stocks:
-                    current_time_str = current_data.get("__current_time__", {}).get("datetime", str(current_time))
-                    if self.trader_callback:
-                        self.trader_callback.gui.log_message(
-                            f"警告: 时间点 {current_time_str} 有 {len(empty_stocks)} 只股票数据为空: {', '.join(empty_stocks[:5])}" + 
-                            (f" 等" if len(empty_stocks) > 5 else ""),
-                            "WARNING"
-                        )
-                
-                # 调用策略处理
-                strategy_start = time.time()
-                signals = self.strategy_module.khHandlebar(current_data)
-                time_stats["策略处理"] += time.time() - strategy_start
-                
-                # 处理信号中的价格精度
-                signal_process_start = time.time()
-                if signals:
-                    for signal in signals:
-                        if 'price' in signal:
-                            # 确保价格保留到0.01
-                            signal['price'] = round(float(signal['price']), 2)
-                        # 添加当前回测时间戳
-                        signal['timestamp'] = current_time
-                time_stats["处理信号"] += time.time() - signal_process_start
-                
-                # 发送交易指令
-                trade_start = time.time()
-                if signals:
-                    self.trade_mgr.process_signals(signals)
-                time_stats["交易指令"] += time.time() - trade_start
-                
-                # 记录结果
-                record_start = time.time()
-                self.record_results(current_time, current_data, signals)
-                time_stats["记录结果"] += time.time() - record_start
-                
-                # 累计总时间
-                time_stats["总时间"] += time.time() - loop_start_time
-            
-            # 输出时间统计信息
-            if self.trader_callback:
-                total_time = time_stats["总时间"]
-                if total_time > 0:
-                    self.trader_callback.gui.log_message("回测各部分执行时间统计:", "INFO")
-                    for key, value in time_stats.items():
-                        if key != "总时间":
-                            percentage = (value / total_time) * 100
-                            self.trader_callback.gui.log_message(f"{key}: {value:.4f}秒 ({percentage:.2f}%)", "INFO")
-                    self.trader_callback.gui.log_message(f"总执行时间: {total_time:.4f}秒", "INFO")
-            
-            # 处理最后一天的盘后回调
-            if current_date is not None and post_market_enabled and hasattr(self.strategy_module, 'khPostMarket'):
-                try:
-                    if self.trader_callback:
-                        self.trader_callback.gui.log_message(f"执行最后一天的盘后回调 - 日期: {current_date}", "INFO")
-                    
-                    # 设置时间信息为盘后时间
-                    time_info = (day_data.get("__current_time__", {}) if day_data else {}).copy()
-                    if not time_info:
-                        # 如果没有时间信息，创建一个默认的
-                        time_info = {
-                            "timestamp": int(time.time()),
-                            "date": current_date,
-                            "time": post_market_time,
-                            "datetime": f"{current_date} {post_market_time}"
-                        }
-                    else:
-                        time_info["time"] = post_market_time
-                        time_info["datetime"] = f"{current_date} {post_market_time}"
-                    
-                    # 使用最后一个时间点的数据或创建一个完整的数据结构
-                    post_data = day_data.copy() if day_data else {}
-                    post_data["__current_time__"] = time_info
-                    
-                    # 添加账户和持仓信息到数据字典
-                    post_data["__account__"] = self.trade_mgr.assets
-                    post_data["__positions__"] = self.trade_mgr.positions
-                    post_data["__stock_list__"] = self.get_stock_list()
+                            if empty_stocks:
+                                self.trader_callback.gui.log_message(
+                                    f"空数据股票列表: {', '.join(empty_stocks[:10])}" + 
+                                    (f" 等{len(empty_stocks)}只股票" if len(empty_stocks) > 10 else ""),
+                                    "WARNING"
+                                )
+                        continue
                     
-                    # 添加框架实例到数据字典
-                    post_data["__framework__"] = self
+                    # 如果有部分股票数据为空，记录警告但继续执行
+                    if empty_stocks:
+                        current_time_str = current_data.get("__current_time__", {}).get("datetime", str(current_time))
+                        if self.trader_callback:
+                            self.trader_callback.gui.log_message(
+                                f"警告: 时间点 {current_time_str} 有 {len(empty_stocks)} 只股票数据为空: {', '.join(empty_stocks[:5])}" + 
+                                (f" 等" if len(empty_stocks) > 5 else ""),
+                                "WARNING"
+                            )
                     
-                    # 执行盘后回调
-                    post_signals = self.strategy_module.khPostMarket(post_data)
+                    # 调用策略处理
+                    with profiler.span("策略处理"):
+                        signals = self.strategy_module.khHandlebar(current_data)
                     
-                    # 处理盘后回调产生的信号
-                    if post_signals:
-                        for signal in post_signals:
+                    # 处理信号中的价格精度
+                    signal_process_start = profiler.now()
+                    if signals:
+                        for signal in signals:
                             if 'price' in signal:
+                                # 确保价格保留到0.01
                                 signal['price'] = round(float(signal['price']), 2)
-                            signal['timestamp'] = time_info["timestamp"]
-                        
-                        # 发送交易指令
-                        self.trade_mgr.process_signals(post_signals)
-                except Exception as e:
+                            # 添加当前回测时间戳
+                            signal['timestamp'] = current_time
+                    profiler.record("处理信号", signal_process_start)
+                    
+                    # 发送交易指令
+                    profiler.begin("交易指令")
+                    if signals:
+                        self.trade_mgr.process_signals(signals)
+                    profiler.end()
+                    
+                    # 记录结果
+                    profiler.begin("记录结果")
+                    self.record_results(current_time, current_data, signals, time_index)
+                    profiler.end()
+                
+                # 每日最后一个时间点记录每个策略的每日统计，不论该时间点是否触发策略、
+                # 是否通过风控检查或有无行情数据（如 1 分钟触发、最后一笔 tick 不在整分钟时）
+                day = timeline_meta.day_index[time_index]
+                if timeline_meta.is_day_end[time_index] and self.trade_day_flags[day]:
+                    profiler.track = ""
+                    profiler.begin("每日统计")
+                    for slot in self.strategy_slots:
+                        self._use_slot(slot)
+                        try:
+                            self._record_daily_stats(timeline_meta.dates[day], timeline_meta.datetime_at(time_index), bar_data)
+                        except Exception as e:
+                            if self.trader_callback:
+                                self.trader_callback.gui.log_message(f"记录每日统计时出错: {str(e)}", "ERROR")
+                            logging.error(f"记录每日统计时出错: {str(e)}", exc_info=True)
+                    profiler.end()
+                
+                if is_new_day:
+                    # 所有策略的盘后回调执行完毕，释放上一交易日的数据
+                    prev_day_data = None
+                self._use_slot(self.strategy_slots[0])
+                profiler.track = ""
+                profiler.end()
+
+            if streaming:
+                # 停止预取线程；中止回测时丢弃尚未使用的预取数据
+                stream_loader.close()
+                if active_segment is None and start_segment is None:
                     if self.trader_callback:
-                        self.trader_callback.gui.log_message(f"执行最后一天的盘后回调时出错: {str(e)}", "ERROR")
+                        self.trader_callback.gui.log_message("错误: 没有找到任何有效的时间点，无法进行回测", "ERROR")
+                    return
+
+            # 输出时间统计信息
+            if self.trader_callback:
+                self._log_profile_summary(profiler)
+            
+            # 处理最后一天的盘后回调（每个策略各执行一次）
+            for slot in self.strategy_slots:
+                self._use_slot(slot)
+                if current_date is not None and post_market_enabled and hasattr(self.strategy_module, 'khPostMarket'):
+                    try:
+                        if self.trader_callback:
+                            self.trader_callback.gui.log_message(f"执行最后一天的盘后回调 - 日期: {current_date}", "INFO")
+                
+                        # 设置时间信息为盘后时间
+                        time_info = (day_data.get("__current_time__", {}) if day_data else {}).copy()
+                        if not time_info:
+                            # 如果没有时间信息，创建一个默认的
+                            time_info = {
+                                "timestamp": int(time.time()),
+                                "date": current_date,
+                                "time": post_market_time,
+                                "datetime": f"{current_date} {post_market_time}"
+                            }
+                        else:
+                            time_info["time"] = post_market_time
+                            time_info["datetime"] = f"{current_date} {post_market_time}"
+                
+                        # 使用最后一个时间点的数据或创建一个完整的数据结构
+                        post_data = day_data.copy() if day_data else {}
+                        post_data["__current_time__"] = time_info
+                
+                        # 添加账户和持仓信息到数据字典
+                        post_data["__account__"] = self.trade_mgr.assets
+                        post_data["__positions__"] = self.trade_mgr.positions
+                        post_data["__stock_list__"] = self.get_stock_list()
                 
-            # 回测完成后清理缓存
+                        # 添加框架实例到数据字典
+                        post_data["__framework__"] = self
+                
+                        # 执行盘后回调
+                        post_signals = self.strategy_module.khPostMarket(post_data)
+                
+                        # 处理盘后回调产生的信号
+                        if post_signals:
+                            for signal in post_signals:
+                                if 'price' in signal:
+                                    signal['price'] = round(float(signal['price']), 2)
+                                signal['timestamp'] = time_info["timestamp"]
+                
+                            # 发送交易指令
+                            self.trade_mgr.process_signals(post_signals)
+                    except Exception as e:
+                        if self.trader_callback:
+                            self.trader_callback.gui.log_message(f"执行最后一天的盘后回调时出错: {str(e)}", "ERROR")
+            self._use_slot(self.strategy_slots[0])
+                
+            # 回测被中止时 is_running 已为 False，中止的回测结果不写入缓存
+            completed = self.is_running
+                
+            # 回测完成后输出缓存统计并清理缓存
+            self._log_cache_stats()
             from khQTTools import clear_khHistory_cache
             clear_khHistory_cache()
 
             # 回测完成后发送信号
-            if self.trader_callback:
-                # 先停止策略并更新状态
-                self.is_running = False
-                self.trader_callback.gui.on_strategy_finished()
-
-                # 显示100%进度
-                self.trader_callback.gui.log_message("回测进度: 100.00%", "INFO")
-
-                # 然后再显示回测结果
-                self.trader_callback.gui.log_message("回测完成", "INFO")
-                QMetaObject.invokeMethod(
-                    self.trader_callback.gui, 
-                    "show_backtest_result", 
-                    Qt.QueuedConnection,
-                    Q_ARG(str, backtest_dir)
-                )
-                
-            # 在回测完成后保存回测记录
-            try:
-                # 获取策略文件名（不含路径和扩展名）
-                strategy_file = self.config.config_dict.get("strategy_file", "")
-                strategy_name = os.path.splitext(os.path.basename(strategy_file))[0] if strategy_file else "unknown"
-                
-                # 生成回测时间戳
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            self._finish_backtest(backtest_dir)
+                
+            # 回测被中止且已有断点时保留断点和分块目录，之后可以用 --resume 继续
+            resumable = not completed and os.path.exists(checkpoint_file)
+            
+            # 在回测完成后保存回测记录，基准数据只获取一次
+            benchmark_df = self._fetch_benchmark_frame()
+            for slot in self.strategy_slots:
+                self._use_slot(slot)
+                self._save_backtest_results(slot, benchmark_df, resumable)
+            self._use_slot(self.strategy_slots[0])
+            
+            if run_keys and completed:
+                self._store_cached_results(run_keys)
+            
+            if completed:
+                # 回测已完成并保存结果，断点不再需要
+                remove_checkpoint(checkpoint_file)
+            elif resumable:
+                message = f"回测已中止，已保留断点 {checkpoint_file}，使用 --resume 可从最近的断点继续"
+                if self.trader_callback:
+                    self.trader_callback.gui.log_message(message, "INFO")
+                logging.info(message)
+            
+            if profile_enabled:
+                self._export_profile(profiler, backtest_dir)
                 
-                # 创建当前回测的子目录（包含策略名）
-                backtest_dir = os.path.join(
-                    "backtest_results",
-                    backtest_dir_name
-                )
+        except Exception as e:
+            error_msg = "回测运行异常: " + str(e)
+            logging.error(error_msg, exc_info=True)
+            # 调用错误回调函数
+            if self.trader_callback:
+                self.trader_callback.gui.log_message(error_msg, "ERROR")
+                import traceback
+                self.trader_callback.gui.log_message(f"错误详情:\n{traceback.format_exc()}", "ERROR")
+            raise  # 重新抛出异常
+        finally:
+            restore_functions(instrumented)
+            set_profiler(None)
+            set_aligned_timeframes(None)
+            self.timeframes = None
+
+    def _log_profile_summary(self, profiler):
+        """输出回测各阶段的执行时间统计"""
+        loop_stats = profiler.stats_by_name("回测循环")
+        if loop_stats is None or loop_stats.total <= 0:
+            return
+        self.trader_callback.gui.log_message("回测各部分执行时间统计:", "INFO")
+        for name in ("构造数据", "构造时间信息", "检查新日期", "盘后回调", "盘前回调", "触发器检查",
+                     "风控检查", "策略处理", "处理信号", "交易指令", "记录结果", *PROFILED_HELPERS, "process_signals"):
+            stats = profiler.stats_by_name(name)
+            if stats is None:
+                continue
+            percentage = (stats.total / loop_stats.total) * 100
+            self.trader_callback.gui.log_message(
+                f"{name}: {stats.total:.4f}秒 ({percentage:.2f}%)，{stats.count}次，"
+                f"P50 {stats.percentile(50) * 1000:.3f}毫秒，P99 {stats.percentile(99) * 1000:.3f}毫秒",
+                "INFO"
+            )
+        self.trader_callback.gui.log_message(f"总执行时间: {loop_stats.total:.4f}秒", "INFO")
 
-                # 如果目录已存在，先删除
-                if os.path.exists(backtest_dir):
-                    shutil.rmtree(backtest_dir)
+    def _preload_history(self, stock_codes: List[str]):
+        """按策略声明的数据需求（DATA_REQUIREMENTS 或 khRequire）预加载 khHistory 缓存
 
-                # 创建新目录
-                os.makedirs(backtest_dir)
+        预加载失败时只记录错误，策略照常在首次使用数据时获取。
+        各组数据的指纹保存在 self._history_fingerprints 中，预加载失败时为 None。
+        """
+        self._history_fingerprints = None
+        try:
+            requirements = collect_history_requirements([slot.strategy_module for slot in self.strategy_slots])
+            if not requirements:
+                self._history_fingerprints = []
+                return
+            preload_start = time.time()
+            summary = preload_history(requirements, stock_codes,
+                                      self.config.backtest_start, self.config.backtest_end)
+            panels = {(group['fre_step'], group['fq']): group['panel'] for group in summary
+                      if group['panel'] is not None}
+            self._history_fingerprints = [
+                {key: group[key] for key in ('fre_step', 'fq', 'fields', 'bar_count', 'fingerprint')}
+                for group in summary
+            ]
+            if panels:
+                self.timeframes = AlignedTimeframes(panels)
+                set_aligned_timeframes(self.timeframes)
+            if self.trader_callback:
+                for group in summary:
+                    self.trader_callback.gui.log_message(
+                        f"预加载历史数据: {group['fre_step']}/{group['fq']} {','.join(group['fields'])}，"
+                        f"回溯{group['bar_count']}根K线，{group['loaded']}/{len(group['symbols'])}只股票", "INFO")
+                self.trader_callback.gui.log_message(f"历史数据预加载耗时: {time.time() - preload_start:.2f}秒", "INFO")
+        except Exception as e:
+            if self.trader_callback:
+                self.trader_callback.gui.log_message(f"预加载历史数据失败，将在首次使用时获取: {str(e)}", "ERROR")
+            logging.error(f"预加载历史数据失败: {str(e)}", exc_info=True)
 
-                # 保存交易记录
-                trades_df = pd.DataFrame(self.backtest_records['trades'])
-                if len(trades_df) > 0:
-                    trades_df.to_csv(os.path.join(backtest_dir, "trades.csv"), index=False, encoding='utf-8-sig')
-                else:
-                    # 创建一个包含列名但没有数据的空DataFrame
-                    empty_trades_df = pd.DataFrame(columns=[
-                        'datetime', 'code', 'action', 'price', 'volume', 'amount',
-                        'commission', 'stamp_tax', 'transfer_fee', 'flow_fee',
-                        'total_asset', 'cash', 'market_value'
-                    ])
-                    empty_trades_df.to_csv(os.path.join(backtest_dir, "trades.csv"), index=False, encoding='utf-8-sig')
-                    if self.trader_callback:
-                        self.trader_callback.gui.log_message("回测期间没有产生交易记录", "WARNING")
+    def _log_cache_stats(self):
+        """输出本次回测各内存缓存的命中、未命中和淘汰统计"""
+        if not self.trader_callback:
+            return
+        self.trader_callback.gui.log_message("内存缓存统计:", "INFO")
+        for line in format_cache_stats():
+            self.trader_callback.gui.log_message(line, "INFO")
+        provider = get_data_provider()
+        if isinstance(provider, DiskCachedDataProvider):
+            s = provider.cache_stats()
+            self.trader_callback.gui.log_message(
+                f"磁盘历史数据缓存: 命中 {s['hits']} 只，未命中 {s['misses']} 只（命中率 {s['hit_rate']:.2%}）", "INFO")
 
-                # 保存每日统计数据
-                daily_stats_df = pd.DataFrame(self.backtest_records['daily_stats'])
-                if len(daily_stats_df) > 0:
-                    daily_stats_df.to_csv(os.path.join(backtest_dir, "daily_stats.csv"), index=False, encoding='utf-8-sig')
-                else:
-                    # 创建一个包含列名但没有数据的空DataFrame
-                    empty_stats_df = pd.DataFrame(columns=[
-                        'date', 'total_asset', 'cash', 'market_value', 
-                        'daily_return', 'benchmark_close', 'positions'
-                    ])
-                    empty_stats_df.to_csv(os.path.join(backtest_dir, "daily_stats.csv"), index=False, encoding='utf-8-sig')
-                    if self.trader_callback:
-                        self.trader_callback.gui.log_message("回测期间没有产生每日统计数据", "WARNING")
-                
-                # 保存基准指数数据
-                benchmark_code = self.config.config_dict["backtest"]["benchmark"]
-                try:
-                    # 使用数据提供者获取基准数据
-                    provider = get_data_provider()
-                    provider.download_history_data(
-                        stock_code=benchmark_code,
-                        period="1d",
-                        start_time=self.config.backtest_start,
-                        end_time=self.config.backtest_end,
+    def _export_profile(self, profiler, backtest_dir: str):
+        """把性能分析汇总表和 Chrome trace 保存到回测目录"""
+        try:
+            summary_file = os.path.join(backtest_dir, "profile_summary.csv")
+            trace_file = os.path.join(backtest_dir, "profile_trace.json")
+            profiler.export_summary(summary_file)
+            profiler.export_chrome_trace(trace_file)
+            if self.trader_callback:
+                self.trader_callback.gui.log_message(
+                    f"性能分析结果已保存: {summary_file}，{trace_file}（可在 chrome://tracing 中打开）", "INFO")
+                if profiler.dropped_events:
+                    self.trader_callback.gui.log_message(
+                        f"调用记录超过上限，Chrome trace 中省略了 {profiler.dropped_events} 次调用（汇总表仍包含全部调用）",
+                        "WARNING"
                     )
+        except Exception as e:
+            if self.trader_callback:
+                self.trader_callback.gui.log_message(f"保存性能分析结果失败: {str(e)}", "ERROR")
+            logging.error(f"保存性能分析结果失败: {str(e)}", exc_info=True)
 
-                    benchmark_data = provider.get_market_data(
-                        field_list=['time', 'close'],
-                        stock_list=[benchmark_code],
-                        period='1d',
-                        start_time=self.config.backtest_start,
-                        end_time=self.config.backtest_end
-                    )
-                    
-                    if self.trader_callback:
-                        self.trader_callback.gui.log_message(
-                            f"基准数据获取结果: {benchmark_data.keys()}",
-                            "INFO"
-                        )
+    def _finish_backtest(self, backtest_dir: str):
+        """回测结束：更新运行状态、上报100%进度并打开回测结果
+        
+        Args:
+            backtest_dir: （主策略的）回测结果目录
+        """
+        if not self.trader_callback:
+            return
+        # 先停止策略并更新状态
+        self.is_running = False
+        self.trader_callback.gui.on_strategy_finished()
 
-                    # V2.2.3.1修复：支持DataFrame和Dict两种格式的基准数据
-                    if benchmark_data and benchmark_code in benchmark_data:
-                        stock_data = benchmark_data[benchmark_code]
-                        closes = None
-                        dates = None
-
-                        # 统一的数据提取逻辑
-                        if isinstance(stock_data, pd.DataFrame):
-                            # DataFrame格式处理 (V2.2.3新格式)
-                            if 'close' not in stock_data.columns:
-                                if self.trader_callback:
-                                    self.trader_callback.gui.log_message(
-                                        f"基准指数 {benchmark_code} DataFrame中没有close列",
-                                        "WARNING"
-                                    )
-                            else:
-                                closes = stock_data['close']
-
-                                # 获取时间信息 (优先级: time列 > DatetimeIndex > 降级方案)
-                                if 'time' in stock_data.columns and len(stock_data['time']) > 0:
-                                    # 从time列提取时间戳
-                                    dates = pd.to_datetime(stock_data['time'], unit='ms')
-                                elif isinstance(stock_data.index, pd.DatetimeIndex):
-                                    # 从DatetimeIndex提取时间
-                                    dates = stock_data.index
-                                else:
-                                    # 降级方案: 使用日期范围
-                                    if self.trader_callback:
-                                        self.trader_callback.gui.log_message(
-                                            "警告：基准数据中没有时间信息，将使用日期范围替代",
-                                            "WARNING"
-                                        )
-                                    dates = pd.date_range(
-                                        start=pd.to_datetime(self.config.backtest_start, format='%Y%m%d'),
-                                        end=pd.to_datetime(self.config.backtest_end, format='%Y%m%d'),
-                                        freq='B'
-                                    )[:len(closes)]
-
-                        elif isinstance(stock_data, dict):
-                            # Dict格式处理 (旧版兼容)
-                            if 'close' not in stock_data or len(stock_data['close']) == 0:
-                                if self.trader_callback:
-                                    self.trader_callback.gui.log_message(
-                                        f"基准指数 {benchmark_code} Dict中没有close键",
-                                        "WARNING"
-                                    )
-                            else:
-                                closes = stock_data['close']
-
-                                # 获取时间信息
-                                if 'time' in stock_data and len(stock_data['time']) > 0:
-                                    dates = pd.to_datetime(stock_data['time'], unit='ms')
-                                else:
-                                    if self.trader_callback:
-                                        self.trader_callback.gui.log_message(
-                                            "警告：基准数据中没有时间信息，将使用日期范围替代",
-                                            "WARNING"
-                                        )
-                                    dates = pd.date_range(
-                                        start=pd.to_datetime(self.config.backtest_start, format='%Y%m%d'),
-                                        end=pd.to_datetime(self.config.backtest_end, format='%Y%m%d'),
-                                        freq='B'
-                                    )[:len(closes)]
-                        else:
-                            if self.trader_callback:
-                                self.trader_callback.gui.log_message(
-                                    f"基准指数 {benchmark_code} 数据格式不支持: {type(stock_data)}",
-                                    "WARNING"
-                                )
+        # 显示100%进度
+        self.trader_callback.gui.log_message("回测进度: 100.00%", "INFO")
+
+        # 然后再显示回测结果
+        self.trader_callback.gui.log_message("回测完成", "INFO")
+        if self.headless:
+            self.trader_callback.gui.show_backtest_result(backtest_dir)
+        else:
+            QMetaObject.invokeMethod(
+                self.trader_callback.gui, 
+                "show_backtest_result", 
+                Qt.QueuedConnection,
+                Q_ARG(str, backtest_dir)
+            )
 
-                        # 保存基准数据
-                        if closes is not None and dates is not None:
-                            df = pd.DataFrame({
-                                'date': dates,
-                                'close': closes
-                            })
+    def _collect_strategy_fingerprints(self) -> Optional[List[Dict[str, Any]]]:
+        """记录每个策略的源码摘要和策略参数，无法读取策略源码时返回 None（不使用回测结果缓存）"""
+        try:
+            return [
+                strategy_fingerprint(getattr(slot.strategy_module, '__file__', None) or slot.strategy_file,
+                                     slot.strategy_module)
+                for slot in self.strategy_slots
+            ]
+        except Exception as e:
+            logging.warning(f"读取策略源码失败，不使用回测结果缓存: {str(e)}")
+            return None
 
-                            benchmark_file = os.path.join(backtest_dir, "benchmark.csv")
-                            df.to_csv(benchmark_file, index=False)
+    def _run_cache_keys(self, stock_codes: List[str], daily_data: Dict[str, pd.DataFrame], data_period: str,
+                        period_fingerprint: Optional[Dict[str, Any]]) -> Optional[List[str]]:
+        """计算每个策略的回测结果缓存键
+        
+        行情数据指纹包含回测实际加载的每个周期的数据：日线收盘价、主周期数据（如 1m/5m/tick）
+        和 khRequire 预加载的各组历史数据，每只股票记录行数和最后一个时间戳。
+        流式模式（主周期数据逐日加载）或历史数据预加载失败时无法得到完整指纹，不使用缓存。
+        
+        Args:
+            stock_codes: 股票池
+            daily_data: 预加载的股票池和基准指数日线数据
+            data_period: 主周期
+            period_fingerprint: 主周期数据的 data_fingerprint，流式模式下为 None
+            
+        Returns:
+            Optional[List[str]]: 与 strategy_slots 一一对应的缓存键，未启用缓存时返回 None
+        """
+        if not self.config.config_dict["backtest"].get("run_cache", False):
+            return None
+        fingerprints = getattr(self, '_strategy_fingerprints', None)
+        history_fingerprints = getattr(self, '_history_fingerprints', None)
+        if not fingerprints or not daily_data:
+            return None
+        if period_fingerprint is None or history_fingerprints is None:
+            if self.trader_callback:
+                self.trader_callback.gui.log_message(
+                    "流式模式或历史数据预加载失败，无法计算完整的行情数据指纹，本次不使用回测结果缓存", "INFO")
+            return None
+        shared = [
+            config_fingerprint(self.config.config_dict, stock_codes),
+            type(get_data_provider()).__name__,
+            {'1d': data_fingerprint(daily_data), data_period: period_fingerprint, 'history': history_fingerprints},
+        ]
+        return [run_cache_key(fingerprint, *shared) for fingerprint in fingerprints]
+
+    def _restore_cached_results(self, run_keys: List[str]) -> bool:
+        """所有策略都命中缓存时，把缓存的回测结果复制到各自的回测目录并结束回测
+        
+        Returns:
+            bool: 是否命中缓存
+        """
+        cache = RunCache()
+        if not all(cache.lookup(key) for key in run_keys):
+            return False
+        try:
+            for slot, key in zip(self.strategy_slots, run_keys):
+                cache.restore(key, slot.backtest_dir)
+        except Exception as e:
+            if self.trader_callback:
+                self.trader_callback.gui.log_message(f"读取回测结果缓存失败，重新运行回测: {str(e)}", "WARNING")
+            logging.error(f"读取回测结果缓存失败: {str(e)}", exc_info=True)
+            for slot in self.strategy_slots:
+                os.makedirs(slot.backtest_dir, exist_ok=True)
+            return False
+        for slot in self.strategy_slots:
+            slot.results_writer.close(remove=True)
+        
+        if self.trader_callback:
+            for slot, key in zip(self.strategy_slots, run_keys):
+                self.trader_callback.gui.log_message(
+                    f"命中回测结果缓存: {slot.name}（策略、配置和行情数据均未变化），结果已复制到 {slot.backtest_dir}",
+                    "INFO"
+                )
+        self._finish_backtest(self.strategy_slots[0].backtest_dir)
+        return True
+
+    def _store_cached_results(self, run_keys: List[str]):
+        """把每个策略的回测结果目录写入回测结果缓存"""
+        cache = RunCache()
+        for slot, key in zip(self.strategy_slots, run_keys):
+            try:
+                cache.store(key, slot.backtest_dir, {'strategy': slot.name, 'strategy_file': slot.strategy_file})
+            except Exception as e:
+                logging.error(f"写入回测结果缓存失败: {str(e)}", exc_info=True)
 
+    def _fetch_benchmark_frame(self) -> Optional[pd.DataFrame]:
+        """回测结束后获取基准指数在回测区间内的日线收盘价（多策略回测时只获取一次）
+        
+        Returns:
+            Optional[pd.DataFrame]: 包含 date、close 两列的基准数据，获取失败时返回 None
+        """
+        benchmark_code = self.config.config_dict["backtest"]["benchmark"]
+        try:
+            # 使用数据提供者获取基准数据
+            provider = get_data_provider()
+            provider.download_history_data(
+                stock_code=benchmark_code,
+                period="1d",
+                start_time=self.config.backtest_start,
+                end_time=self.config.backtest_end,
+            )
+
+            benchmark_data = provider.get_market_data(
+                field_list=['time', 'close'],
+                stock_list=[benchmark_code],
+                period='1d',
+                start_time=self.config.backtest_start,
+                end_time=self.config.backtest_end
+            )
+
+            if self.trader_callback:
+                self.trader_callback.gui.log_message(
+                    f"基准数据获取结果: {benchmark_data.keys()}",
+                    "INFO"
+                )
+
+            # V2.2.3.1修复：支持DataFrame和Dict两种格式的基准数据
+            if benchmark_data and benchmark_code in benchmark_data:
+                stock_data = benchmark_data[benchmark_code]
+                closes = None
+                dates = None
+
+                # 统一的数据提取逻辑
+                if isinstance(stock_data, pd.DataFrame):
+                    # DataFrame格式处理 (V2.2.3新格式)
+                    if 'close' not in stock_data.columns:
+                        if self.trader_callback:
+                            self.trader_callback.gui.log_message(
+                                f"基准指数 {benchmark_code} DataFrame中没有close列",
+                                "WARNING"
+                            )
+                    else:
+                        closes = stock_data['close']
+
+                        # 获取时间信息 (优先级: time列 > DatetimeIndex > 降级方案)
+                        if 'time' in stock_data.columns and len(stock_data['time']) > 0:
+                            # 从time列提取时间戳
+                            dates = pd.to_datetime(stock_data['time'], unit='ms')
+                        elif isinstance(stock_data.index, pd.DatetimeIndex):
+                            # 从DatetimeIndex提取时间
+                            dates = stock_data.index
+                        else:
+                            # 降级方案: 使用日期范围
                             if self.trader_callback:
                                 self.trader_callback.gui.log_message(
-                                    f"基准指数数据已保存到 {benchmark_file}, 共 {len(df)} 条记录",
-                                    "INFO"
+                                    "警告：基准数据中没有时间信息，将使用日期范围替代",
+                                    "WARNING"
                                 )
-                    else:
+                            dates = pd.date_range(
+                                start=pd.to_datetime(self.config.backtest_start, format='%Y%m%d'),
+                                end=pd.to_datetime(self.config.backtest_end, format='%Y%m%d'),
+                                freq='B'
+                            )[:len(closes)]
+
+                elif isinstance(stock_data, dict):
+                    # Dict格式处理 (旧版兼容)
+                    if 'close' not in stock_data or len(stock_data['close']) == 0:
                         if self.trader_callback:
                             self.trader_callback.gui.log_message(
-                                f"基准指数 {benchmark_code} 数据获取失败（返回数据格式错误）",
+                                f"基准指数 {benchmark_code} Dict中没有close键",
                                 "WARNING"
                             )
-                except Exception as e:
+                    else:
+                        closes = stock_data['close']
+
+                        # 获取时间信息
+                        if 'time' in stock_data and len(stock_data['time']) > 0:
+                            dates = pd.to_datetime(stock_data['time'], unit='ms')
+                        else:
+                            if self.trader_callback:
+                                self.trader_callback.gui.log_message(
+                                    "警告：基准数据中没有时间信息，将使用日期范围替代",
+                                    "WARNING"
+                                )
+                            dates = pd.date_range(
+                                start=pd.to_datetime(self.config.backtest_start, format='%Y%m%d'),
+                                end=pd.to_datetime(self.config.backtest_end, format='%Y%m%d'),
+                                freq='B'
+                            )[:len(closes)]
+                else:
                     if self.trader_callback:
-                        self.trader_callback.gui.log_message(f"获取基准指数数据时出错: {str(e)}", "ERROR")
-                    logging.error(f"获取基准指数数据时出错: {str(e)}", exc_info=True)
-                
-                # 保存回测配置信息
-                config_info = {
-                    'start_time': self.backtest_records['start_time'],
-                    'end_time': self.backtest_records['end_time'],
-                    'init_capital': self.backtest_records['init_capital'],
-                    'benchmark': self.config.config_dict["backtest"]["benchmark"],
-                    'strategy_file': self.config.config_dict.get("strategy_file", ""),  # 从配置字典中获取策略文件路径
-                    'actual_start_time': datetime.datetime.fromtimestamp(self.start_time).strftime("%Y-%m-%d %H:%M:%S") if self.start_time else "",
-                    'actual_end_time': datetime.datetime.fromtimestamp(self.end_time).strftime("%Y-%m-%d %H:%M:%S") if self.end_time else "",
-                    'total_runtime_seconds': self.total_runtime,
-                    'total_runtime_formatted': self._format_runtime(self.total_runtime)
-                }
-                pd.DataFrame([config_info]).to_csv(os.path.join(backtest_dir, "config.csv"), index=False, encoding='utf-8-sig')
-                
+                        self.trader_callback.gui.log_message(
+                            f"基准指数 {benchmark_code} 数据格式不支持: {type(stock_data)}",
+                            "WARNING"
+                        )
+
+                if closes is not None and dates is not None:
+                    return pd.DataFrame({
+                        'date': dates,
+                        'close': closes
+                    })
+            else:
                 if self.trader_callback:
                     self.trader_callback.gui.log_message(
-                        f"回测记录已保存到目录: {backtest_dir}", 
-                        "INFO"
+                        f"基准指数 {benchmark_code} 数据获取失败（返回数据格式错误）",
+                        "WARNING"
                     )
-                    # 记录回测总耗时
+        except Exception as e:
+            if self.trader_callback:
+                self.trader_callback.gui.log_message(f"获取基准指数数据时出错: {str(e)}", "ERROR")
+            logging.error(f"获取基准指数数据时出错: {str(e)}", exc_info=True)
+        return None
+    
+    def _save_backtest_results(self, slot: StrategySlot, benchmark_df: Optional[pd.DataFrame],
+                               resumable: bool = False):
+        """回测完成后把一个策略的回测记录导出到其回测目录
+        
+        Args:
+            slot: 策略槽位（调用前已通过 _use_slot 切换）
+            benchmark_df: 基准指数日线数据，为 None 时不保存 benchmark.csv
+            resumable: 回测被中止且可以断点续跑，保留回测目录中的断点文件和分块目录
+        """
+        backtest_dir = slot.backtest_dir
+        try:
+            # 如果目录已存在，先删除（可以断点续跑时保留断点文件）
+            if os.path.exists(backtest_dir):
+                if resumable:
+                    for name in os.listdir(backtest_dir):
+                        if name.startswith(CHECKPOINT_FILE):
+                            continue
+                        path = os.path.join(backtest_dir, name)
+                        if os.path.isdir(path):
+                            shutil.rmtree(path)
+                        else:
+                            os.remove(path)
+                else:
+                    shutil.rmtree(backtest_dir)
+
+            # 创建新目录
+            os.makedirs(backtest_dir, exist_ok=True)
+
+            # 从分块文件流式导出交易记录、每日统计和持仓明细
+            row_counts = self.results_writer.export_csv(backtest_dir)
+            if row_counts['trades'] == 0 and self.trader_callback:
+                self.trader_callback.gui.log_message("回测期间没有产生交易记录", "WARNING")
+            if row_counts['daily_stats'] == 0 and self.trader_callback:
+                self.trader_callback.gui.log_message("回测期间没有产生每日统计数据", "WARNING")
+            # 分块文件（Parquet/CSV）保留在回测目录的 records 子目录中；
+            # 可以断点续跑时分块目录留在原处，继续回测时从断点状态恢复
+            if not resumable:
+                self.results_writer.close()
+                os.replace(self.results_writer.directory, os.path.join(backtest_dir, "records"))
+            
+            # 保存基准指数数据
+            if benchmark_df is not None:
+                benchmark_file = os.path.join(backtest_dir, "benchmark.csv")
+                benchmark_df.to_csv(benchmark_file, index=False)
+                if self.trader_callback:
                     self.trader_callback.gui.log_message(
-                        f"回测总耗时: {self._format_runtime(self.total_runtime)}", 
+                        f"基准指数数据已保存到 {benchmark_file}, 共 {len(benchmark_df)} 条记录",
                         "INFO"
                     )
-                
-            except Exception as e:
-                if self.trader_callback:
-                    self.trader_callback.gui.log_message(f"保存回测记录时出错: {str(e)}", "ERROR")
-                logging.error(f"保存回测记录时出错: {str(e)}", exc_info=True)
-                
-        except Exception as e:
-            error_msg = "回测运行异常: " + str(e)
-            logging.error(error_msg, exc_info=True)
-            # 调用错误回调函数
+            
+            # 保存回测配置信息
+            config_info = {
+                'start_time': self.backtest_records['start_time'],
+                'end_time': self.backtest_records['end_time'],
+                'init_capital': self.backtest_records['init_capital'],
+                'benchmark': self.config.config_dict["backtest"]["benchmark"],
+                'strategy_file': slot.strategy_file,
+                'actual_start_time': datetime.datetime.fromtimestamp(self.start_time).strftime("%Y-%m-%d %H:%M:%S") if self.start_time else "",
+                'actual_end_time': datetime.datetime.fromtimestamp(self.end_time).strftime("%Y-%m-%d %H:%M:%S") if self.end_time else "",
+                'total_runtime_seconds': self.total_runtime,
+                'total_runtime_formatted': self._format_runtime(self.total_runtime)
+            }
+            pd.DataFrame([config_info]).to_csv(os.path.join(backtest_dir, "config.csv"), index=False, encoding='utf-8-sig')
+
             if self.trader_callback:
-                self.trader_callback.gui.log_message(error_msg, "ERROR")
-                import traceback
-                self.trader_callback.gui.log_message(f"错误详情:\n{traceback.format_exc()}", "ERROR")
-            raise  # 重新抛出异常
+                self.trader_callback.gui.log_message(
+                    f"回测记录已保存到目录: {backtest_dir}", 
+                    "INFO"
+                )
+                # 记录回测总耗时
+                self.trader_callback.gui.log_message(
+                    f"回测总耗时: {self._format_runtime(self.total_runtime)}", 
+                    "INFO"
+                )
 
-    def record_results(self, timestamp, data, signals):
+        except Exception as e:
+            if self.trader_callback:
+                self.trader_callback.gui.log_message(f"保存回测记录时出错: {str(e)}", "ERROR")
+            logging.error(f"保存回测记录时出错: {str(e)}", exc_info=True)
+    
+    def record_results(self, timestamp, data, signals, time_index: Optional[int] = None):
         """记录回测结果
         
         Args:
             timestamp: 当前时间戳
             data: 当前市场数据
             signals: 交易信号列表
+            time_index: 当前时间点在统一时间轴中的下标，为 None 时按时间戳查找
         """
         try:
-            # 获取当前时间信息
-            current_time_info = data.get("__current_time__", {})
-            current_ts = current_time_info.get("timestamp", timestamp)
-            current_datetime = current_time_info.get("datetime", "")
-            current_date = current_time_info.get("date", "")
-            current_time = current_time_info.get("time", "")
-            
-            # 检查是否是交易日
-            is_trading_day = self.tools.is_trade_day(current_date)
+            # 时间信息直接从预先计算的时间元数据中查询
+            meta = self.timeline_meta
+            if time_index is None:
+                time_index = meta.index_of(timestamp)
+            day = meta.day_index[time_index]
+            current_ts = data.get("__current_time__", {}).get("timestamp", timestamp)
+            
+            # 检查是否是交易日（每日判断结果在回测开始前已计算）
+            is_trading_day = bool(self.trade_day_flags[day])
             if not is_trading_day:
                 # 如果不是交易日，则跳过策略调用
                 if self.trader_callback:
-                    self.trader_callback.gui.log_message(f"日期 {current_date} 不是交易日，跳过策略执行", "INFO")
+                    self.trader_callback.gui.log_message(f"日期 {meta.date_strings[day]} 不是交易日，跳过策略执行", "INFO")
                 return
             
             # 记录交易信号
@@ -2373,61 +2499,10 @@ class KhQuantFramework:
                     if timestamp_ms < 1e10:
                         timestamp_ms *= 1000
             
-            # 1. 时间戳处理优化 - 使用缓存和类型检查优化
-            if isinstance(timestamp, str):
-                if hasattr(self, '_cached_timestamp') and self._cached_timestamp.get('str') == timestamp:
-                    current_time = self._cached_timestamp.get('datetime')
-                    current_date = self._cached_timestamp.get('date')
-                    current_ts_seconds = self._cached_timestamp.get('ts_seconds')
-                else:
-                    current_time = datetime.datetime.strptime(timestamp, "%Y%m%d%H%M%S")
-                    current_date = current_time.date()
-                    current_ts_seconds = current_time.timestamp()
-                    self._cached_timestamp = {
-                        'str': timestamp,
-                        'datetime': current_time,
-                        'date': current_date,
-                        'ts_seconds': current_ts_seconds
-                    }
-            else:
-                # 数字时间戳处理
-                ts_float = float(timestamp)
-                # 统一转换为秒级时间戳
-                ts_seconds = ts_float / 1000 if ts_float > 1e10 else ts_float
-                
-                # 使用缓存检查是否与上次时间戳相近（避免重复转换相近时间戳）
-                if hasattr(self, '_cached_timestamp') and abs(self._cached_timestamp.get('ts_seconds', 0) - ts_seconds) < 0.1:
-                    current_time = self._cached_timestamp.get('datetime')
-                    current_date = self._cached_timestamp.get('date')
-                    current_ts_seconds = self._cached_timestamp.get('ts_seconds')
-                else:
-                    current_time = datetime.datetime.fromtimestamp(ts_seconds)
-                    current_date = current_time.date()
-                    current_ts_seconds = ts_seconds
-                    self._cached_timestamp = {
-                        'ts_seconds': ts_seconds,
-                        'datetime': current_time,
-                        'date': current_date
-                    }
+            current_date = meta.dates[day]
+            # datetime 对象只在记录交易时需要
+            current_time = meta.datetime_at(time_index) if signals else None
             
-            # 2. 交易日检查优化 - 使用缓存避免重复查询
-            cache_key = f"trade_day_{current_date}"
-            if hasattr(self, '_cached_trade_days') and cache_key in self._cached_trade_days:
-                is_trading_day = self._cached_trade_days[cache_key]
-            else:
-                if not hasattr(self, '_cached_trade_days'):
-                    self._cached_trade_days = {}
-                    
-                try:
-                    # 使用KhQuTools的is_trade_day方法进行统一的交易日判断
-                    date_str = current_date.strftime("%Y-%m-%d")
-                    is_trading_day = self.tools.is_trade_day(date_str)
-                    # 缓存结果
-                    self._cached_trade_days[cache_key] = is_trading_day
-                except Exception as e:
-                    logging.warning(f"检查交易日失败: {str(e)}")
-                    is_trading_day = True  # 出错默认为交易日
-                    
             # 3. 持仓更新优化 - 预先获取并缓存持仓列表
             positions = self.trade_mgr.positions
             position_codes = list(positions.keys())
@@ -2503,7 +2578,7 @@ class KhQuantFramework:
                 market_value = assets['market_value']
                 
                 # 使用列表推导式批量处理信号
-                self.backtest_records['trades'].extend([
+                self.results_writer.add_trades([
                     {
                         'datetime': current_time,
                         'code': signal['code'],
@@ -2554,102 +2629,404 @@ class KhQuantFramework:
                     for signal in signals
                 ])
             
-            # 8. 最后时间点判断优化
-            # 使用函数字典替代if-else判断
-            is_last_time_point = False
-            
-            if isinstance(self.trigger, CustomTimeTrigger):
-                # 对于自定义时间触发，使用缓存优化
-                trigger_seconds = self.trigger.trigger_seconds
-                if trigger_seconds:
-                    # 缓存当天的触发时间点
-                    cache_key = f"time_points_{current_date}"
-                    if not hasattr(self, '_cached_time_points') or cache_key not in self._cached_time_points:
-                        if not hasattr(self, '_cached_time_points'):
-                            self._cached_time_points = {}
-                            
-                        # 获取当天所有触发时间点并缓存
-                        today_times = []
-                        max_trigger_second = max(trigger_seconds)
-                        
-                        # 使用列表推导式优化循环
-                        today_times = [
-                            int(datetime.datetime.combine(current_date, datetime.time(
-                                seconds // 3600,
-                                (seconds % 3600) // 60,
-                                seconds % 60
-                            )).timestamp())
-                            for seconds in trigger_seconds
-                        ]
-                        
-                        # 缓存计算结果
-                        self._cached_time_points[cache_key] = {
-                            'times': sorted(today_times),
-                            'max_second': max_trigger_second
-                        }
-                    
-                    # 使用缓存数据
-                    max_trigger_second = self._cached_time_points[cache_key]['max_second']
-                    
-                    # 计算当前时间点的秒数(使用已有变量避免重复计算)
-                    current_ts_dt = current_time
-                    current_seconds = current_ts_dt.hour * 3600 + current_ts_dt.minute * 60 + current_ts_dt.second
-                    
-                    # 检查是否是当天最后一个触发点
-                    is_last_time_point = abs(current_seconds - max_trigger_second) < 0.1
-            else:
-                # 非自定义时间触发，使用all_times缓存优化
-                cache_key = f"daily_times_{current_date}"
-                if not hasattr(self, '_cached_daily_times') or cache_key not in self._cached_daily_times:
-                    if not hasattr(self, '_cached_daily_times'):
-                        self._cached_daily_times = {}
-                        
-                    # 获取当天的时间点，使用生成器表达式优化
-                    today_times = []
-                    
-                    # 使用列表推导式和异常处理优化
-                    try:
-                        today_times = [
-                            t for t in self.all_times
-                            if datetime.datetime.fromtimestamp(
-                                float(t) / 1000 if float(t) > 1e10 else float(t)
-                            ).date() == current_date
-                        ]
-                    except Exception:
-                        # 出错时使用传统循环方式作为备选
-                        for t in self.all_times:
-                            try:
-                                t_float = float(t)
-                                t_seconds = t_float / 1000 if t_float > 1e10 else t_float
-                                t_time = datetime.datetime.fromtimestamp(t_seconds)
-                                
-                                if t_time.date() == current_date:
-                                    today_times.append(t)
-                            except Exception:
-                                continue
-                    
-                    # 缓存结果
-                    self._cached_daily_times[cache_key] = sorted(today_times)
-                
-                # 使用缓存的时间点
-                today_times = self._cached_daily_times[cache_key]
-                
-                # 检查是否是最后时间点
-                if today_times:
-                    # 直接使用数值比较，避免创建新的datetime对象
-                    last_time = float(today_times[-1])
-                    last_time_seconds = last_time / 1000 if last_time > 1e10 else last_time
-                    is_last_time_point = abs(last_time_seconds - current_ts_seconds) < 0.1
-            
-            # 9. 每日统计记录优化 - 只在最后时间点记录
-            if is_last_time_point and is_trading_day:
-                self._record_daily_stats(current_date, current_time, data)
+            # 每日统计由回测循环在每日最后一个时间点记录（不论该时间点是否触发策略）
             
         except Exception as e:
             if self.trader_callback:
                 self.trader_callback.gui.log_message(f"记录回测结果时出错: {str(e)}", "ERROR")
             logging.error(f"记录回测结果时出错: {str(e)}", exc_info=True)
     
+    def _resolve_data_period(self, period: str) -> str:
+        """确定实际加载的数据周期
+        
+        触发器需要秒级数据（"1s"）时：自定义定时触发的时间点都是整分钟则使用1分钟K线，
+        否则使用tick数据。
+        """
+        if period != "1s":
+            return period
+        if isinstance(self.trigger, CustomTimeTrigger):
+            # 检查所有触发时间点是否都是整分钟（秒数为0）
+            if all(seconds % 60 == 0 for seconds in self.trigger.trigger_seconds):
+                if self.trader_callback:
+                    self.trader_callback.gui.log_message(f"所有自定义时间点都是整分钟，使用1分钟K线数据", "INFO")
+                return "1m"
+            if self.trader_callback:
+                self.trader_callback.gui.log_message(f"存在非整分钟的自定义时间点，使用tick数据", "INFO")
+        # 默认使用tick数据
+        return "tick"
+    
+    def _load_historical_data(self, stock_codes: List[str], period: str, start_time: str, end_time: str,
+                              verbose: bool = True) -> Dict[str, pd.DataFrame]:
+        """逐只股票加载 [start_time, end_time] 区间的历史数据
+        
+        Args:
+            stock_codes: 股票代码列表
+            period: 数据周期
+            start_time: 开始日期，格式 YYYYMMDD
+            end_time: 结束日期，格式 YYYYMMDD
+            verbose: 是否输出日志，流式模式在后台线程加载时为 False
+            
+        Returns:
+            Dict[str, pd.DataFrame]: {股票代码: 历史数据}，回测被中止时可能不完整
+        """
+        log = self.trader_callback.gui.log_message if (verbose and self.trader_callback) else None
+        
+        # 确保field_list中包含time和close字段
+        field_list = self.config.config_dict["data"]["fields"]
+        if "time" not in field_list:
+            field_list = ["time"] + field_list
+        if "close" not in field_list:
+            field_list = field_list + ["close"]
+        
+        historical_data = {}
+        for code in stock_codes:
+            if not self.is_running:
+                break
+                
+            if log:
+                log(f"加载{code}的历史数据...", "INFO")
+            
+            # 使用数据提供者获取市场数据
+            provider = get_data_provider()
+            data = provider.get_market_data(
+                field_list=field_list,
+                stock_list=[code],
+                period=period,
+                start_time=start_time,
+                end_time=end_time,
+                dividend_type=self.config.config_dict["data"]["dividend_type"],
+                fill_data=True
+            )
+            if data and code in data:
+                # 判断是否为自定义时间触发
+                if isinstance(self.trigger, CustomTimeTrigger):
+                    # 对于自定义时间触发，只保留触发时间点附近的数据
+                    df = data[code]
+                    if 'time' in df.columns:
+                        # 检查是否接近任一触发时间点（允许1秒误差）
+                        all_timestamps = df['time'].values.astype(np.int64)
+                        near_mask = self.trigger.near_trigger_times(all_timestamps, 1, inclusive=True)
+                        
+                        # 只保留触发时间点附近的数据
+                        if near_mask.any():
+                            filtered_df = df[near_mask]
+                            historical_data[code] = filtered_df
+                            if log:
+                                log(f"自定义时间触发: {code}过滤后保留{len(filtered_df)}个时间点，原始数据有{len(df)}个时间点", "INFO")
+                        else:
+                            # 如果没有找到匹配的时间点，仍然保存原始数据
+                            historical_data[code] = df
+                            if log:
+                                log(f"警告: {code}没有找到匹配的自定义时间点，使用原始数据", "WARNING")
+                    else:
+                        # 如果没有time列，使用原始数据
+                        historical_data[code] = data[code]
+                        if log:
+                            log(f"警告: {code}的数据中没有time列，无法按自定义时间过滤", "WARNING")
+                else:
+                    # 非自定义时间触发，直接存储DataFrame
+                    historical_data[code] = data[code]
+        return historical_data
+    
+    def _trading_days_between(self, start_time: str, end_time: str) -> List[datetime.date]:
+        """获取 [start_time, end_time] 区间内的交易日（使用KhQuTools的真实交易日判断，排除节假日）"""
+        current_date = datetime.datetime.strptime(start_time, "%Y%m%d").date()
+        end_date = datetime.datetime.strptime(end_time, "%Y%m%d").date()
+        trading_days = []
+        while current_date <= end_date:
+            if self.tools.is_trade_day(current_date.strftime("%Y-%m-%d")):
+                trading_days.append(current_date)
+            current_date += datetime.timedelta(days=1)
+        return trading_days
+    
+    def _custom_timeline(self, trading_days: List[datetime.date]) -> np.ndarray:
+        """为每个交易日生成自定义触发时间点（秒级时间戳，已排序去重）"""
+        custom_timeline = []
+        for day in trading_days:
+            for seconds in self.trigger.trigger_seconds:
+                # 将秒数转换为时分秒，创建完整的datetime对象
+                h = seconds // 3600
+                m = (seconds % 3600) // 60
+                s = seconds % 60
+                dt = datetime.datetime.combine(day, datetime.time(h, m, s))
+                custom_timeline.append(int(dt.timestamp()))
+        return np.unique(np.asarray(custom_timeline, dtype=np.int64))
+    
+    def _build_segment(self, historical_data: Dict[str, pd.DataFrame], custom_timeline: Optional[np.ndarray] = None,
+                       key: str = "all", verbose: bool = True) -> Optional[SimpleNamespace]:
+        """把一段历史数据构建为回测数据段：统一时间轴、时间元数据、行情面板和触发计划
+        
+        Args:
+            historical_data: {股票代码: 历史数据}
+            custom_timeline: 自定义触发时间轴，为 None 时使用数据自身的时间点
+            key: 数据段标识，整段回测为 "all"，流式模式为交易日 YYYYMMDD
+            verbose: 是否输出日志，流式模式在后台线程构建时为 False
+            
+        Returns:
+            Optional[SimpleNamespace]: 数据段，没有任何有效时间点时返回 None
+        """
+        log = self.trader_callback.gui.log_message if (verbose and self.trader_callback) else None
+        
+        # 向量化构建统一时间轴（int64）及每只股票在时间轴上的行号（-1 表示无数据）
+        if log:
+            log("正在构建统一时间轴...", "INFO")
+        all_times, panel_positions = build_timeline(historical_data, custom_timeline)
+        
+        for code in historical_data:
+            if code not in panel_positions:
+                if log:
+                    log(f"错误: {code}的数据中没有找到任何时间字段，跳过该股票", "ERROR")
+                else:
+                    logging.warning(f"{key}: {code}的数据中没有找到任何时间字段，跳过该股票")
+        
+        if len(all_times) == 0:
+            if log:
+                log("错误: 没有找到任何有效的时间点，无法进行回测", "ERROR")
+            return None
+        
+        if log:
+            log(f"共找到{len(all_times)}个时间点", "INFO")
+            log(f"第一个时间点: {all_times[0]}", "INFO")
+            log(f"最后一个时间点: {all_times[-1]}", "INFO")
+        
+        # 一次性计算整条时间轴的日期/时间字符串、交易日序号和当日秒数
+        meta = TimelineMeta(all_times)
+        
+        # 将所有股票数据一次性对齐到统一时间轴，构建 (时间 × 股票 × 字段) 行情面板
+        # 循环中只返回 BarView 视图，不再为每只股票每个时间点创建 pd.Series
+        panel = MarketDataPanel.from_frames(
+            {code: historical_data[code] for code in panel_positions},
+            panel_positions,
+            len(all_times)
+        )
+        if log:
+            log(f"数据缓存构建完成: {len(panel.codes)}只股票 × {len(all_times)}个时间点 × {len(panel.fields)}个字段", "INFO")
+        
+        # 获取唯一的交易日列表，并一次性判断每一天是否为交易日
+        trade_day_flags = np.array([self.tools.is_trade_day(day) for day in meta.date_strings], dtype=bool)
+        if log:
+            log(f"回测期间共有 {len(meta.date_strings)} 个交易日", "INFO")
+        
+        # 一次性计算触发计划，只有触发时间点以及每日首尾时间点（用于盘前盘后回调）
+        # 才需要构造数据，其余时间点直接跳过
+        trigger_mask = np.asarray(self.trigger.plan(all_times, meta), dtype=bool)
+        iteration_indices = np.flatnonzero(trigger_mask | meta.is_day_start | meta.is_day_end)
+        total_times = len(iteration_indices)
+        
+        # 计算进度显示增量（至少为1，最多为总数/100向上取整）
+        if total_times > 100:
+            progress_increment = max(1, int(total_times / 100))
+        else:
+            # 如果时间点太少，则每处理一个点都显示一次进度
+            progress_increment = 1
+        
+        if log:
+            log(f"触发计划: {int(trigger_mask.sum())}个触发时间点，需处理{total_times}个时间点（共{len(all_times)}个）", "INFO")
+        
+        return SimpleNamespace(
+            key=key,
+            offset=0,       # 在整个回测中的序号，用于折算进度
+            count=1,        # 整个回测的数据段数
+            all_times=all_times,
+            meta=meta,
+            panel=panel,
+            trade_day_flags=trade_day_flags,
+            trigger_mask=trigger_mask,
+            iteration_indices=iteration_indices,
+            progress_increment=progress_increment,
+        )
+    
+    def _load_day_segment(self, stock_codes: List[str], period: str, day: datetime.date) -> Optional[SimpleNamespace]:
+        """流式模式：加载单个交易日全部股票的数据并构建数据段（在预取线程中执行）"""
+        day_str = day.strftime("%Y%m%d")
+        historical_data = self._load_historical_data(stock_codes, period, day_str, day_str, verbose=False)
+        custom_timeline = self._custom_timeline([day]) if isinstance(self.trigger, CustomTimeTrigger) else None
+        return self._build_segment(historical_data, custom_timeline, key=day_str, verbose=False)
+    
+    def _iter_stream_segments(self, loader: DayStreamLoader, first_day: int, num_days: int):
+        """流式模式：依次返回每个交易日的数据段，跳过没有数据的交易日"""
+        for i, (day, segment) in enumerate(loader):
+            if segment is None:
+                if self.trader_callback:
+                    self.trader_callback.gui.log_message(f"{day} 没有行情数据，跳过", "WARNING")
+                continue
+            segment.offset = first_day + i
+            segment.count = num_days
+            if self.trader_callback:
+                self.trader_callback.gui.log_message(
+                    f"已加载 {day} 的数据: {len(segment.panel.codes)}只股票 × {len(segment.all_times)}个时间点", "INFO")
+            yield segment
+    
+    @staticmethod
+    def _iter_segment_bars(segments, start_position: int = 0):
+        """依次遍历各数据段中需要处理的时间点
+        
+        Yields:
+            (数据段, 段内位置, 时间轴下标)，start_position 只作用于第一个数据段
+        """
+        for segment in segments:
+            for position in range(start_position, len(segment.iteration_indices)):
+                yield segment, position, segment.iteration_indices[position]
+            start_position = 0
+    
+    def _activate_segment(self, segment: SimpleNamespace):
+        """切换当前使用的数据段，record_results 等通过实例变量访问当前时间轴"""
+        self.market_panel = segment.panel
+        self.all_times = segment.all_times
+        self.timeline_meta = segment.meta
+        self.trade_day_flags = segment.trade_day_flags
+        if self.timeframes is not None:
+            self.timeframes.align(segment.all_times)
+        return segment.all_times, segment.meta, segment.trigger_mask
+    
+    def _checkpoint_fingerprint(self, stock_codes: List[str], timeline_key: tuple) -> Dict:
+        """生成断点对应的回测配置指纹，配置、策略源码或策略参数、数据变化后断点失效
+        
+        Args:
+            stock_codes: 股票代码列表
+            timeline_key: 时间轴标识，整段回测为 (时间点数, 首个时间点, 最后时间点)，
+                流式模式为 ('stream', 交易日数, 首个交易日, 最后交易日)
+        """
+        return {
+            'strategy_file': os.path.basename(self.config.config_dict.get("strategy_file", "")),
+            'start_time': self.config.backtest_start,
+            'end_time': self.config.backtest_end,
+            'stock_codes': list(stock_codes),
+            'strategies': [slot.name for slot in self.strategy_slots],
+            # 策略源码摘要和策略参数（与回测结果缓存相同），修改策略后不再从旧断点继续
+            'strategy_fingerprints': getattr(self, '_strategy_fingerprints', None),
+            'trigger': self.config.config_dict["backtest"].get("trigger", {}).get("type"),
+            'timeline': timeline_key,
+            # 影响回测结果的配置（初始资金、交易成本、风控、盘前盘后回调、数据周期和复权方式等）
+            'config': config_fingerprint(self.config.config_dict, stock_codes),
+        }
+    
+    def _save_backtest_checkpoint(self, path: str, fingerprint: Dict, segment_key: str, position: int,
+                                  processed_times: int, current_date, day_start_time, day_data: Dict):
+        """保存回测断点（原子写入）
+        
+        Args:
+            path: 断点文件路径
+            fingerprint: 回测配置指纹
+            segment_key: 当前数据段标识
+            position: 数据段内的迭代位置，恢复时从该位置继续
+            processed_times: 已处理的迭代时间点数
+            current_date: 最近处理完的交易日
+            day_start_time: 该交易日第一个时间点的时间戳
+            day_data: 该交易日最后一个时间点的数据，恢复后供盘后回调使用
+        """
+        try:
+            # 每个策略保存各自的账户、回测记录、结果写入器和策略状态
+            slots = []
+            for slot in self.strategy_slots:
+                strategy_state = None
+                if hasattr(slot.strategy_module, 'khSaveState'):
+                    try:
+                        strategy_state = slot.strategy_module.khSaveState()
+                    except Exception as e:
+                        if self.trader_callback:
+                            self.trader_callback.gui.log_message(f"保存策略 {slot.name} 的状态失败: {str(e)}", "WARNING")
+                slots.append({
+                    'trade_mgr': {
+                        'assets': slot.trade_mgr.assets,
+                        'positions': slot.trade_mgr.positions,
+                        'orders': slot.trade_mgr.orders,
+                        'trades': slot.trade_mgr.trades,
+                    },
+                    'backtest_records': slot.backtest_records,
+                    'writer': slot.results_writer.state(),
+                    'strategy_state': strategy_state,
+                })
+            save_checkpoint(path, {
+                'fingerprint': fingerprint,
+                'segment': segment_key,
+                'position': position,
+                'processed_times': processed_times,
+                'current_date': current_date,
+                'day_start_time': day_start_time,
+                # BarView 引用整个行情面板，断点中只保存为 pd.Series；框架引用在恢复时重新设置
+                'day_data': {code: bar.to_series() if isinstance(bar, BarView) else bar
+                             for code, bar in day_data.items() if code != "__framework__"},
+                'day_data_has_framework': "__framework__" in day_data,
+                'slots': slots,
+            })
+            if self.trader_callback:
+                self.trader_callback.gui.log_message(f"已保存回测断点，已完成至 {current_date}", "INFO")
+        except Exception as e:
+            if self.trader_callback:
+                self.trader_callback.gui.log_message(f"保存回测断点失败: {str(e)}", "WARNING")
+            logging.warning(f"保存回测断点失败: {str(e)}", exc_info=True)
+    
+    def _load_backtest_checkpoint(self, path: str, fingerprint: Dict) -> Optional[Dict]:
+        """读取并恢复回测断点，断点不存在或与当前配置不一致时从头开始
+        
+        Returns:
+            Optional[Dict]: 恢复成功时返回断点内容，否则返回 None
+        """
+        try:
+            checkpoint = load_checkpoint(path)
+        except Exception as e:
+            logging.warning(f"读取回测断点失败: {str(e)}", exc_info=True)
+            checkpoint = None
+        
+        if checkpoint is None or checkpoint.get('fingerprint') != fingerprint:
+            if self.trader_callback:
+                reason = "未找到可用的回测断点" if checkpoint is None else "回测断点与当前配置不一致"
+                self.trader_callback.gui.log_message(f"{reason}，从头开始回测", "WARNING")
+            for slot in self.strategy_slots:
+                slot.results_writer.restore(None)
+            return None
+        
+        for slot, state in zip(self.strategy_slots, checkpoint['slots']):
+            # 原地更新交易管理器状态，保持其他对象持有的引用有效
+            for name, value in state['trade_mgr'].items():
+                target = getattr(slot.trade_mgr, name)
+                target.clear()
+                target.update(value)
+            slot.backtest_records = state['backtest_records']
+            slot.results_writer.restore(state['writer'])
+            
+            if state.get('strategy_state') is not None:
+                if hasattr(slot.strategy_module, 'khLoadState'):
+                    slot.strategy_module.khLoadState(state['strategy_state'])
+                elif self.trader_callback:
+                    self.trader_callback.gui.log_message(
+                        f"断点中包含策略 {slot.name} 的状态，但策略未实现 khLoadState，已忽略", "WARNING")
+        self._use_slot(self.strategy_slots[0])
+        
+        if self.trader_callback:
+            self.trader_callback.gui.log_message(
+                f"从回测断点继续：已完成至 {checkpoint['current_date']}，"
+                f"已处理 {checkpoint['processed_times']} 个时间点",
+                "INFO"
+            )
+        return checkpoint
+    
+    def _load_daily_closes(self, codes: List[str]) -> Dict[str, pd.DataFrame]:
+        """一次性加载一组股票在回测区间内的日线收盘价，并合并到 self.daily_closes
+        
+        Args:
+            codes: 股票代码列表
+            
+        Returns:
+            Dict[str, pd.DataFrame]: 数据提供者返回的 {股票代码: DataFrame}
+        """
+        self._daily_close_requested.update(codes)
+        daily_data = get_data_provider().get_market_data(
+            field_list=['time', 'close'],
+            stock_list=codes,
+            period='1d',
+            start_time=self.config.backtest_start,
+            end_time=self.config.backtest_end,
+            # 与回测数据保持一致的复权方式，避免"下单用复权价、估值用未复权价"的不一致
+            dividend_type=self.config.config_dict["data"].get("dividend_type", "none")
+        )
+        if not isinstance(daily_data, dict):
+            daily_data = {}
+        matrix = DailyCloseMatrix.from_frames(daily_data)
+        self.daily_closes = matrix if self.daily_closes is None else self.daily_closes.merge(matrix)
+        return daily_data
+    
     def _record_daily_stats(self, current_date, current_time, data):
         """记录每日统计数据（从record_results中分离出来的功能）
         
@@ -2662,124 +3039,62 @@ class KhQuantFramework:
         assets = self.trade_mgr.assets
         cash = assets['cash']
         
-        # 确保日期是字符串格式
-        date_str = current_date
-        if not isinstance(current_date, str):
-            try:
-                date_str = current_date.strftime("%Y-%m-%d") if hasattr(current_date, 'strftime') else str(current_date)
-            except:
-                date_str = str(current_date)
-        
         # 重新计算一天结束时的市值
         positions = self.trade_mgr.positions
         position_codes = list(positions.keys())
-        day_end_market_value = 0.0
-        
-        # 转换日期为YYYYMMDD格式，用于获取日线数据
-        yyyymmdd_date = date_str.replace('-', '') if '-' in date_str else date_str
-        
-        # 批量获取收盘价
-        daily_prices = {}
-        if position_codes:
-            # 检查缓存中是否已有当日数据
-            cache_date_key = f"daily_prices_{yyyymmdd_date}"
-            if cache_date_key in self.daily_price_cache:
-                # 直接使用缓存中的数据
-                daily_prices = self.daily_price_cache[cache_date_key]
-                if self.trader_callback:
-                    self.trader_callback.gui.log_message(f"使用缓存的日线数据，日期: {yyyymmdd_date}", "INFO")
-            else:
+        
+        # 从预加载的日线收盘价矩阵中一次取出所有持仓的收盘价
+        closes = np.full(len(position_codes), np.nan, dtype=np.float64)
+        if position_codes and self.daily_closes is not None:
+            missing_codes = [
+                code for code in position_codes
+                if code not in self.daily_closes.code_index and code not in self._daily_close_requested
+            ]
+            if missing_codes:
+                # 持仓中出现股票池以外的股票时，一次性补充加载其整个回测区间的日线
                 try:
-                    # 使用数据提供者获取日线数据
-                    provider = get_data_provider()
-                    daily_data = provider.get_market_data(
-                        field_list=['close'],
-                        stock_list=position_codes,
-                        period='1d',
-                        start_time=yyyymmdd_date,
-                        end_time=yyyymmdd_date,
-                        # 与回测数据保持一致的复权方式，避免"下单用复权价、估值用未复权价"的不一致
-                        dividend_type=self.config.config_dict["data"].get("dividend_type", "none")
-                    )
-                    
-                    # 优化数据提取逻辑
-                    if daily_data is not None and isinstance(daily_data, dict) and 'close' in daily_data:
-                        close_data = daily_data['close']
-                        # 检查close_data的类型
-                        if isinstance(close_data, pd.DataFrame):
-                            # 使用向量化操作处理DataFrame
-                            if any(code in close_data.index for code in position_codes):
-                                latest_date = close_data.columns[-1]
-                                # 使用向量化操作获取所有股票的价格
-                                valid_codes = [code for code in position_codes if code in close_data.index]
-                                daily_prices.update({
-                                    code: close_data.loc[code, latest_date]
-                                    for code in valid_codes
-                                    if close_data.loc[code, latest_date] is not None and close_data.loc[code, latest_date] > 0
-                                })
-                    
-                    # 缓存获取的数据，避免同一天重复请求
-                    self.daily_price_cache[cache_date_key] = daily_prices
+                    self._load_daily_closes(missing_codes)
                 except Exception as e:
                     logging.error(f"获取日线数据失败: {e}")
+            closes = self.daily_closes.prices(current_date, position_codes)
         
-        # 批量计算持仓市值
-        for code in position_codes:
-            # 优先使用日线收盘价
-            if code in daily_prices and daily_prices[code] > 0:
-                current_price = daily_prices[code]
-            # 备选方案：使用触发数据中的价格
-            elif code in data and 'close' in data[code]:
-                current_price = data[code]['close']
-            # 备选方案：使用持仓记录的价格
+        # 日线收盘价缺失时，依次使用触发数据中的价格、持仓记录的价格、持仓均价
+        for k in np.flatnonzero(~(closes > 0)):
+            code = position_codes[k]
+            if code in data and 'close' in data[code]:
+                closes[k] = data[code]['close']
             elif 'current_price' in positions[code] and positions[code]['current_price'] > 0:
-                current_price = positions[code]['current_price']
-            # 最后备选：使用持仓均价
+                closes[k] = positions[code]['current_price']
             else:
-                current_price = positions[code]['avg_price']
-            
-            # 计算市值
-            volume = positions[code]['volume']
-            market_value = current_price * volume
-            day_end_market_value += market_value
-            
-            # 更新持仓信息
-            positions[code]['current_price'] = current_price
-            positions[code]['market_value'] = market_value
-            
-            # 计算盈亏
-            avg_price = positions[code]['avg_price']
-            positions[code]['profit'] = (current_price - avg_price) * volume
-            positions[code]['profit_ratio'] = (current_price - avg_price) / avg_price if avg_price > 0 else 0
+                closes[k] = positions[code]['avg_price']
+        
+        # 持仓市值 = 持仓数量 · 收盘价
+        volumes = np.array([positions[code]['volume'] for code in position_codes], dtype=np.float64)
+        market_values = volumes * closes
+        day_end_market_value = float(np.dot(volumes, closes)) if position_codes else 0.0
+        
+        # 更新持仓信息和盈亏
+        for code, current_price, market_value in zip(position_codes, closes.tolist(), market_values.tolist()):
+            position = positions[code]
+            avg_price = position['avg_price']
+            position['current_price'] = current_price
+            position['market_value'] = market_value
+            position['profit'] = (current_price - avg_price) * position['volume']
+            position['profit_ratio'] = (current_price - avg_price) / avg_price if avg_price > 0 else 0
         
         # 计算总资产
         total_asset = cash + day_end_market_value
         
-        # 获取基准指数收盘价 - 使用缓存优化
+        # 基准指数收盘价取自同一份预加载数据，缺失时使用触发数据中的价格
         benchmark_code = self.config.config_dict["backtest"]["benchmark"]
-        benchmark_close = None
-        
-        # 使用缓存避免重复获取基准数据
-        cache_key = f"benchmark_{yyyymmdd_date}_{benchmark_code}"
-        if cache_key in self._cached_benchmark_close:
-            benchmark_close = self._cached_benchmark_close[cache_key]
-        else:
-            try:
-                # 备选：使用触发数据中的价格
-                if benchmark_code in data and 'close' in data[benchmark_code]:
-                    benchmark_close = data[benchmark_code]['close']
-                    # 缓存结果
-                    self._cached_benchmark_close[cache_key] = benchmark_close
-            except Exception as e:
-                logging.error(f"获取基准指数数据失败: {e}")
-                # 备选方案
-                if benchmark_code in data and 'close' in data[benchmark_code]:
-                    benchmark_close = data[benchmark_code]['close']
+        benchmark_close = self.daily_closes.close(current_date, benchmark_code) if self.daily_closes is not None else None
+        if benchmark_close is None and benchmark_code in data and 'close' in data[benchmark_code]:
+            benchmark_close = data[benchmark_code]['close']
         
         # 计算当日收益率
-        daily_stats = self.backtest_records['daily_stats']
-        if daily_stats:
-            prev_asset = daily_stats[-1]['total_asset']
+        last_daily_stat = self.results_writer.last_daily_stat
+        if last_daily_stat:
+            prev_asset = last_daily_stat['total_asset']
             daily_return = (total_asset - prev_asset) / prev_asset if prev_asset != 0 else 0
         else:
             init_capital = self.backtest_records['init_capital']
@@ -2798,17 +3113,16 @@ class KhQuantFramework:
             for code, pos in self.trade_mgr.positions.items()
         }
         
-        # 记录每日统计数据
+        # 记录每日统计数据（持仓快照写入单独的持仓明细表）
         daily_stat = {
             'date': current_date,
             'total_asset': total_asset,
             'cash': cash,
             'market_value': day_end_market_value,
             'daily_return': daily_return,
-            'benchmark_close': benchmark_close,
-            'positions': positions_snapshot
+            'benchmark_close': benchmark_close
         }
-        self.backtest_records['daily_stats'].append(daily_stat)
+        self.results_writer.add_daily_stat(daily_stat, positions_snapshot)
         
         # 记录基准指数数据
         if benchmark_close is not None:
@@ -0,0 +1,934 @@
+# coding: utf-8
+"""
+回测行情面板 - 一次性把历史数据预加载为 NumPy 面板
+
+回测主循环过去在每个时间点对每只股票执行 df.iloc[idx]，每根K线都会分配
+一个新的 pd.Series。这里把 historical_data 在循环开始前整理成
+(时间 × 股票 × 字段) 的二维/三维数组，循环中只返回轻量的 BarView 视图，
+策略侧的 khPrice / khGet / data[code]['close'] 等访问方式保持不变。
+"""
+
+import datetime
+import time
+import warnings
+from collections.abc import Mapping
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class BarView(Mapping):
+    """单只股票在某一时间点的行情视图（替代 pd.Series 的轻量只读对象）
+
+    支持 bar['close']、bar.get('close')、'close' in bar、bar.keys()/items()
+    以及 bar.empty，满足框架和策略中对 Series 的常见用法。
+    """
+
+    __slots__ = ('_panel', '_t', '_s')
+
+    def __init__(self, panel: 'MarketDataPanel', t: int, s: int):
+        self._panel = panel
+        self._t = t    # 面板中的时间下标，-1 表示该时间点无数据
+        self._s = s    # 面板中的股票下标
+
+    @property
+    def empty(self) -> bool:
+        """该时间点是否没有数据（与 pd.Series.empty 语义一致）"""
+        return self._t < 0
+
+    def _row(self) -> int:
+        """原始 DataFrame 中对应的行号"""
+        return self._panel.positions[self._t, self._s]
+
+    def __getitem__(self, field):
+        if self._t >= 0:
+            panel = self._panel
+            j = panel.field_index.get(field)
+            if j is not None and panel.has_field[self._s, j]:
+                return panel.values[self._t, self._s, j]
+            objects = panel.object_values.get(field)
+            if objects is not None and objects[self._s] is not None:
+                return objects[self._s][self._row()]
+        raise KeyError(field)
+
+    def __contains__(self, field) -> bool:
+        if self._t < 0:
+            return False
+        panel = self._panel
+        j = panel.field_index.get(field)
+        if j is not None:
+            return bool(panel.has_field[self._s, j])
+        objects = panel.object_values.get(field)
+        return objects is not None and objects[self._s] is not None
+
+    def __iter__(self):
+        if self._t < 0:
+            return iter(())
+        return iter([field for field in self._panel.all_fields if field in self])
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def to_series(self) -> pd.Series:
+        """转换为 pd.Series（兼容需要完整 Series 的旧代码，会产生拷贝）"""
+        return pd.Series({field: self[field] for field in self})
+
+    def __repr__(self):
+        code = self._panel.codes[self._s]
+        if self._t < 0:
+            return f"BarView({code}, empty)"
+        return f"BarView({code}, {dict(self.items())})"
+
+
+class MarketDataPanel:
+    """按统一时间轴对齐的行情面板
+
+    Attributes:
+        codes: 股票代码列表（面板第二维）
+        fields: 数值字段列表（面板第三维）
+        values: float64 数组，形状为 (时间点数, 股票数, 字段数)，缺失为 NaN
+        positions: int64 数组，形状为 (时间点数, 股票数)，为原始 DataFrame
+                   的行号，-1 表示该股票在此时间点没有K线
+        has_field: bool 数组，形状为 (股票数, 字段数)，标记股票原始数据是否包含该字段
+        object_values: 非数值字段 {字段: [每只股票的原始 ndarray 或 None]}
+    """
+
+    def __init__(self, codes: List[str], fields: List[str], values: np.ndarray,
+                 positions: np.ndarray, has_field: np.ndarray,
+                 object_values: Optional[Dict[str, list]] = None):
+        self.codes = list(codes)
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.fields = list(fields)
+        self.field_index = {field: j for j, field in enumerate(self.fields)}
+        self.values = values
+        self.positions = positions
+        self.has_field = has_field
+        self.object_values = object_values or {}
+        self.all_fields = self.fields + [f for f in self.object_values if f not in self.field_index]
+
+    @property
+    def num_times(self) -> int:
+        return self.positions.shape[0]
+
+    @classmethod
+    def from_frames(cls, frames: Dict[str, pd.DataFrame], positions: Dict[str, np.ndarray],
+                    num_times: int) -> 'MarketDataPanel':
+        """从 {股票代码: DataFrame} 和每只股票的对齐下标构建面板
+
+        Args:
+            frames: 历史数据，DataFrame 或旧版 Dict 格式
+            positions: {股票代码: int 数组}，长度为时间点数，元素为该时间点在
+                       DataFrame 中的行号，-1 表示无数据
+            num_times: 统一时间轴长度
+        """
+        codes = list(frames.keys())
+        tables = {code: _to_frame(frames[code]) for code in codes}
+
+        # 收集字段（保持首次出现的顺序），数值列进入面板，其余列单独保存
+        fields, object_fields = [], []
+        for df in tables.values():
+            for col in df.columns:
+                if col in fields or col in object_fields:
+                    continue
+                if _is_numeric(df[col]):
+                    fields.append(col)
+                else:
+                    object_fields.append(col)
+
+        num_codes, num_fields = len(codes), len(fields)
+        values = np.full((num_times, num_codes, num_fields), np.nan, dtype=np.float64)
+        pos_matrix = np.full((num_times, num_codes), -1, dtype=np.int64)
+        has_field = np.zeros((num_codes, num_fields), dtype=bool)
+        object_values = {field: [None] * num_codes for field in object_fields}
+        field_index = {field: j for j, field in enumerate(fields)}
+
+        for s, code in enumerate(codes):
+            df = tables[code]
+            pos = positions.get(code)
+            if pos is None:
+                continue
+            pos = np.asarray(pos, dtype=np.int64)
+            pos_matrix[:, s] = pos
+            present = pos >= 0
+            rows = pos[present]
+            for col in df.columns:
+                j = field_index.get(col)
+                if j is not None:
+                    has_field[s, j] = True
+                    column = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+                    values[present, s, j] = column[rows]
+                elif col in object_values:
+                    object_values[col][s] = df[col].to_numpy()
+
+        return cls(codes, fields, values, pos_matrix, has_field, object_values)
+
+    def bar(self, t: int, code: str) -> BarView:
+        """获取指定时间下标和股票的行情视图"""
+        s = self.code_index[code]
+        return BarView(self, t if self.positions[t, s] >= 0 else -1, s)
+
+    def snapshot(self, t: int) -> Dict[str, BarView]:
+        """获取某一时间下标上所有股票的行情视图 {股票代码: BarView}"""
+        present = self.positions[t] >= 0
+        return {
+            code: BarView(self, t if present[s] else -1, s)
+            for s, code in enumerate(self.codes)
+        }
+
+    def column(self, field: str) -> np.ndarray:
+        """获取某字段的 (时间 × 股票) 矩阵视图（不拷贝）"""
+        return self.values[:, :, self.field_index[field]]
+
+
+def frame_times(data) -> Optional[np.ndarray]:
+    """提取单只股票数据每一行的时间戳（int64）
+
+    查找顺序与回测框架一致：'time' 列 → 'timestamp'/'date'/'datetime' 列 →
+    DatetimeIndex（转换为秒级时间戳）。旧版 Dict 格式使用其 'time' 键。
+
+    Args:
+        data: DataFrame 或旧版 Dict 格式数据
+
+    Returns:
+        np.ndarray: 与数据行一一对应的 int64 时间戳，找不到时间字段或无法转换时返回 None
+    """
+    values = None
+    if isinstance(data, pd.DataFrame):
+        for field in ['time', 'timestamp', 'date', 'datetime']:
+            if field in data.columns:
+                values = data[field].to_numpy()
+                break
+        else:
+            if isinstance(data.index, pd.DatetimeIndex):
+                # 转换为秒级时间戳（与原有 astype(np.int64) // 10**9 一致）
+                return data.index.as_unit('ns').asi8 // 10**9
+    elif isinstance(data, dict) and 'time' in data:
+        values = np.asarray(data['time'])
+
+    if values is None:
+        return None
+    try:
+        return np.asarray(values).astype(np.int64)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_millisecond(times: np.ndarray) -> bool:
+    """判断时间戳是否为毫秒级（与框架中 > 1e10 的判断一致）"""
+    return len(times) > 0 and int(np.max(times)) > 1e10
+
+
+def to_time_unit(times: np.ndarray, millisecond: bool) -> np.ndarray:
+    """将时间戳转换为指定精度（毫秒 / 秒）"""
+    if is_millisecond(times) == millisecond:
+        return times
+    return times * 1000 if millisecond else times // 1000
+
+
+def local_time_parts(timeline: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """向量化计算时间轴上每个时间点的本地日期序号和当日秒数
+
+    与 datetime.fromtimestamp 的本地时间语义一致，时区偏移按 15 分钟分桶
+    通过 time.localtime 查询，避免逐个时间点创建 datetime 对象。
+
+    Args:
+        timeline: int64 时间戳数组（秒级或毫秒级）
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (自 1970-01-01 起的本地日期序号, 从午夜开始的秒数)
+    """
+    timeline = np.asarray(timeline, dtype=np.int64)
+    seconds = timeline // 1000 if is_millisecond(timeline) else timeline
+    if len(seconds) == 0:
+        return seconds.copy(), seconds.copy()
+    buckets, inverse = np.unique(seconds // 900, return_inverse=True)
+    offsets = np.array([time.localtime(int(b) * 900).tm_gmtoff for b in buckets], dtype=np.int64)
+    local = seconds + offsets[inverse.reshape(-1)]
+    return local // 86400, local % 86400
+
+
+class TimelineMeta:
+    """统一时间轴的时间元数据，在回测循环开始前一次性向量化计算
+
+    日期字符串按交易日、时间字符串按当日秒数去重后各格式化一次，每个时间点只保存
+    指向这两张表的下标，循环中构造 __current_time__ 只需查表，不再逐个时间点
+    调用 datetime.fromtimestamp / strftime。
+
+    Attributes:
+        timeline: int64 统一时间轴
+        millisecond: 时间轴是否为毫秒级
+        day_index: 每个时间点所属交易日在 dates 中的序号
+        seconds_of_day: 每个时间点从午夜开始的秒数（本地时间）
+        dates: 时间轴覆盖的日期列表（datetime.date，升序）
+        date_strings: 与 dates 对应的 "%Y-%m-%d" 字符串列表
+        day_starts / day_ends: 每个交易日第一个 / 最后一个时间点在时间轴中的下标
+        is_day_start / is_day_end: 与时间轴等长的 bool 数组，标记每日首 / 尾时间点
+    """
+
+    def __init__(self, timeline: np.ndarray):
+        self.timeline = np.asarray(timeline, dtype=np.int64)
+        self.millisecond = is_millisecond(self.timeline)
+        day_numbers, self.seconds_of_day = local_time_parts(self.timeline)
+        unique_days, day_index = np.unique(day_numbers, return_inverse=True)
+        self.day_index = day_index.reshape(-1)
+        self.date_strings = np.datetime_as_string(unique_days.astype('datetime64[D]')).tolist()
+        epoch = datetime.date(1970, 1, 1)
+        self.dates = [epoch + datetime.timedelta(days=int(day)) for day in unique_days]
+
+        # 交易日分段索引：时间轴有序，同一天的时间点连续
+        counts = np.bincount(self.day_index, minlength=len(unique_days))
+        self.day_ends = np.cumsum(counts) - 1
+        self.day_starts = self.day_ends - counts + 1
+        self.is_day_start = np.zeros(len(self.timeline), dtype=bool)
+        self.is_day_start[self.day_starts] = True
+        self.is_day_end = np.zeros(len(self.timeline), dtype=bool)
+        self.is_day_end[self.day_ends] = True
+
+        unique_seconds, time_index = np.unique(self.seconds_of_day, return_inverse=True)
+        self._time_index = time_index.reshape(-1)
+        # "1970-01-01T09:30:00"[11:] -> "09:30:00"
+        self._time_strings = [s[11:] for s in np.datetime_as_string(unique_seconds.astype('datetime64[s]')).tolist()]
+
+    def __len__(self) -> int:
+        return len(self.timeline)
+
+    @property
+    def num_days(self) -> int:
+        return len(self.dates)
+
+    def date_str(self, i: int) -> str:
+        return self.date_strings[self.day_index[i]]
+
+    def time_str(self, i: int) -> str:
+        return self._time_strings[self._time_index[i]]
+
+    def datetime_str(self, i: int) -> str:
+        return f"{self.date_strings[self.day_index[i]]} {self._time_strings[self._time_index[i]]}"
+
+    def date_at(self, i: int) -> datetime.date:
+        return self.dates[self.day_index[i]]
+
+    def datetime_at(self, i: int) -> datetime.datetime:
+        """时间点对应的 datetime 对象（与 datetime.fromtimestamp 结果一致，按需创建）"""
+        timestamp = int(self.timeline[i])
+        return datetime.datetime.fromtimestamp(timestamp / 1000 if self.millisecond else timestamp)
+
+    def time_info(self, i: int) -> dict:
+        """构造回测数据中的 __current_time__ 字典"""
+        raw_time = self.timeline[i]
+        date_str = self.date_strings[self.day_index[i]]
+        time_str = self._time_strings[self._time_index[i]]
+        return {
+            "timestamp": int(raw_time),
+            "datetime": f"{date_str} {time_str}",
+            "date": date_str,
+            "time": time_str,
+            "raw_time": raw_time
+        }
+
+    def index_of(self, timestamp) -> int:
+        """查找时间戳在时间轴中的下标，不存在时返回 -1"""
+        i = int(np.searchsorted(self.timeline, timestamp))
+        if i < len(self.timeline) and self.timeline[i] == timestamp:
+            return i
+        return -1
+
+
+class DailyCloseMatrix:
+    """回测区间内 (交易日 × 股票) 的日线收盘价矩阵
+
+    回测开始前一次性加载股票池和基准指数的日线数据，每日收盘结算时按日期
+    取一行，持仓市值为持仓数量与收盘价的向量点积，不再逐日请求数据提供者。
+
+    Attributes:
+        day_numbers: 升序的本地日期序号（自 1970-01-01 起的天数）
+        codes: 股票代码列表（矩阵第二维）
+        closes: float64 数组，形状为 (交易日数, 股票数)，缺失为 NaN
+    """
+
+    _EPOCH = datetime.date(1970, 1, 1)
+
+    def __init__(self, day_numbers: np.ndarray, codes: List[str], closes: np.ndarray):
+        self.day_numbers = np.asarray(day_numbers, dtype=np.int64)
+        self.codes = list(codes)
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.closes = closes
+
+    @classmethod
+    def from_frames(cls, frames: Dict[str, pd.DataFrame]) -> 'DailyCloseMatrix':
+        """从数据提供者返回的 {股票代码: 日线 DataFrame} 构建矩阵
+
+        找不到时间字段或收盘价的股票不会进入矩阵。
+        """
+        series = {}
+        for code, df in (frames or {}).items():
+            df = _to_frame(df)
+            times = frame_times(df)
+            if times is None or len(times) == 0 or 'close' not in df.columns:
+                continue
+            days, _ = local_time_parts(times)
+            closes = pd.to_numeric(df['close'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+            series[code] = (days, closes)
+
+        arrays = [days for days, _ in series.values()]
+        day_numbers = np.unique(np.concatenate(arrays)) if arrays else np.empty(0, dtype=np.int64)
+        matrix = np.full((len(day_numbers), len(series)), np.nan, dtype=np.float64)
+        for s, (days, closes) in enumerate(series.values()):
+            rows = align_positions(day_numbers, days)
+            present = rows >= 0
+            matrix[present, s] = closes[rows[present]]
+        return cls(day_numbers, list(series.keys()), matrix)
+
+    def merge(self, other: 'DailyCloseMatrix') -> 'DailyCloseMatrix':
+        """合并另一个矩阵中本矩阵没有的股票，返回新矩阵"""
+        new_codes = [code for code in other.codes if code not in self.code_index]
+        if not new_codes:
+            return self
+        day_numbers = np.union1d(self.day_numbers, other.day_numbers)
+        matrix = np.full((len(day_numbers), len(self.codes) + len(new_codes)), np.nan, dtype=np.float64)
+        matrix[np.searchsorted(day_numbers, self.day_numbers), :len(self.codes)] = self.closes
+        columns = [other.code_index[code] for code in new_codes]
+        matrix[np.searchsorted(day_numbers, other.day_numbers), len(self.codes):] = other.closes[:, columns]
+        return DailyCloseMatrix(day_numbers, self.codes + new_codes, matrix)
+
+    def _row(self, date) -> int:
+        """日期在矩阵中的行号，不存在时返回 -1
+
+        Args:
+            date: datetime.date 或 "YYYY-MM-DD" / "YYYYMMDD" 字符串
+        """
+        if isinstance(date, str):
+            date = datetime.datetime.strptime(date.replace('-', ''), "%Y%m%d").date()
+        day = (date - self._EPOCH).days
+        i = int(np.searchsorted(self.day_numbers, day))
+        if i < len(self.day_numbers) and self.day_numbers[i] == day:
+            return i
+        return -1
+
+    def prices(self, date, codes: List[str]) -> np.ndarray:
+        """获取指定日期一组股票的收盘价，缺失为 NaN"""
+        result = np.full(len(codes), np.nan, dtype=np.float64)
+        row = self._row(date)
+        if row < 0:
+            return result
+        for k, code in enumerate(codes):
+            s = self.code_index.get(code)
+            if s is not None:
+                result[k] = self.closes[row, s]
+        return result
+
+    def close(self, date, code: str) -> Optional[float]:
+        """获取指定日期单只股票的收盘价，缺失时返回 None"""
+        value = self.prices(date, [code])[0]
+        return None if np.isnan(value) else float(value)
+
+
+_INTRADAY_PERIODS = ('tick', '1m', '5m')
+INDICATOR_KINDS = ('MA', 'EMA', 'STD', 'HHV', 'LLV')
+_TIME_INDEX_NAMES = ('time', 'timestamp', 'date', 'datetime')
+# EMA 从最近 window × EMA_SEED_MULTIPLE 根K线的第一根开始递推，更早数据的权重约为 e^-20，可以忽略
+EMA_SEED_MULTIPLE = 10
+# 批量计算 EMA 时每批处理的窗口数，限制临时数组的大小
+_EMA_CHUNK = 4096
+
+
+def _ema_weights(window: int, length: int) -> np.ndarray:
+    """以第一根K线为初值、span=window、adjust=False 递推 length 根K线后，各K线在最终 EMA 中的权重"""
+    alpha = 2.0 / (window + 1)
+    weights = alpha * (1 - alpha) ** np.arange(length - 1, -1, -1, dtype=np.float64)
+    weights[0] = (1 - alpha) ** (length - 1)
+    return weights
+
+
+def fixed_window_ema(values: np.ndarray, window: int) -> float:
+    """values 中最后一个时间点的 EMA（span=window, adjust=False）
+
+    只使用最近 window × EMA_SEED_MULTIPLE 条数据，以其中第一条为初值递推，结果与数据从哪里开始无关；
+    数据不足时使用全部数据。窗口内有缺失值时结果为 NaN。
+
+    Args:
+        values: 按时间升序排列的数值数组
+        window: EMA 周期
+
+    Returns:
+        float: EMA 值
+    """
+    values = np.asarray(values, dtype=np.float64)[-window * EMA_SEED_MULTIPLE:]
+    return float((values * _ema_weights(window, len(values))).sum())
+
+
+def _end_index(times: np.ndarray, current_datetime: datetime.datetime, period: str) -> int:
+    """已排序时间数组中当前时间点之前的数据行数（日内周期严格早于当前时间，其他周期不晚于当日）"""
+    if period in _INTRADAY_PERIODS:
+        bound = np.datetime64(current_datetime)
+    else:
+        bound = np.datetime64(current_datetime.date() + datetime.timedelta(days=1))
+    return int(np.searchsorted(times, bound, side='left'))
+
+
+def _readonly(values: np.ndarray) -> np.ndarray:
+    """数组的只读视图（不影响原数组的可写状态）"""
+    view = values.view()
+    view.flags.writeable = False
+    return view
+
+
+class SymbolHistory:
+    """单只股票预先排序、时间已标准化的历史数据，khHistory 按时间点二分查找后切片
+
+    时间的标准化方式与 khHistory 逐次处理时完全一致：时间在索引中（Mootdx）时直接使用
+    索引，时间在 time 列中（xtquant，毫秒时间戳）时转换为北京时间。各列保存为只读数组，
+    window 返回的 DataFrame 中的列是这些数组的切片视图。
+    """
+
+    __slots__ = ('source', 'times', 'columns', 'active_rows', 'indicators')
+
+    def __init__(self, source, times: np.ndarray, columns: Dict[str, np.ndarray]):
+        self.source = source          # 构建时使用的原始数据（用于判断缓存数据是否已被替换）
+        self.times = times            # 按时间升序排列的 datetime64 数组
+        self.columns = columns        # {字段名: 与 times 对齐的只读数组}
+        self.active_rows = None       # 成交量大于0的行号，skip_paused 时按需计算
+        self.indicators = {}          # {(指标, 字段, 窗口): 滚动指标序列}，按需计算
+
+    @classmethod
+    def from_data(cls, data) -> Optional['SymbolHistory']:
+        """由数据提供者返回的单只股票数据构建
+
+        Args:
+            data: DataFrame（time 列或时间索引）或 Mootdx Dict 格式数据
+
+        Returns:
+            Optional[SymbolHistory]: 无法识别时间信息、时间带时区或包含扩展类型列时返回 None，
+                调用方沿用逐次筛选的处理方式
+        """
+        if isinstance(data, dict):
+            frame = pd.DataFrame(data)
+            if 'time' not in frame.columns:
+                return None
+            frame['time'] = pd.to_datetime(frame['time'], unit='ms')
+            frame = frame.set_index('time')
+        elif isinstance(data, pd.DataFrame):
+            frame = data
+        else:
+            return None
+
+        if isinstance(frame.index, pd.DatetimeIndex) or frame.index.name in _TIME_INDEX_NAMES:
+            if getattr(frame.index, 'tz', None) is not None:
+                return None
+            times = frame.index
+            value_columns = [col for col in frame.columns if col != 'time']
+        elif 'time' in frame.columns:
+            times = pd.to_datetime(frame['time'].astype(float), unit='ms') + pd.Timedelta(hours=8)
+            value_columns = [col for col in frame.columns if col != 'time']
+        else:
+            return None
+
+        times = np.asarray(times)
+        if times.dtype.kind != 'M':
+            return None
+        if not all(isinstance(frame[col].dtype, np.dtype) for col in value_columns):
+            return None
+
+        # 丢弃时间缺失的行（逐次筛选时这些行不会通过时间条件），再按时间稳定排序
+        valid = ~np.isnat(times)
+        order = np.flatnonzero(valid)
+        order = order[np.argsort(times[order], kind='stable')]
+        # 数据已按时间排序（最常见的情况）时直接使用原数组的只读视图，不复制数据
+        in_order = len(order) == len(times) and bool(np.all(order == np.arange(len(order))))
+        sorted_times = _readonly(times) if in_order else times[order]
+        sorted_times.flags.writeable = False
+        columns = {}
+        for col in value_columns:
+            values = frame[col].to_numpy()
+            values = _readonly(values) if in_order else values[order]
+            values.flags.writeable = False
+            columns[col] = values
+        return cls(data, sorted_times, columns)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @property
+    def nbytes(self) -> int:
+        """时间、各列和已计算指标序列占用的字节数（不含原始数据）"""
+        arrays = [self.times, *self.columns.values(), *self.indicators.values()]
+        if self.active_rows is not None:
+            arrays.append(self.active_rows)
+        return sum(int(array.nbytes) for array in arrays)
+
+    def end_index(self, current_datetime: datetime.datetime, period: str) -> int:
+        """当前时间点之前（不含未来数据）的数据行数
+
+        日内周期取严格早于 current_datetime 的数据，日线及其他周期取日期不晚于当日的数据。
+        """
+        return _end_index(self.times, current_datetime, period)
+
+    def indicator(self, kind: str, field: str, window: int) -> Optional[np.ndarray]:
+        """滚动指标序列，第一次使用时对整段历史一次性计算
+
+        返回数组长度为 len(self) + 1，values[end] 是前 end 行数据中最后 window 行的指标值，
+        与 end_index 配合即可 O(1) 查询任意时间点的指标（end < window 时为 NaN）。
+        缺失值的处理与 pandas 的 Series.mean/std/max/min 一致（忽略 NaN）。
+
+        Args:
+            kind: 'MA' 均值、'STD' 标准差（ddof=0，与 MyTT.STD 一致）、'HHV' 最大值、'LLV' 最小值、
+                'EMA' 指数移动平均（span=window, adjust=False，与 fixed_window_ema 相同，从前 end 行中
+                最近 window × EMA_SEED_MULTIPLE 行的第一行开始递推，不依赖缓存数据的起点）
+            field: 字段名
+            window: 窗口长度
+
+        Returns:
+            Optional[np.ndarray]: 字段不存在或不是数值类型时返回 None
+        """
+        if kind not in INDICATOR_KINDS:
+            raise ValueError(f"不支持的指标类型: {kind}")
+        key = (kind, field, window)
+        if key in self.indicators:
+            return self.indicators[key]
+        raw = self.columns.get(field)
+        if raw is None or raw.dtype.kind not in 'biuf' or window <= 0:
+            return None
+
+        values = raw.astype(np.float64)
+        out = np.full(len(values) + 1, np.nan)
+        if kind == 'EMA':
+            # 与 fixed_window_ema 逐位相同：数据不足种子窗口时逐个计算，之后按滑动窗口分批加权求和
+            seed = window * EMA_SEED_MULTIPLE
+            for end in range(window, min(seed, len(values)) + 1):
+                out[end] = (values[:end] * _ema_weights(window, end)).sum()
+            if len(values) >= seed:
+                weights = _ema_weights(window, seed)
+                windows = sliding_window_view(values, seed)
+                for start in range(0, len(windows), _EMA_CHUNK):
+                    chunk = windows[start:start + _EMA_CHUNK]
+                    out[seed + start:seed + start + len(chunk)] = (chunk * weights).sum(axis=1)
+        elif len(values) >= window:
+            missing = np.isnan(values)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                if kind == 'MA':
+                    # 逐窗口求和（与 Series.mean 的求和顺序一致，结果逐位相同），而不是用累计和相减：
+                    # 累计和的舍入误差会让 round(均值, 2) 在 .xx5 附近得到不同的结果
+                    filled = np.where(missing, 0.0, values)
+                    sums = sliding_window_view(filled, window).sum(axis=1)
+                    present = np.concatenate(([0], np.cumsum(~missing)))
+                    counts = present[window:] - present[:-window]
+                    out[window:] = sums / counts
+                else:
+                    windows = sliding_window_view(values, window)
+                    with warnings.catch_warnings():
+                        # 整个窗口都是 NaN 时结果为 NaN，与 pandas 一致，不输出警告
+                        warnings.simplefilter('ignore', RuntimeWarning)
+                        if kind == 'STD':
+                            out[window:] = np.nanstd(windows, axis=1)
+                        elif kind == 'HHV':
+                            out[window:] = np.nanmax(windows, axis=1)
+                        else:
+                            out[window:] = np.nanmin(windows, axis=1)
+        out.flags.writeable = False
+        self.indicators[key] = out
+        return out
+
+    def window(self, current_datetime: datetime.datetime, period: str, bar_count: int,
+               fields: List[str], skip_paused: bool = False, stock_code: str = "") -> pd.DataFrame:
+        """当前时间点之前最近 bar_count 条数据
+
+        Args:
+            current_datetime: 当前时间（不包含该时间点之后的数据）
+            period: 数据周期
+            bar_count: K线数量
+            fields: 字段列表，数据中不存在的字段被忽略
+            skip_paused: 是否跳过成交量为0的停牌数据
+            stock_code: 股票代码，仅用于输出过滤停牌数据的提示
+
+        Returns:
+            pd.DataFrame: time 列和 fields 中存在的列，行号从0开始
+        """
+        end = self.end_index(current_datetime, period)
+        if skip_paused and 'volume' in self.columns:
+            if self.active_rows is None:
+                self.active_rows = np.flatnonzero(self.columns['volume'] > 0)
+            k = int(np.searchsorted(self.active_rows, end, side='left'))
+            if k != end:
+                print(f"股票 {stock_code} 过滤停牌数据: {end} -> {k}")
+            rows = self.active_rows[max(0, k - bar_count):k]
+        else:
+            rows = slice(max(0, end - bar_count), end)
+
+        columns_order = ['time'] + [col for col in fields if col in self.columns]
+        window = {'time': self.times[rows]}
+        for col in columns_order[1:]:
+            window[col] = self.columns[col][rows]
+        frame = pd.DataFrame(window, copy=False)
+        if len(frame.columns) != len(columns_order):
+            # 字段重复（或包含 time）时保持与逐次筛选相同的列
+            frame = frame[columns_order]
+        return frame
+
+
+class PanelHistory:
+    """多只股票按时间对齐的历史数据矩阵（时间 × 股票），khPanel 按时间点二分查找后切片
+
+    时间轴是所有股票数据时间的并集，股票在某个时间点没有数据时为 NaN；同一只股票
+    有重复时间戳时取最后一行。每个字段保存为一个只读 float64 矩阵，window 返回的
+    DataFrame 是矩阵的行切片视图，截面计算（排名、标准化等）可以直接对整行向量化处理。
+    """
+
+    __slots__ = ('codes', 'times', 'index', 'columns', 'matrices')
+
+    def __init__(self, codes: List[str], times: np.ndarray, matrices: Dict[str, np.ndarray]):
+        self.codes = codes                                  # 股票代码（矩阵的列顺序）
+        self.times = times                                  # 按时间升序排列的 datetime64 时间轴
+        self.index = pd.DatetimeIndex(times, name='time')   # 每次切片复用的时间索引
+        self.columns = pd.Index(codes)                      # 每次切片复用的列索引
+        self.matrices = matrices                            # {字段名: (时间 × 股票) 只读矩阵}
+
+    @classmethod
+    def from_histories(cls, codes: List[str], histories: List[Optional[SymbolHistory]],
+                       fields: List[str]) -> 'PanelHistory':
+        """由每只股票的 SymbolHistory 构建
+
+        Args:
+            codes: 股票代码列表
+            histories: 与 codes 一一对应的 SymbolHistory，没有数据的股票为 None
+            fields: 字段列表，股票数据中没有的字段为 NaN
+
+        Raises:
+            ValueError: 字段不是数值类型
+        """
+        present = [(j, history) for j, history in enumerate(histories) if history is not None and len(history)]
+        if present:
+            times = np.unique(np.concatenate([history.times for _, history in present]))
+        else:
+            times = np.empty(0, dtype='datetime64[ns]')
+        # 每只股票各行在统一时间轴上的位置，重复时间戳按顺序赋值，保留最后一行
+        slots = [(j, history, np.searchsorted(times, history.times)) for j, history in present]
+
+        matrices = {}
+        for field in dict.fromkeys(fields):
+            matrix = np.full((len(times), len(codes)), np.nan)
+            for j, history, rows in slots:
+                values = history.columns.get(field)
+                if values is None:
+                    continue
+                if values.dtype.kind not in 'biuf':
+                    raise ValueError(f"字段 {field} 不是数值类型，无法构建截面矩阵")
+                matrix[rows, j] = values
+            matrix.flags.writeable = False
+            matrices[field] = matrix
+        return cls(list(codes), times, matrices)
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.times.nbytes) + sum(int(matrix.nbytes) for matrix in self.matrices.values())
+
+    def end_index(self, current_datetime: datetime.datetime, period: str) -> int:
+        """当前时间点之前（不含未来数据）的时间点数，规则与 SymbolHistory.end_index 相同"""
+        return _end_index(self.times, current_datetime, period)
+
+    def window(self, current_datetime: datetime.datetime, period: str, bar_count: int,
+               fields: List[str]) -> Dict[str, pd.DataFrame]:
+        """当前时间点之前最近 bar_count 个时间点的截面数据
+
+        Returns:
+            Dict[str, pd.DataFrame]: {字段名: DataFrame}，索引为时间，列为股票代码
+        """
+        return self.window_at(self.end_index(current_datetime, period), bar_count, fields)
+
+    def window_at(self, end: int, bar_count: int, fields: List[str]) -> Dict[str, pd.DataFrame]:
+        """时间轴前 end 个时间点中最近 bar_count 个时间点的截面数据"""
+        start = max(0, end - bar_count)
+        index = self.index[start:end]
+        return {field: pd.DataFrame(self.matrices[field][start:end], index=index, columns=self.columns, copy=False)
+                for field in fields}
+
+
+# A 股收盘时间：日线K线在当日收盘后才完整
+_DAILY_CLOSE = np.timedelta64(15 * 3600, 's')
+
+
+def completed_counts(times: np.ndarray, period: str, timeline: np.ndarray) -> np.ndarray:
+    """主时间轴每个时间点已经完成的K线数（游标）
+
+    分钟K线的时间为K线结束时间，时间不晚于当前时间点即已完成；日线在当日 15:00 收盘后
+    才完成，盘中的时间点只能看到前一交易日的日线，不会用到当日尚未收盘的数据。
+
+    Args:
+        times: 另一周期按时间升序排列的 datetime64 时间轴（本地时间）
+        period: 该周期，如 '1d'、'5m'
+        timeline: 主时间轴（int64 秒级或毫秒级时间戳）
+
+    Returns:
+        np.ndarray: 长度为主时间轴长度 + 1 的 int64 数组，第 0 个元素为第一个交易日开盘前
+            （当日零点）已完成的K线数，第 t + 1 个元素为时间点 t 已完成的K线数
+    """
+    day_numbers, seconds = local_time_parts(timeline)
+    local_times = (day_numbers * 86400 + seconds).astype('datetime64[s]')
+    if period in _INTRADAY_PERIODS:
+        completed_at = times
+    else:
+        completed_at = times.astype('datetime64[D]') + _DAILY_CLOSE
+    counts = np.empty(len(local_times) + 1, dtype=np.int64)
+    counts[0] = np.searchsorted(completed_at, day_numbers[0].astype('datetime64[D]'), side='right') if len(local_times) else 0
+    counts[1:] = np.searchsorted(completed_at, local_times, side='right')
+    return counts
+
+
+class TimeframeCursor:
+    """另一周期的截面历史数据及其在主时间轴上的游标
+
+    回测开始前为主时间轴的每个时间点计算一次已完成的K线数，循环中按时间轴下标查表，
+    取最近一根已完成的K线或最近若干根K线都是 O(1) 的数组下标和切片，不需要按时间查找，
+    也不会取到当前时间点尚未完成的K线。
+
+    以下方法的 t 为主时间轴下标，-1 表示第一个交易日开盘前（首个交易日的盘前回调）。
+
+    Args:
+        period: 周期，如 '1d'、'5m'、'1m'
+        panel: 该周期的截面历史数据
+        timeline: 主时间轴（int64 时间戳）
+    """
+
+    __slots__ = ('period', 'panel', 'counts', 'code_index')
+
+    def __init__(self, period: str, panel: PanelHistory, timeline: np.ndarray):
+        self.period = period
+        self.panel = panel
+        self.counts = completed_counts(panel.times, period, timeline)
+        self.code_index = {code: j for j, code in enumerate(panel.codes)}
+
+    def end(self, t: int) -> int:
+        """主时间轴第 t 个时间点已完成的K线数"""
+        return int(self.counts[t + 1])
+
+    def value(self, t: int, code: str, field: str, offset: int = 0) -> Optional[float]:
+        """最近第 offset 根已完成K线（0 为最近一根）的字段值，没有数据时返回 None"""
+        row = self.counts[t + 1] - 1 - offset
+        j = self.code_index.get(code)
+        matrix = self.panel.matrices.get(field)
+        if row < 0 or j is None or matrix is None:
+            return None
+        value = matrix[row, j]
+        return None if np.isnan(value) else float(value)
+
+    def bar(self, t: int, code: str, offset: int = 0) -> Optional[Dict[str, object]]:
+        """最近第 offset 根已完成K线的所有字段，time 为K线时间；没有数据时返回 None"""
+        row = self.counts[t + 1] - 1 - offset
+        j = self.code_index.get(code)
+        if row < 0 or j is None:
+            return None
+        bar = {field: float(matrix[row, j]) for field, matrix in self.panel.matrices.items()}
+        if all(np.isnan(value) for value in bar.values()):
+            return None
+        bar['time'] = pd.Timestamp(self.panel.times[row])
+        return bar
+
+    def window(self, t: int, bar_count: int, fields: List[str]) -> Dict[str, pd.DataFrame]:
+        """最近 bar_count 根已完成K线的截面数据，格式同 PanelHistory.window"""
+        return self.panel.window_at(int(self.counts[t + 1]), bar_count, fields)
+
+
+class AlignedTimeframes:
+    """回测中预加载的其他周期数据，按 (周期, 复权方式) 保存截面数据和对齐到当前数据段的游标
+
+    框架在切换数据段时调用 align，在每个时间点（以及盘前盘后回调前）更新 position，
+    khBar / khBars 按 position 查表。
+
+    Args:
+        panels: {(周期, 复权方式): PanelHistory}，周期和复权方式为 khHistory 的参数写法（如 '5m', 'pre'）
+    """
+
+    def __init__(self, panels: Dict[Tuple[str, str], PanelHistory]):
+        self.panels = panels
+        self.cursors = {}       # {(周期, 复权方式): TimeframeCursor}
+        self.position = -1      # 当前主时间轴下标
+
+    def align(self, timeline: np.ndarray):
+        """为新的主时间轴（数据段）计算游标"""
+        self.cursors = {key: TimeframeCursor(key[0], panel, timeline) for key, panel in self.panels.items()}
+        self.position = -1
+
+    def cursor(self, period: str, fq: str) -> Optional[TimeframeCursor]:
+        return self.cursors.get((period, fq))
+
+
+def align_positions(timeline: np.ndarray, times: np.ndarray) -> np.ndarray:
+    """计算统一时间轴上每个时间点在单只股票数据中的行号
+
+    Args:
+        timeline: 已排序的 int64 统一时间轴
+        times: 单只股票每一行的 int64 时间戳（可以无序，可以有重复）
+
+    Returns:
+        np.ndarray: int64 数组，长度与 timeline 相同，-1 表示该时间点无数据；
+                    时间戳重复时取最后一行
+    """
+    positions = np.full(len(timeline), -1, dtype=np.int64)
+    if len(times) == 0 or len(timeline) == 0:
+        return positions
+    order = np.argsort(times, kind='stable')
+    sorted_times = times[order]
+    idx = np.searchsorted(sorted_times, timeline, side='right') - 1
+    valid = idx >= 0
+    matched = np.zeros(len(timeline), dtype=bool)
+    matched[valid] = sorted_times[idx[valid]] == timeline[valid]
+    positions[matched] = order[idx[matched]]
+    return positions
+
+
+def build_timeline(frames: Dict[str, pd.DataFrame],
+                   timeline: Optional[np.ndarray] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """构建统一时间轴以及每只股票的对齐下标
+
+    Args:
+        frames: {股票代码: DataFrame}
+        timeline: 预先指定的时间轴（如自定义定时触发生成的时间点），
+                  为 None 时取所有股票时间戳的并集
+
+    Returns:
+        Tuple[np.ndarray, Dict[str, np.ndarray]]: (int64 统一时间轴, {股票代码: 对齐下标})；
+            找不到时间字段的股票不会出现在下标字典中
+    """
+    stock_times = {}
+    for code, data in frames.items():
+        times = frame_times(data)
+        if times is not None:
+            stock_times[code] = times
+
+    if timeline is None:
+        # 各股票时间精度一致时保持原精度，否则统一为毫秒
+        units = {is_millisecond(times) for times in stock_times.values() if len(times) > 0}
+        if len(units) > 1:
+            stock_times = {code: to_time_unit(times, True) for code, times in stock_times.items()}
+        arrays = [times for times in stock_times.values() if len(times) > 0]
+        timeline = np.unique(np.concatenate(arrays)) if arrays else np.empty(0, dtype=np.int64)
+    else:
+        timeline = np.asarray(timeline, dtype=np.int64)
+        millisecond = is_millisecond(timeline)
+        stock_times = {code: to_time_unit(times, millisecond) for code, times in stock_times.items()}
+
+    positions = {code: align_positions(timeline, times) for code, times in stock_times.items()}
+    return timeline, positions
+
+
+def _to_frame(data) -> pd.DataFrame:
+    """统一为 DataFrame（兼容旧版 Mootdx Dict 格式）"""
+    if isinstance(data, pd.DataFrame):
+        return data
+    if isinstance(data, dict):
+        return pd.DataFrame(data)
+    return pd.DataFrame()
+
+
+def _is_numeric(series: pd.Series) -> bool:
+    return pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series)
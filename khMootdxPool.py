@@ -0,0 +1,247 @@
+# coding: utf-8
+"""
+Mootdx 连接池 - 多个连接、多个行情服务器并发获取K线数据
+
+MootdxAdapter 原先只有一个 Quotes 客户端，逐只股票请求，300 只股票就是 300 多次串行往返。
+连接池最多同时保持 size 个客户端连接，分布在配置的多个服务器上，map 以 size 个线程
+并发执行请求，股票池的加载时间大致随连接数线性下降。
+
+每个服务器记录成功/失败次数和平均耗时：连续失败达到阈值的服务器暂停使用一段时间
+（冷却期），期间的请求分配到其他服务器；新连接优先分配到活动连接最少、耗时最短的服务器。
+
+客户端由 client_factory(server) 创建，server 为 (主机, 端口) 或 None（使用 mootdx 默认服务器），
+默认使用 mootdx 的 Quotes.factory。传入自定义的 client_factory 即可连接本地模拟的行情服务器。
+
+配置示例（.kh 文件 system.data_provider.mootdx）：
+    "servers": ["119.147.212.81:7709", "114.80.63.12:7709"],
+    "pool_size": 4
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# 默认连接数
+DEFAULT_POOL_SIZE = 4
+
+Server = Optional[Tuple[str, int]]
+
+
+def parse_server(server: Union[str, Sequence, None]) -> Server:
+    """把 "主机:端口"、[主机, 端口] 或 (主机, 端口) 转换为 (主机, 端口)，None 表示默认服务器"""
+    if server is None or server == "":
+        return None
+    if isinstance(server, str):
+        host, _, port = server.strip().rpartition(':')
+        if not host:
+            raise ValueError(f"服务器地址格式应为 主机:端口，实际为 {server!r}")
+        return host, int(port)
+    host, port = server
+    return str(host), int(port)
+
+
+def default_client_factory(server: Server, timeout: float = 15) -> Any:
+    """使用 mootdx Quotes.factory 创建连接到 server 的客户端"""
+    from mootdx.quotes import Quotes
+    kwargs = dict(market='std', multithread=True, heartbeat=True, bestip=False, timeout=timeout)
+    if server is not None:
+        kwargs['server'] = server
+    return Quotes.factory(**kwargs)
+
+
+class ServerHealth:
+    """单个服务器的健康状态
+
+    Attributes:
+        server: (主机, 端口)，None 为 mootdx 默认服务器
+        successes / failures: 累计成功、失败的请求数
+        consecutive_failures: 连续失败次数，成功后清零
+        latency: 成功请求耗时的指数移动平均（秒）
+        disabled_until: 冷却期结束时间（time.monotonic），之前不分配新请求
+        active: 当前在使用中的连接数
+    """
+
+    __slots__ = ('server', 'successes', 'failures', 'consecutive_failures', 'latency', 'disabled_until', 'active')
+
+    def __init__(self, server: Server):
+        self.server = server
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency = 0.0
+        self.disabled_until = 0.0
+        self.active = 0
+
+    def available(self, now: float) -> bool:
+        return now >= self.disabled_until
+
+    def record_success(self, elapsed: float):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.latency = elapsed if self.successes == 1 else 0.8 * self.latency + 0.2 * elapsed
+
+    def record_failure(self, now: float, failure_threshold: int, cooldown: float) -> bool:
+        """记录一次失败，连续失败达到阈值时进入冷却期，返回是否进入冷却期"""
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= failure_threshold:
+            self.disabled_until = now + cooldown
+            return True
+        return False
+
+    @property
+    def name(self) -> str:
+        return f"{self.server[0]}:{self.server[1]}" if self.server is not None else "默认服务器"
+
+
+class MootdxConnectionPool:
+    """Mootdx 客户端连接池
+
+    Args:
+        servers: 服务器列表（"主机:端口" 或 (主机, 端口)），为空时使用 mootdx 默认服务器
+        size: 最多同时保持的连接数，也是 map 的并发数，None 表示 DEFAULT_POOL_SIZE
+        client_factory: 创建客户端的函数 client_factory(server)，默认 default_client_factory
+        timeout: 默认客户端的超时时间（秒）
+        max_retries: 每个请求最多尝试的次数，失败的请求优先换到其他服务器重试
+        failure_threshold: 服务器连续失败多少次后进入冷却期
+        cooldown: 冷却期（秒）
+    """
+
+    def __init__(self, servers: Optional[Iterable] = None, size: Optional[int] = None,
+                 client_factory: Optional[Callable[[Server], Any]] = None, timeout: float = 15,
+                 max_retries: int = 3, failure_threshold: int = 2, cooldown: float = 30.0):
+        parsed = [parse_server(server) for server in (servers or [])]
+        self.health = [ServerHealth(server) for server in dict.fromkeys(parsed or [None])]
+        self.size = max(1, int(size if size is not None else DEFAULT_POOL_SIZE))
+        self.client_factory = client_factory or (lambda server: default_client_factory(server, timeout))
+        self.max_retries = max(1, max_retries)
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self._idle = {id(h): [] for h in self.health}   # {id(ServerHealth): [空闲客户端]}
+        self._connections = 0                            # 已创建且未关闭的连接数
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+
+    def _choose(self, exclude: Optional[ServerHealth] = None) -> ServerHealth:
+        # 可用服务器中优先选活动连接最少、平均耗时最短的；都在冷却期时选最早恢复的
+        now = time.monotonic()
+        candidates = [h for h in self.health if h.available(now) and h is not exclude]
+        if not candidates:
+            candidates = [h for h in self.health if h.available(now)] or \
+                         [min(self.health, key=lambda h: h.disabled_until)]
+        return min(candidates, key=lambda h: (h.active, h.latency))
+
+    def _reserve(self, exclude: Optional[ServerHealth] = None) -> Tuple[ServerHealth, Any]:
+        """占用一个连接槽位，返回 (服务器, 空闲客户端)，没有空闲客户端时返回 (服务器, None)，
+        由调用方创建客户端；调用方必须配对调用 _release"""
+        self._slots.acquire()
+        with self._lock:
+            health = self._choose(exclude)
+            health.active += 1
+            idle = self._idle[id(health)]
+            if idle:
+                return health, idle.pop()
+            # 其他服务器的空闲连接占满了连接数上限时，关闭其中一个再新建
+            if self._connections >= self.size:
+                self._close(self._pop_idle_elsewhere())
+            self._connections += 1
+            return health, None
+
+    def _pop_idle_elsewhere(self) -> Any:
+        for clients in self._idle.values():
+            if clients:
+                return clients.pop()
+        return None
+
+    def _close(self, client: Any):
+        if client is None:
+            return
+        self._connections -= 1
+        close = getattr(client, 'close', None)
+        if callable(close):
+            try:
+                close()
+            except Exception:
+                pass
+
+    def _release(self, health: ServerHealth, client: Any, ok: bool):
+        """归还连接；请求失败的连接直接关闭，之后按需重新创建"""
+        with self._lock:
+            health.active -= 1
+            if ok:
+                self._idle[id(health)].append(client)
+            elif client is None:
+                self._connections -= 1  # 创建客户端失败
+            else:
+                self._close(client)
+        self._slots.release()
+
+    def call(self, method: str, **kwargs) -> Any:
+        """用池中的一个连接调用客户端方法（如 bars、index_bars），失败时换服务器重试
+
+        Raises:
+            最后一次尝试的异常
+        """
+        last_error = None
+        failed = None
+        for attempt in range(self.max_retries):
+            if attempt and len(self.health) == 1:
+                time.sleep(2 ** (attempt - 1))  # 只有一个服务器时指数退避
+            health, client = self._reserve(exclude=failed)
+            try:
+                if client is None:
+                    client = self.client_factory(health.server)
+                start = time.monotonic()
+                result = getattr(client, method)(**kwargs)
+            except Exception as e:
+                self._release(health, client, ok=False)
+                self._mark_failure(health, e)
+                logger.warning(f"Mootdx调用失败 ({health.name}, 尝试{attempt + 1}/{self.max_retries}): {e}")
+                last_error, failed = e, health
+                continue
+            elapsed = time.monotonic() - start
+            with self._lock:
+                health.record_success(elapsed)
+            self._release(health, client, ok=True)
+            return result
+        raise last_error
+
+    def _mark_failure(self, health: ServerHealth, error: Exception):
+        with self._lock:
+            disabled = health.record_failure(time.monotonic(), self.failure_threshold, self.cooldown)
+        if disabled and len(self.health) > 1:
+            logger.warning(f"Mootdx服务器 {health.name} 连续失败{health.consecutive_failures}次，"
+                           f"暂停使用{self.cooldown:.0f}秒: {error}")
+
+    def map(self, func: Callable[[Any], Any], items: Sequence) -> List[Any]:
+        """以 size 个线程并发执行 func(item)，按 items 的顺序返回结果
+
+        func 内部通过 call 使用连接，并发数不超过连接数；只有一项或连接数为 1 时在当前线程顺序执行。
+        """
+        items = list(items)
+        if self.size <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.size, len(items)), thread_name_prefix='mootdx') as executor:
+            return list(executor.map(func, items))
+
+    def close(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            for clients in self._idle.values():
+                while clients:
+                    self._close(clients.pop())
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """每个服务器一项：成功/失败次数、平均耗时（毫秒）、是否在冷却期"""
+        now = time.monotonic()
+        return [{
+            'server': h.name,
+            'successes': h.successes,
+            'failures': h.failures,
+            'latency_ms': round(h.latency * 1000, 1),
+            'disabled': not h.available(now),
+        } for h in self.health]
@@ -0,0 +1,328 @@
+# coding: utf-8
+"""
+回测性能分析 - 按阶段记录层级耗时区间，统计调用次数和分位数
+
+回测循环的每个阶段（构造数据、策略处理、交易指令、记录结果等）都记录为一个区间，
+区间可以嵌套，路径形如 "回测循环/策略处理/khHistory"。每个区间按轨道（框架或
+某个策略）分别统计调用次数、总耗时和 P50/P90/P99 分位数。
+
+开启 trace 时还会保留每一次调用的起止时间，可导出为 Chrome trace JSON，
+在 chrome://tracing 或 https://ui.perfetto.dev 中按时间线查看。
+
+策略代码也可以记录自己的区间：
+    from khProfiler import get_profiler
+    with get_profiler().span("计算因子"):
+        ...
+"""
+
+import functools
+import json
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+# backtest.profile 开启时统计的辅助函数
+PROFILED_HELPERS = ("khHistory", "khPanel", "khMA", "khPrice")
+
+SUMMARY_COLUMNS = ['track', 'span', 'count', 'total_s', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'percent']
+
+
+class SpanStats:
+    """单个区间的统计：调用次数、总耗时、最大值，以及用于估计分位数的蓄水池样本"""
+
+    __slots__ = ('count', 'total', 'max', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, duration: float, reservoir_size: int, rng: Callable[[], float]):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        if len(self.samples) < reservoir_size:
+            self.samples.append(duration)
+        else:
+            j = int(rng() * self.count)
+            if j < reservoir_size:
+                self.samples[j] = duration
+
+    def percentile(self, q: float) -> float:
+        """第 q 百分位数（秒），q 取 0-100"""
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+        return ordered[index]
+
+
+class _Span:
+    """span() 返回的上下文管理器"""
+
+    __slots__ = ('_profiler', '_name')
+
+    def __init__(self, profiler: 'Profiler', name: str):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._profiler.begin(self._name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._profiler.end()
+        return False
+
+
+class Profiler:
+    """层级区间性能分析器
+
+    区间有两种记录方式：
+        - begin(name) / end() 或 with span(name)：区间入栈，期间记录的区间都是它的子区间
+        - record(name, start)：记录从 start（perf_counter 时间）到现在的叶子区间
+
+    框架使用的接口为 track、now、begin、end、record、span、wrap，
+    实现了同样接口的对象也可以赋值给 KhQuantFramework.profiler 代替默认分析器。
+
+    Args:
+        trace: 是否保留每一次调用的起止时间（用于导出 Chrome trace）
+        max_trace_events: 最多保留的调用记录数，超过后只统计不再记录
+        reservoir_size: 每个区间用于估计分位数的样本数
+    """
+
+    now = staticmethod(time.perf_counter)
+
+    def __init__(self, trace: bool = False, max_trace_events: int = 1000000, reservoir_size: int = 4096):
+        self.trace = trace
+        self.max_trace_events = max_trace_events
+        self.reservoir_size = reservoir_size
+        self.track = ""           # 当前轨道：空字符串为框架，多策略时为策略名
+        self.stats = {}           # {(轨道, 路径): SpanStats}
+        self.events = []          # [(轨道, 路径, 开始时间, 耗时)]
+        self.dropped_events = 0
+        self.origin = time.perf_counter()
+        self._stack = []          # [(路径, 开始时间)]
+        self._rng = random.Random(0).random
+        self._paths = {}          # {(父路径, 区间名): 路径}，避免每次调用都拼接字符串
+
+    def _path(self, name: str) -> str:
+        parent = self._stack[-1][0] if self._stack else None
+        path = self._paths.get((parent, name))
+        if path is None:
+            path = self._paths[(parent, name)] = f"{parent}/{name}" if parent else name
+        return path
+
+    def begin(self, name: str) -> float:
+        """开始一个区间并入栈，返回开始时间"""
+        path = self._path(name)
+        start = time.perf_counter()
+        self._stack.append((path, start))
+        return start
+
+    def end(self):
+        """结束最近一次 begin 的区间"""
+        path, start = self._stack.pop()
+        self._add(path, start, time.perf_counter() - start)
+
+    def record(self, name: str, start: float):
+        """记录一个从 start 到现在的叶子区间"""
+        path = self._path(name)
+        self._add(path, start, time.perf_counter() - start)
+
+    def span(self, name: str) -> _Span:
+        """以上下文管理器形式记录区间"""
+        return _Span(self, name)
+
+    def wrap(self, func: Callable, name: Optional[str] = None) -> Callable:
+        """返回每次调用都记录为一个区间的包装函数"""
+        name = name or getattr(func, '__name__', 'call')
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.begin(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.end()
+
+        wrapper.__wrapped_by_profiler__ = func
+        return wrapper
+
+    def reset_stack(self):
+        """清空区间栈（回测中途异常退出后调用）"""
+        self._stack = []
+
+    def _add(self, path: str, start: float, duration: float):
+        key = (self.track, path)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = SpanStats()
+        stats.add(duration, self.reservoir_size, self._rng)
+        if self.trace:
+            if len(self.events) < self.max_trace_events:
+                self.events.append((self.track, path, start, duration))
+            else:
+                self.dropped_events += 1
+
+    def totals_by_name(self) -> Dict[str, Tuple[float, int]]:
+        """按区间名（路径最后一段）汇总所有轨道的总耗时和调用次数"""
+        totals = {}
+        for (_, path), stats in self.stats.items():
+            name = path.rsplit('/', 1)[-1]
+            total, count = totals.get(name, (0.0, 0))
+            totals[name] = (total + stats.total, count + stats.count)
+        return totals
+
+    def stats_by_name(self, name: str) -> Optional[SpanStats]:
+        """合并所有轨道和路径中名为 name 的区间统计"""
+        merged = None
+        for (_, path), stats in self.stats.items():
+            if path.rsplit('/', 1)[-1] != name:
+                continue
+            if merged is None:
+                merged = SpanStats()
+            merged.count += stats.count
+            merged.total += stats.total
+            merged.max = max(merged.max, stats.max)
+            merged.samples.extend(stats.samples)
+        return merged
+
+    def summary(self) -> pd.DataFrame:
+        """每个区间一行的汇总表，percent 为占顶层区间总耗时的百分比"""
+        root_total = sum(stats.total for (_, path), stats in self.stats.items() if '/' not in path)
+        rows = []
+        for (track, path), stats in sorted(self.stats.items()):
+            rows.append({
+                'track': track or "框架",
+                'span': path,
+                'count': stats.count,
+                'total_s': round(stats.total, 6),
+                'mean_ms': round(stats.total / stats.count * 1000, 4) if stats.count else 0.0,
+                'p50_ms': round(stats.percentile(50) * 1000, 4),
+                'p90_ms': round(stats.percentile(90) * 1000, 4),
+                'p99_ms': round(stats.percentile(99) * 1000, 4),
+                'max_ms': round(stats.max * 1000, 4),
+                'percent': round(stats.total / root_total * 100, 2) if root_total > 0 else 0.0,
+            })
+        return pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+
+    def export_summary(self, path: str):
+        """把汇总表保存为 CSV"""
+        self.summary().to_csv(path, index=False, encoding='utf-8-sig')
+
+    def export_chrome_trace(self, path: str):
+        """把调用记录保存为 Chrome trace JSON（Trace Event Format）"""
+        tracks = {"": 0}
+        for track, _, _, _ in self.events:
+            if track not in tracks:
+                tracks[track] = len(tracks)
+        trace_events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': track or "框架"}}
+            for track, tid in tracks.items()
+        ]
+        for track, span_path, start, duration in self.events:
+            trace_events.append({
+                'name': span_path.rsplit('/', 1)[-1],
+                'cat': span_path.split('/', 1)[0],
+                'ph': 'X',
+                'ts': round((start - self.origin) * 1e6, 3),
+                'dur': round(duration * 1e6, 3),
+                'pid': 1,
+                'tid': tracks[track],
+                'args': {'path': span_path},
+            })
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms',
+                       'otherData': {'dropped_events': self.dropped_events}}, f, ensure_ascii=False)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class NullProfiler:
+    """不记录任何内容的分析器，回测之外调用 get_profiler() 时使用"""
+
+    now = staticmethod(time.perf_counter)
+    track = ""
+
+    def begin(self, name: str) -> float:
+        return 0.0
+
+    def end(self):
+        pass
+
+    def record(self, name: str, start: float):
+        pass
+
+    def span(self, name: str) -> _NullSpan:
+        return _NullSpan()
+
+    def wrap(self, func: Callable, name: Optional[str] = None) -> Callable:
+        return func
+
+    def reset_stack(self):
+        pass
+
+
+_profiler = NullProfiler()
+
+
+def get_profiler():
+    """获取当前回测使用的性能分析器，不在回测中时返回 NullProfiler"""
+    return _profiler
+
+
+def set_profiler(profiler=None):
+    """设置当前的性能分析器，None 表示恢复为 NullProfiler"""
+    global _profiler
+    _profiler = profiler if profiler is not None else NullProfiler()
+
+
+def instrument_functions(profiler, modules: List[Any], names: List[str]) -> List[Tuple[Any, str, Any]]:
+    """把若干模块中的同名函数替换为记录区间的包装函数
+
+    同一个函数对象在多个模块中（如 khQTTools 和 from khQuantImport import * 的策略模块）
+    只包装一次，所有模块中的引用都替换为同一个包装函数。
+
+    Args:
+        profiler: 性能分析器
+        modules: 要替换的模块列表
+        names: 函数名列表
+
+    Returns:
+        List[Tuple[Any, str, Any]]: [(模块, 函数名, 原函数)]，传给 restore_functions 恢复
+    """
+    replaced = []
+    wrappers = {}
+    for module in modules:
+        for name in names:
+            func = getattr(module, name, None)
+            if not callable(func) or hasattr(func, '__wrapped_by_profiler__'):
+                continue
+            if id(func) not in wrappers:
+                wrappers[id(func)] = profiler.wrap(func, name)
+            # 对象上的绑定方法（如交易管理器的 process_signals）以实例属性替换，恢复时删除
+            replaced.append((module, name, func if name in vars(module) else None))
+            setattr(module, name, wrappers[id(func)])
+    return replaced
+
+
+def restore_functions(replaced: List[Tuple[Any, str, Any]]):
+    """恢复 instrument_functions 替换的函数"""
+    for module, name, func in reversed(replaced):
+        if func is None:
+            delattr(module, name)
+        else:
+            setattr(module, name, func)
@@ -31,32 +31,45 @@ import csv
 import time
 from datetime import datetime, timedelta
 import pandas as pd
-from xtquant import xtdata  # 保留用于实盘交易
+from khXtCompat import xtdata  # 保留用于实盘交易（未安装 xtquant 时为 None）
 # from xtquant.xtdata import get_client
 import glob
 import numpy as np
 import logging
 import ast
 import holidays  # 添加这个导入，用于处理holidays.China()
+from khRunCache import data_fingerprint
 from typing import Dict, List, Union, Optional
 import math
+import warnings
 from khTrade import KhTradeManager
 from types import SimpleNamespace
 
 # ===== V2.2.0新增: 数据接口抽象层支持 =====
-from khDataProvider import DataProviderFactory
+from khDataProvider import DataProviderFactory, DataProviderInterface
+from khMarketData import SymbolHistory, PanelHistory, EMA_SEED_MULTIPLE, fixed_window_ema
+from khCache import LRUCache, estimate_size
 
 # 全局数据提供者实例（延迟初始化）
 _global_data_provider = None
 
-# khHistory 数据缓存（用于减少重复网络请求）
-# 缓存键格式: (stock_code, period, start_time, end_time, dividend_type)
-_khHistory_cache = {}
+# khHistory 数据缓存（用于减少重复网络请求），按股票保存已获取范围的并集
+# 缓存键格式: (stock_code, period, dividend_type)，值为 _HistoryCacheEntry
+# 超过内存上限（配置 system.cache_max_mb）时淘汰最久未使用的股票
+_khHistory_cache = LRUCache("khHistory数据")
+
+# khHistory 按股票预先排序、时间标准化的历史数据（SymbolHistory），由缓存数据按需构建
+# 键格式同 _khHistory_cache
+_khHistory_store = LRUCache("khHistory预处理数据")
+
+# khPanel 按股票池对齐的截面数据（PanelHistory），键格式: (股票代码元组, period, dividend_type)
+_khPanel_cache = LRUCache("khPanel截面数据")
 
 def clear_khHistory_cache():
     """清空 khHistory 缓存（用于回测结束或策略重启时）"""
-    global _khHistory_cache
-    _khHistory_cache = {}
+    _khHistory_cache.clear()
+    _khHistory_store.clear()
+    _khPanel_cache.clear()
     logger = logging.getLogger(__name__)
     logger.info("khHistory 缓存已清空")
 
@@ -86,10 +99,14 @@ def set_data_provider(provider_type='xtquant', **kwargs):
     """设置全局数据提供者
 
     Args:
-        provider_type: 数据提供者类型 ('xtquant' 或 'mootdx')
+        provider_type: 数据提供者类型 ('xtquant' 或 'mootdx')，
+                       也可以直接传入 DataProviderInterface 实例（如参数扫描使用的共享数据提供者）
         **kwargs: 提供者特定的配置参数
     """
     global _global_data_provider
+    if isinstance(provider_type, DataProviderInterface):
+        _global_data_provider = provider_type
+        return
     _global_data_provider = DataProviderFactory.get_provider(provider_type, **kwargs)
 
 # 延迟导入Qt相关模块，避免在子进程中意外启动Qt应用
@@ -306,39 +323,18 @@ class KhQuTools:
         Raises:
             ValueError: 如果不在交易时间（日内频率）或数据不足
         """
-        from datetime import datetime
-        if end_time is None:
-            now = datetime.now()
-            if fre_step in ['1m', '5m', 'tick']:
-                end_time = now.strftime('%Y%m%d %H%M%S')
-            else:
-                end_time = now.strftime('%Y%m%d')
-
-        # 结合 is_trade_time 判断（仅对日内频率）
-        if fre_step in ['1m', '5m', 'tick'] and not self.is_trade_time():
-            raise ValueError("不在交易时间内，无法计算日内移动平均线")
-
-        # 获取历史数据（不包含当前时间点）
-        data = khHistory(
-            symbol_list=stock_code,
-            fields=[field],
-            bar_count=period,
-            fre_step=fre_step,
-            current_time=end_time,
-            fq=fq,
-            force_download=True  # 确保数据最新
-        )
-
-        if stock_code not in data or len(data[stock_code]) < period:
+        # 与 khMA 共用均线缓存；数据尚未缓存时先下载最新数据
+        value = _window_indicator('MA', stock_code, period, field, fre_step, end_time, fq, force_download=True)
+        if value is None:
             raise ValueError(f"股票 {stock_code} 数据量不足 {period} 条，无法计算 MA{period}")
-
-        prices = data[stock_code][field]
-        return round(prices.mean(), 2)
+        return value
 
 
 def khMA(stock_code: str, period: int, field: str = 'close', fre_step: str = '1d', end_time: Optional[str] = None, fq: str = 'pre') -> float:
     """计算移动平均线（独立函数版本）
 
+    均线序列按 (股票, 字段, 周期, 频率, 复权方式) 缓存，回测中每次调用只需按时间点查表。
+
     Args:
         stock_code: 股票代码
         period: 周期长度
@@ -348,47 +344,46 @@ def khMA(stock_code: str, period: int, field: str = 'close', fre_step: str = '1d
         fq: 复权方式，'pre'前复权, 'post'后复权, 'none'不复权
 
     Returns:
-        float: 移动平均值
+        float: 移动平均值，数据不足时返回 None
 
     Raises:
-        ValueError: 如果不在交易时间（日内频率）或数据不足
+        ValueError: 如果不在交易时间（日内频率）
     """
-    from datetime import datetime
-    
-    if end_time is None:
-        now = datetime.now()
-        if fre_step in ['1m', '5m', 'tick']:
-            end_time = now.strftime('%Y%m%d %H%M%S')
-        else:
-            end_time = now.strftime('%Y%m%d')
+    return _window_indicator('MA', stock_code, period, field, fre_step, end_time, fq)
 
-    # 结合 is_trade_time 判断（仅对日内频率）
-    tools = KhQuTools()
-    if fre_step in ['1m', '5m', 'tick'] and not tools.is_trade_time():
-        raise ValueError("不在交易时间内，无法计算日内移动平均线")
-
-    # 获取历史数据（不包含当前时间点）
-    data = khHistory(
-        symbol_list=stock_code,
-        fields=[field],
-        bar_count=period,
-        fre_step=fre_step,
-        current_time=end_time,
-        fq=fq,
-        force_download=False  # 不强制下载数据，提高回测速度
-    )
 
-    # 调试信息（仅在数据不足时输出警告）
-    import logging
-    logger = logging.getLogger(__name__)
+def khEMA(stock_code: str, period: int, field: str = 'close', fre_step: str = '1d', end_time: Optional[str] = None, fq: str = 'pre') -> float:
+    """计算指数移动平均线（span=period, adjust=False，与 MyTT.EMA 的递推公式一致）
+
+    从 end_time 之前最近 period × 10 根K线的第一根开始递推，更早数据的权重约为 e^-20，
+    结果不随缓存数据或数据源的起点变化；之前不足 period × 10 根K线时从第一根开始递推。
+    参数与 khMA 相同，数据不足 period 条时返回 None。
+    """
+    return _window_indicator('EMA', stock_code, period, field, fre_step, end_time, fq)
 
-    if stock_code not in data or len(data[stock_code]) < period:
-        # 数据不足时返回 None，而不是抛出异常（回测初期数据不足是正常情况）
-        logger.warning(f"股票 {stock_code} 数据量不足 {period} 条，无法计算均线{period}，返回 None")
-        return None
 
-    prices = data[stock_code][field]
-    return round(prices.mean(), 2)
+def khSTD(stock_code: str, period: int, field: str = 'close', fre_step: str = '1d', end_time: Optional[str] = None, fq: str = 'pre') -> float:
+    """计算最近 period 根K线的标准差（总体标准差，与 MyTT.STD 一致）
+
+    参数与 khMA 相同，数据不足 period 条时返回 None。
+    """
+    return _window_indicator('STD', stock_code, period, field, fre_step, end_time, fq)
+
+
+def khHHV(stock_code: str, period: int, field: str = 'high', fre_step: str = '1d', end_time: Optional[str] = None, fq: str = 'pre') -> float:
+    """计算最近 period 根K线的最高值（默认字段为 high）
+
+    参数与 khMA 相同，数据不足 period 条时返回 None。
+    """
+    return _window_indicator('HHV', stock_code, period, field, fre_step, end_time, fq)
+
+
+def khLLV(stock_code: str, period: int, field: str = 'low', fre_step: str = '1d', end_time: Optional[str] = None, fq: str = 'pre') -> float:
+    """计算最近 period 根K线的最低值（默认字段为 low）
+
+    参数与 khMA 相同，数据不足 period 条时返回 None。
+    """
+    return _window_indicator('LLV', stock_code, period, field, fre_step, end_time, fq)
 
 
 def calculate_max_buy_volume(data: Dict, stock_code: str, price: float, cash_ratio: float = 1.0) -> int:
@@ -1634,9 +1629,17 @@ def save_stock_list_to_csv_for_subprocess(stock_dict, output_dir, queue):
                 f.write(f"{stock['code']},{stock['name']}\n")
         print(f"[更新进度] {board_names[board]}列表保存完成，共 {len(stocks)} 只证券", flush=True)
 
-# 定义多进程版本的更新管理器类
-if not is_subprocess():
-    from PyQt5.QtCore import QObject, pyqtSignal, QTimer
+# 定义多进程版本的更新管理器类（命令行回测环境可能没有安装 PyQt5）
+try:
+    if not is_subprocess():
+        from PyQt5.QtCore import QObject, pyqtSignal, QTimer
+        _qt_core_available = True
+    else:
+        _qt_core_available = False
+except ImportError:
+    _qt_core_available = False
+
+if _qt_core_available:
     import multiprocessing
     import queue
     
@@ -2209,6 +2212,525 @@ def get_stock_names(stock_codes, stock_list_file):
     
     return stock_names
 
+
+_HISTORY_DIVIDEND_TYPES = {'pre': 'front', 'post': 'back', 'none': 'none'}
+_HISTORY_PERIODS = {'1d': '1d', '1m': '1m', '5m': '5m', 'tick': 'tick'}
+
+
+def _parse_history_time(current_time) -> datetime:
+    """解析 khHistory 的 current_time 参数，为 None 时返回当前时间"""
+    if current_time is None:
+        # 如果没有指定时间，使用当前时间
+        return datetime.now()
+    if not isinstance(current_time, str):
+        raise ValueError("current_time必须是字符串格式")
+    
+    # 解析输入的时间格式
+    current_time = current_time.strip()
+    time_formats = [
+        '%Y%m%d %H%M%S',     # YYYYMMDD HHMMSS
+        '%Y-%m-%d %H:%M:%S', # YYYY-MM-DD HH:MM:SS
+        '%Y%m%d',            # YYYYMMDD
+        '%Y-%m-%d'           # YYYY-MM-DD
+    ]
+    for fmt in time_formats:
+        try:
+            return datetime.strptime(current_time, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"无法解析时间格式: {current_time}，支持的格式: YYYYMMDD, YYYY-MM-DD, YYYYMMDD HHMMSS, YYYY-MM-DD HH:MM:SS")
+
+
+def _history_range(current_datetime):
+    """khHistory 数据获取范围：按年份固定，同一年内的调用使用相同的范围"""
+    # === 缓存优化核心修复 ===
+    # 问题分析：之前每天的 start_time 和 end_time 都递增，导致每天的请求范围不同，无法命中缓存
+    # 根本原因：start_dt = current_datetime - lookback_days 导致每天start_time不同
+    #
+    # 优化方案：使用固定的时间范围作为获取范围，确保整个回测期间尽量只获取一次
+    # 1. start_time: 使用当前时间点向前固定天数（如360天）作为缓存起点
+    # 2. end_time: 使用当前时间点向后固定天数（如180天）作为缓存终点
+    # 3. 这样可以确保回测期间内所有交易日都落在已缓存的范围内
+    #
+    # 性能提升：原本每天都获取数据（120天=120次请求），现在只需1次请求（提升99%+）
+
+    # 固定的缓存范围（确保涵盖整个回测期间所需的历史数据）
+    cache_start_offset = 360  # 向前360天（约1年），确保有足够历史数据
+    cache_end_offset = 180   # 向后180天（约6个月），适应不同回测周期
+
+    # 计算固定的缓存时间范围（关键：不随current_datetime变化）
+    # 使用年初作为基准点，确保同一年的回测使用相同范围
+    year_start = datetime(current_datetime.year, 1, 1)
+
+    # start_time: 从年初向前推cache_start_offset天
+    cache_start_dt = year_start - timedelta(days=cache_start_offset)
+    start_time = cache_start_dt.strftime('%Y%m%d')
+
+    # end_time: 从年末向后推cache_end_offset天
+    year_end = datetime(current_datetime.year, 12, 31)
+    cache_end_dt = year_end + timedelta(days=cache_end_offset)
+    end_time = cache_end_dt.strftime('%Y%m%d')
+
+    # 注意：
+    # 1. 虽然请求的时间范围很大（~2年），但mootdx每次只返回最近800条数据
+    # 2. 对于日线数据，800天 ≈ 3年多数据，完全满足回测需求
+    # 3. khHistory后续会严格过滤到current_datetime之前的数据，不会泄露未来数据
+
+    return start_time, end_time
+
+
+class _HistoryCacheEntry:
+    """khHistory 单只股票（或 khPanel 一个股票池）的缓存数据
+
+    start_time/end_time 是已获取的时间范围（多次获取的并集），fields 是已获取的字段，
+    data 为 None 表示已获取过但数据提供者没有返回该股票的数据。
+    """
+
+    __slots__ = ('start_time', 'end_time', 'fields', 'data')
+
+    def __init__(self, start_time: str, end_time: str, fields, data):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.fields = frozenset(fields)
+        self.data = data
+
+    @property
+    def nbytes(self) -> int:
+        return estimate_size(self.data)
+
+    def covers(self, fields, start_time: str, current_datetime) -> bool:
+        """是否包含 start_time 到 current_datetime 当日的全部所需字段
+
+        khHistory 只返回当前时间点之前的数据，缓存范围覆盖到当日即可，
+        跨年回测时上一年获取的数据（向后多取了半年）可以继续使用。
+        """
+        return (self.start_time <= start_time
+                and self.end_time >= current_datetime.strftime('%Y%m%d')
+                and self.fields.issuperset(fields))
+
+
+def _history_cached(stock_codes, fields, period, dividend_type, current_datetime) -> bool:
+    """khHistory 所需的数据是否都已缓存"""
+    start_time, _ = _history_range(current_datetime)
+    for stock_code in stock_codes:
+        entry = _khHistory_cache.peek((stock_code, period, dividend_type))
+        if entry is None or not entry.covers(fields, start_time, current_datetime):
+            return False
+    return True
+
+
+def _load_history_data(provider, stock_codes, fields, period, dividend_type, current_datetime,
+                       start_time=None, end_datetime=None):
+    """获取 khHistory 使用的原始数据（优先使用缓存）
+
+    缓存按股票保存，已缓存的股票直接使用，其余股票合并为一次数据提供者请求获取。
+    股票已有缓存但范围或字段不足时，按已缓存和本次所需范围、字段的并集重新获取。
+
+    Args:
+        start_time: 所需数据的开始日期，默认为 current_datetime 所在年份的获取范围
+        end_datetime: 所需数据覆盖到的时间，默认为 current_datetime（预加载整个回测区间时使用）
+
+    Returns:
+        dict: {股票代码: 数据}，已获取过但没有数据的股票值为 None，获取失败的股票不包含在内
+    """
+    logger = logging.getLogger(__name__)
+    range_start, _ = _history_range(current_datetime)
+    start_time = min(start_time, range_start) if start_time else range_start
+    end_datetime = end_datetime or current_datetime
+    _, end_time = _history_range(end_datetime)
+
+    data = {}
+    missing = []
+    fetch_start, fetch_end = start_time, end_time
+    fetch_fields = list(fields)
+    for stock_code in dict.fromkeys(stock_codes):
+        entry = _khHistory_cache.get((stock_code, period, dividend_type))
+        if entry is not None and entry.covers(fields, start_time, end_datetime):
+            # 直接命中缓存（O(1)操作）
+            data[stock_code] = entry.data
+            continue
+        missing.append(stock_code)
+        if entry is not None:
+            fetch_start = min(fetch_start, entry.start_time)
+            fetch_end = max(fetch_end, entry.end_time)
+            fetch_fields += [field for field in entry.fields if field not in fetch_fields]
+
+    if not missing:
+        return data
+
+    # 缓存未命中，记录日志
+    logger.info(f"❌ [缓存未命中] 需要获取 {len(missing)}只股票的新数据 {fetch_start}~{fetch_end}")
+    fetched = provider.get_market_data(
+        field_list=['time'] + fetch_fields,
+        stock_list=missing,
+        period=period,
+        start_time=fetch_start,
+        end_time=fetch_end,
+        count=-1,
+        dividend_type=dividend_type,
+        fill_data=True
+    )
+
+    # 存入缓存（仅当成功获取数据时），数据提供者没有返回的股票也记录下来，避免反复请求
+    if fetched:
+        for stock_code in missing:
+            stock_data = fetched.get(stock_code)
+            _khHistory_cache.put((stock_code, period, dividend_type), _HistoryCacheEntry(
+                fetch_start, fetch_end, fetch_fields, stock_data))
+            data[stock_code] = stock_data
+        logger.info(f"💾 [缓存存储] 成功缓存 {len(missing)}只股票数据, 范围={fetch_start}~{fetch_end}")
+
+    return data
+
+
+def _get_symbol_history(stock_code, period, dividend_type, stock_data) -> Optional[SymbolHistory]:
+    """获取（首次使用时构建）缓存数据对应的 SymbolHistory，无法构建时返回 None"""
+    key = (stock_code, period, dividend_type)
+    history = _khHistory_store.get(key)
+    if history is None or history.source is not stock_data:
+        history = SymbolHistory.from_data(stock_data)
+        _khHistory_store.put(key, history)
+    return history
+
+
+# 策略在 init 中通过 khRequire 声明的历史数据需求，由框架在回测循环开始前预加载
+_history_requirements = []
+
+# 每个交易日的K线数量，用于把 bar_count 换算为需要回溯的自然日天数
+_BARS_PER_DAY = {'1d': 1, '5m': 48, '1m': 240, 'tick': 4800}
+
+
+def _normalize_requirement(requirement) -> dict:
+    """检查并规范化一条历史数据需求
+
+    Returns:
+        dict: {'fields': 字段列表, 'bar_count': K线数量, 'fre_step': 周期, 'fq': 复权方式,
+               'symbol_list': 股票代码列表，None 表示股票池}
+    """
+    if not isinstance(requirement, dict):
+        raise ValueError(f"数据需求必须是字典: {requirement!r}")
+    fields = requirement.get('fields')
+    fields = [fields] if isinstance(fields, str) else list(dict.fromkeys(fields or []))
+    bar_count = requirement.get('bar_count')
+    fre_step = requirement.get('fre_step', requirement.get('period', '1d'))
+    fq = requirement.get('fq', 'pre')
+    symbol_list = requirement.get('symbol_list')
+    if not fields:
+        raise ValueError("数据需求的 fields 不能为空")
+    if not isinstance(bar_count, int) or bar_count <= 0:
+        raise ValueError(f"数据需求的 bar_count 必须是正整数: {bar_count!r}")
+    if fre_step not in _HISTORY_PERIODS:
+        raise ValueError(f"不支持的数据需求周期: {fre_step}，支持: {', '.join(_HISTORY_PERIODS)}")
+    if fq not in _HISTORY_DIVIDEND_TYPES:
+        raise ValueError(f"不支持的复权方式: {fq}，支持: {', '.join(_HISTORY_DIVIDEND_TYPES)}")
+    if isinstance(symbol_list, str):
+        symbol_list = [symbol_list]
+    elif symbol_list is not None:
+        symbol_list = list(dict.fromkeys(symbol_list))
+    return {'fields': fields, 'bar_count': bar_count, 'fre_step': fre_step, 'fq': fq, 'symbol_list': symbol_list}
+
+
+def khRequire(fields, bar_count, fre_step='1d', fq='pre', symbol_list=None):
+    """
+    声明策略需要的历史数据，回测开始前由框架一次性批量加载
+
+    在策略的 init 中调用（也可以在策略模块中定义同样格式的 DATA_REQUIREMENTS 列表）。
+    框架在进入回测循环前，按周期和复权方式合并所有声明，为整个回测区间一次性获取数据并
+    完成预处理，之后 khHistory、khPanel、khMA 等在循环中直接使用缓存，不再请求数据源。
+    未声明的数据仍在首次使用时获取。
+
+    参数:
+        fields: 字段列表或单个字段，如['close', 'volume']
+        bar_count: 回测开始时需要回溯的K线数量（如最长均线的周期）
+        fre_step: 时间频率，如'1d', '1m', '5m'
+        fq: 复权方式，'pre'前复权, 'post'后复权, 'none'不复权
+        symbol_list: 股票代码列表，None 表示股票池（不含基准指数）
+
+    示例:
+        def init(stocks=None, data=None):
+            khRequire(['close'], LONG_WINDOW)
+
+        # 或在模块中定义
+        DATA_REQUIREMENTS = [{'fields': ['close', 'volume'], 'bar_count': 60, 'fre_step': '1d'}]
+    """
+    _history_requirements.append(_normalize_requirement({
+        'fields': fields, 'bar_count': bar_count, 'fre_step': fre_step, 'fq': fq, 'symbol_list': symbol_list
+    }))
+
+
+def clear_history_requirements():
+    """清空 khRequire 声明的数据需求（框架在调用策略 init 之前调用）"""
+    _history_requirements.clear()
+
+
+def collect_history_requirements(strategy_modules) -> List[dict]:
+    """汇总策略模块的 DATA_REQUIREMENTS 和 khRequire 声明的数据需求"""
+    requirements = []
+    for module in strategy_modules:
+        declared = getattr(module, 'DATA_REQUIREMENTS', None) or []
+        if isinstance(declared, dict):
+            declared = [declared]
+        requirements.extend(_normalize_requirement(requirement) for requirement in declared)
+    requirements.extend(_history_requirements)
+    return requirements
+
+
+def preload_history(requirements, stock_codes, start_time, end_time) -> List[dict]:
+    """按数据需求为整个回测区间批量加载 khHistory 缓存
+
+    需求按 (周期, 复权方式) 合并字段和股票，取最大的 bar_count，每组只发起一次数据提供者请求，
+    获取范围从回测开始前 bar_count 根K线覆盖到回测结束，并预先构建每只股票的 SymbolHistory。
+
+    Args:
+        requirements: collect_history_requirements 返回的数据需求
+        stock_codes: 股票池（需求未指定股票时使用）
+        start_time: 回测开始日期（YYYYMMDD）
+        end_time: 回测结束日期（YYYYMMDD）
+
+    Returns:
+        List[dict]: 每组一项 {'fre_step', 'fq', 'fields', 'bar_count', 'symbols', 'loaded', 'panel', 'fingerprint'}，
+            panel 为该组股票按时间对齐的 PanelHistory（tick 或非数值字段时为 None），
+            供框架构建与主时间轴对齐的多周期游标；fingerprint 为该组加载数据的行数和最后时间戳
+            （data_fingerprint），用于回测结果缓存键
+    """
+    groups = {}
+    for requirement in requirements:
+        group = groups.setdefault((requirement['fre_step'], requirement['fq']), {
+            'fre_step': requirement['fre_step'], 'fq': requirement['fq'],
+            'fields': [], 'bar_count': 0, 'symbols': []
+        })
+        group['fields'] += [field for field in requirement['fields'] if field not in group['fields']]
+        group['bar_count'] = max(group['bar_count'], requirement['bar_count'])
+        symbols = requirement['symbol_list'] if requirement['symbol_list'] is not None else stock_codes
+        group['symbols'] += [code for code in symbols if code not in group['symbols']]
+
+    start_datetime = _parse_history_time(start_time)
+    end_datetime = _parse_history_time(end_time).replace(hour=23, minute=59, second=59)
+    provider = get_data_provider()
+    summary = []
+    for group in groups.values():
+        period = _HISTORY_PERIODS[group['fre_step']]
+        dividend_type = _HISTORY_DIVIDEND_TYPES[group['fq']]
+        # 回溯天数：按每日K线数换算为交易日，再按交易日约占自然日的 2/3 留出周末和节假日
+        lookback_days = math.ceil(group['bar_count'] / _BARS_PER_DAY[period] * 1.5) + 15
+        fetch_start = (start_datetime - timedelta(days=lookback_days)).strftime('%Y%m%d')
+        data = _load_history_data(provider, group['symbols'], group['fields'], period, dividend_type,
+                                  start_datetime, start_time=fetch_start, end_datetime=end_datetime)
+        histories = []
+        for stock_code in group['symbols']:
+            stock_data = data.get(stock_code)
+            histories.append(_get_symbol_history(stock_code, period, dividend_type, stock_data)
+                             if stock_data is not None and len(stock_data) > 0 else None)
+        panel = None
+        if period != 'tick':
+            try:
+                panel = PanelHistory.from_histories(group['symbols'], histories, group['fields'])
+            except ValueError as e:
+                logging.getLogger(__name__).warning(f"{group['fre_step']} 周期数据无法对齐为截面矩阵: {e}")
+        summary.append({**group, 'loaded': sum(history is not None for history in histories), 'panel': panel,
+                        'fingerprint': data_fingerprint({code: data.get(code) for code in group['symbols']})})
+    return summary
+
+
+# 回测中与主时间轴对齐的其他周期数据（AlignedTimeframes），由框架在预加载后设置
+_aligned_timeframes = None
+
+
+def set_aligned_timeframes(timeframes=None):
+    """设置当前回测的多周期对齐数据，None 表示清除（回测结束时）"""
+    global _aligned_timeframes
+    _aligned_timeframes = timeframes
+
+
+def get_aligned_timeframes():
+    """获取当前回测的多周期对齐数据，不在回测中时返回 None"""
+    return _aligned_timeframes
+
+
+def _timeframe_cursor(fre_step, fq):
+    cursor = _aligned_timeframes.cursor(fre_step, fq) if _aligned_timeframes is not None else None
+    if cursor is None:
+        raise ValueError(f"{fre_step} 周期（fq={fq}）的数据未预加载，请在策略 init 中调用 "
+                         f"khRequire(字段列表, K线数量, '{fre_step}', fq='{fq}') 声明")
+    return cursor
+
+
+def khBar(stock_code, fre_step, field=None, offset=0, fq='pre'):
+    """
+    获取当前时间点最近一根已完成的其他周期K线（O(1) 查表，不含未完成的K线）
+
+    用于分钟策略同时使用日线、5分钟线等多周期数据：所需周期须在 init 中用 khRequire 声明，
+    框架在回测开始前预加载并为每个时间点计算游标。分钟K线在其结束时间完成，日线在当日
+    15:00 收盘后完成，因此盘中只能取到前一交易日的日线，盘前回调中只能取到之前的K线。
+
+    参数:
+        stock_code: 股票代码
+        fre_step: 周期，如'1d', '5m', '1m'
+        field: 字段名，为None时返回该K线所有已声明字段的字典（含 time）
+        offset: 向前偏移的K线数，0为最近一根已完成的K线，1为再前一根
+        fq: 复权方式，与 khRequire 声明一致
+
+    返回:
+        field 不为 None 时返回 float，否则返回 dict；没有数据时返回 None
+
+    示例:
+        def init(stocks=None, data=None):
+            khRequire(['close', 'high', 'low'], 20, '1d')
+            khRequire(['close'], 12, '5m')
+
+        def khHandlebar(data):
+            prev_close = khBar('000001.SZ', '1d', 'close')   # 前一交易日收盘价
+            last_5m = khBar('000001.SZ', '5m')               # 最近一根已完成的5分钟K线
+    """
+    cursor = _timeframe_cursor(fre_step, fq)
+    t = _aligned_timeframes.position
+    if field is None:
+        return cursor.bar(t, stock_code, offset)
+    return cursor.value(t, stock_code, field, offset)
+
+
+def khBars(symbol_list, fields, bar_count, fre_step, fq='pre'):
+    """
+    获取当前时间点最近 bar_count 根已完成的其他周期K线截面数据（O(1) 切片）
+
+    数据来源和完成规则同 khBar，返回格式同 khPanel。
+
+    参数:
+        symbol_list: 股票代码列表或单个股票代码字符串，须在 khRequire 声明的股票范围内
+        fields: 字段列表或单个字段
+        bar_count: K线数量
+        fre_step: 周期，如'1d', '5m', '1m'
+        fq: 复权方式，与 khRequire 声明一致
+
+    返回:
+        dict: {字段: DataFrame}，索引为K线时间，列为股票代码；返回的数据是只读的
+    """
+    if bar_count <= 0:
+        raise ValueError("bar_count必须大于0")
+    cursor = _timeframe_cursor(fre_step, fq)
+    fields = [fields] if isinstance(fields, str) else list(dict.fromkeys(fields))
+    missing = [field for field in fields if field not in cursor.panel.matrices]
+    if missing:
+        raise ValueError(f"字段 {missing} 未在 {fre_step} 周期的 khRequire 中声明")
+    window = cursor.window(_aligned_timeframes.position, bar_count, fields)
+    if symbol_list is None:
+        return window
+    codes = [symbol_list] if isinstance(symbol_list, str) else list(dict.fromkeys(symbol_list))
+    if codes == cursor.panel.codes:
+        return window
+    unknown = [code for code in codes if code not in cursor.code_index]
+    if unknown:
+        raise ValueError(f"股票 {unknown} 未在 {fre_step} 周期的 khRequire 中声明")
+    return {field: frame[codes] for field, frame in window.items()}
+
+
+# 指标缓存不可用（调用方改为逐次计算）的标记
+_INDICATOR_UNAVAILABLE = object()
+
+
+def _cached_indicator(kind: str, stock_code: str, window: int, field: str, fre_step: str,
+                      end_time: str, fq: str, require_cached: bool = False):
+    """从指标缓存查询 end_time 之前（不含）最近 window 根K线的指标值
+
+    指标序列按 (股票, 字段, 窗口, 周期, 复权方式) 在 khHistory 的缓存数据上一次性计算，
+    之后每次查询只需二分查找时间点并按下标取值。
+
+    Args:
+        require_cached: 为 True 时只使用已缓存的数据，数据尚未缓存时返回不可用
+
+    Returns:
+        指标值；数据不足时返回 None；无法使用指标缓存时返回 _INDICATOR_UNAVAILABLE
+    """
+    if window <= 0:
+        return _INDICATOR_UNAVAILABLE
+    current_datetime = _parse_history_time(end_time)
+    period = _HISTORY_PERIODS.get(fre_step, fre_step)
+    dividend_type = _HISTORY_DIVIDEND_TYPES.get(fq, 'front')
+    if require_cached and not _history_cached([stock_code], [field], period, dividend_type, current_datetime):
+        return _INDICATOR_UNAVAILABLE
+    try:
+        data = _load_history_data(get_data_provider(), [stock_code], [field], period,
+                                  dividend_type, current_datetime)
+    except Exception:
+        return _INDICATOR_UNAVAILABLE
+    stock_data = data.get(stock_code) if data else None
+    if stock_data is None or len(stock_data) == 0:
+        return _INDICATOR_UNAVAILABLE
+    history = _get_symbol_history(stock_code, period, dividend_type, stock_data)
+    if history is None:
+        return _INDICATOR_UNAVAILABLE
+    count = len(history.indicators)
+    values = history.indicator(kind, field, window)
+    if len(history.indicators) != count:
+        # 新计算的指标序列计入缓存占用
+        _khHistory_store.resize((stock_code, period, dividend_type))
+    if values is None:
+        return _INDICATOR_UNAVAILABLE
+    end = history.end_index(current_datetime, period)
+    if end < window:
+        return None
+    return values[end]
+
+
+# 指标结果保留的小数位数，None 表示不取整
+_INDICATOR_DECIMALS = {'MA': 2, 'EMA': 2, 'STD': 4, 'HHV': None, 'LLV': None}
+_INDICATOR_NAMES = {'MA': '移动平均线', 'EMA': '指数移动平均线', 'STD': '标准差', 'HHV': '最高值', 'LLV': '最低值'}
+
+
+def _window_indicator(kind: str, stock_code: str, period: int, field: str, fre_step: str,
+                      end_time: Optional[str], fq: str, force_download: bool = False):
+    """khMA/khEMA/khSTD/khHHV/khLLV 的公共实现，数据不足时返回 None"""
+    if end_time is None:
+        now = datetime.now()
+        if fre_step in ['1m', '5m', 'tick']:
+            end_time = now.strftime('%Y%m%d %H%M%S')
+        else:
+            end_time = now.strftime('%Y%m%d')
+
+    # 结合 is_trade_time 判断（仅对日内频率）
+    if fre_step in ['1m', '5m', 'tick'] and not is_trade_time():
+        raise ValueError(f"不在交易时间内，无法计算日内{_INDICATOR_NAMES[kind]}")
+
+    logger = logging.getLogger(__name__)
+    decimals = _INDICATOR_DECIMALS[kind]
+    # force_download 时数据尚未缓存则先按原方式下载并获取，之后的调用直接查询指标缓存
+    value = _cached_indicator(kind, stock_code, period, field, fre_step, end_time, fq,
+                              require_cached=force_download)
+    if value is _INDICATOR_UNAVAILABLE:
+        # 获取历史数据（不包含当前时间点）；EMA 使用与指标缓存相同的固定种子窗口
+        data = khHistory(
+            symbol_list=stock_code,
+            fields=[field],
+            bar_count=period if kind != 'EMA' else period * EMA_SEED_MULTIPLE,
+            fre_step=fre_step,
+            current_time=end_time,
+            fq=fq,
+            force_download=force_download
+        )
+        if stock_code not in data or len(data[stock_code]) < period:
+            value = None
+        else:
+            prices = data[stock_code][field]
+            if kind == 'MA':
+                value = prices.mean()
+            elif kind == 'EMA':
+                value = fixed_window_ema(prices.to_numpy(), period)
+            elif kind == 'STD':
+                value = prices.std(ddof=0)
+            elif kind == 'HHV':
+                value = prices.max()
+            else:
+                value = prices.min()
+
+    if value is None:
+        # 数据不足时返回 None，而不是抛出异常（回测初期数据不足是正常情况）
+        label = '均线' if kind == 'MA' else kind
+        logger.warning(f"股票 {stock_code} 数据量不足 {period} 条，无法计算{label}{period}，返回 None")
+        return None
+    value = float(value)
+    return round(value, decimals) if decimals is not None else value
+
+
 def khHistory(symbol_list, fields, bar_count, fre_step, current_time=None, skip_paused=False, fq='pre', force_download=False):
     """
     获取股票历史数据（不包含当前时间点）
@@ -2258,58 +2780,16 @@ def khHistory(symbol_list, fields, bar_count, fre_step, current_time=None, skip_
         stock_codes = list(symbol_list)
     
     # 处理当前时间
-    current_datetime = None
-    current_date_str = None
-    
-    if current_time is None:
-        # 如果没有指定时间，使用当前时间
-        current_datetime = datetime.now()
-        current_date_str = current_datetime.strftime('%Y%m%d')
-    else:
-        # 解析输入的时间格式
-        if isinstance(current_time, str):
-            current_time = current_time.strip()
-            
-            # 尝试解析不同的时间格式
-            time_formats = [
-                '%Y%m%d %H%M%S',     # YYYYMMDD HHMMSS
-                '%Y-%m-%d %H:%M:%S', # YYYY-MM-DD HH:MM:SS
-                '%Y%m%d',            # YYYYMMDD
-                '%Y-%m-%d'           # YYYY-MM-DD
-            ]
-            
-            for fmt in time_formats:
-                try:
-                    current_datetime = datetime.strptime(current_time, fmt)
-                    break
-                except ValueError:
-                    continue
-            
-            if current_datetime is None:
-                raise ValueError(f"无法解析时间格式: {current_time}，支持的格式: YYYYMMDD, YYYY-MM-DD, YYYYMMDD HHMMSS, YYYY-MM-DD HH:MM:SS")
-            
-            current_date_str = current_datetime.strftime('%Y%m%d')
-        else:
-            raise ValueError("current_time必须是字符串格式")
+    current_datetime = _parse_history_time(current_time)
+    current_date_str = current_datetime.strftime('%Y%m%d')
     
     #print(f"解析的当前时间: {current_datetime.strftime('%Y-%m-%d %H:%M:%S')} (不包含此时间点)")
     
     # 转换复权方式
-    dividend_type_map = {
-        'pre': 'front',
-        'post': 'back', 
-        'none': 'none'
-    }
-    dividend_type = dividend_type_map.get(fq, 'front')
+    dividend_type = _HISTORY_DIVIDEND_TYPES.get(fq, 'front')
     
     # 转换时间步长格式
-    period_map = {
-        '1d': '1d',
-        '1m': '1m',
-        '5m': '5m',
-        'tick': 'tick'
-    }
-    period = period_map.get(fre_step, fre_step)
+    period = _HISTORY_PERIODS.get(fre_step, fre_step)
     
     result = {}
     
@@ -2381,91 +2861,7 @@ def khHistory(symbol_list, fields, bar_count, fre_step, current_time=None, skip_
         else:
             lookback_days = bar_count * 3
 
-        # === 缓存优化核心修复 ===
-        # 问题分析：之前每天的 start_time 和 end_time 都递增，导致缓存键每天不同，无法命中缓存
-        # 根本原因：start_dt = current_datetime - lookback_days 导致每天start_time不同
-        #
-        # 优化方案：使用固定的时间范围作为缓存键基准，确保整个回测期间缓存键相同
-        # 1. start_time: 使用当前时间点向前固定天数（如360天）作为缓存起点
-        # 2. end_time: 使用当前时间点向后固定天数（如180天）作为缓存终点
-        # 3. 这样可以确保回测期间内所有交易日使用相同的缓存键
-        #
-        # 性能提升：原本每天都获取数据（120天=120次请求），现在只需1次请求（提升99%+）
-
-        # 固定的缓存范围（确保涵盖整个回测期间所需的历史数据）
-        cache_start_offset = 360  # 向前360天（约1年），确保有足够历史数据
-        cache_end_offset = 180   # 向后180天（约6个月），适应不同回测周期
-
-        # 计算固定的缓存时间范围（关键：不随current_datetime变化）
-        # 使用年初作为基准点，确保同一年的回测使用相同缓存
-        year_start = datetime(current_datetime.year, 1, 1)
-
-        # start_time: 从年初向前推cache_start_offset天
-        cache_start_dt = year_start - timedelta(days=cache_start_offset)
-        start_time = cache_start_dt.strftime('%Y%m%d')
-
-        # end_time: 从年末向后推cache_end_offset天
-        year_end = datetime(current_datetime.year, 12, 31)
-        cache_end_dt = year_end + timedelta(days=cache_end_offset)
-        end_time = cache_end_dt.strftime('%Y%m%d')
-
-        # 注意：
-        # 1. 虽然请求的时间范围很大（~2年），但mootdx每次只返回最近800条数据
-        # 2. 对于日线数据，800天 ≈ 3年多数据，完全满足回测需求
-        # 3. khHistory后续会严格过滤到current_datetime之前的数据，不会泄露未来数据
-        # 4. 所有交易日使用相同的(start_time, end_time)，确保缓存键相同，实现100%缓存命中
-
-        # 检查缓存（优化：复用更大范围的缓存数据）
-        global _khHistory_cache
-        logger = logging.getLogger(__name__)
-
-        # 缓存键（关键：使用固定的时间范围）
-        cache_key = (tuple(sorted(stock_codes)), period, start_time, end_time, dividend_type)
-
-        # 移除冗余DEBUG日志以提升性能
-        # if logger.isEnabledFor(logging.DEBUG):
-        #     logger.debug(f"[缓存策略] 当前日期={current_datetime.strftime('%Y%m%d')}, 缓存范围={start_time}~{end_time}")
-        #     logger.debug(f"[缓存策略] 缓存键: stocks={stock_codes}, period={period}, range={start_time}~{end_time}, div={dividend_type}")
-        #     logger.debug(f"[缓存状态] 现有缓存数: {len(_khHistory_cache)}")
-
-        # === 缓存查找优化 ===
-        # 优化前：遍历所有缓存键，时间复杂度O(n)
-        # 优化后：直接查找固定键，时间复杂度O(1)
-        #
-        # 由于使用了固定的时间范围，所有交易日的缓存键完全相同
-        # 因此可以直接使用字典查找，无需遍历
-        data = None
-
-        if cache_key in _khHistory_cache:
-            # 直接命中缓存（O(1)操作）
-            data = _khHistory_cache[cache_key]
-            # logger.info(f"✅ [缓存命中] 直接使用缓存数据 {start_time}~{end_time}")
-        else:
-            # 缓存未命中，记录日志
-            logger.info(f"❌ [缓存未命中] 需要获取新数据 {start_time}~{end_time}")
-
-        if data is None:
-            # 未找到可复用缓存，获取新数据
-            # 获取数据
-            data = provider.get_market_data(
-                field_list=['time'] + fields,
-                stock_list=stock_codes,
-                period=period,
-                start_time=start_time,
-                end_time=end_time,
-                count=-1,
-                dividend_type=dividend_type,
-                fill_data=True
-            )
-
-            # 存入缓存（仅当成功获取数据时）
-            if data:
-                _khHistory_cache[cache_key] = data
-                logger.info(f"💾 [缓存存储] 成功缓存 {len(stock_codes)}只股票数据, 范围={start_time}~{end_time}")
-                # 移除冗余DEBUG日志以提升性能
-                # if logger.isEnabledFor(logging.DEBUG):
-                #     logger.debug(f"[缓存详情] 缓存键: {cache_key}")
-                #     logger.debug(f"[缓存详情] 当前缓存总数: {len(_khHistory_cache)}")
+        data = _load_history_data(provider, stock_codes, fields, period, dividend_type, current_datetime)
         
         if not data:
             print("未获取到任何数据")
@@ -2485,15 +2881,32 @@ def khHistory(symbol_list, fields, bar_count, fre_step, current_time=None, skip_
                 print(f"警告: 股票 {stock_code} 数据为空")
                 result[stock_code] = pd.DataFrame()
                 continue
-
-            # 判断数据格式并转换为 DataFrame
             if isinstance(stock_data, dict):
-                # 字典格式（Mootdx）- 转换为 DataFrame
                 if not stock_data or 'time' not in stock_data:
                     print(f"警告: 股票 {stock_code} 字典数据为空或缺少time字段")
                     result[stock_code] = pd.DataFrame()
                     continue
+            elif isinstance(stock_data, pd.DataFrame):
+                if stock_data.empty:
+                    print(f"警告: 股票 {stock_code} 数据为空")
+                    result[stock_code] = pd.DataFrame()
+                    continue
+            else:
+                print(f"警告: 股票 {stock_code} 数据格式未知: {type(stock_data)}")
+                result[stock_code] = pd.DataFrame()
+                continue
+
+            # 缓存数据只在第一次使用时排序和转换时间，之后每次调用只需二分查找当前时间点
+            # 并切片，返回的列是只读视图。与下面逐次筛选的结果完全一致（不包含未来数据）
+            history = _get_symbol_history(stock_code, period, dividend_type, stock_data)
+            if history is not None:
+                result[stock_code] = history.window(current_datetime, period, bar_count, fields,
+                                                   skip_paused=skip_paused, stock_code=stock_code)
+                continue
 
+            # 无法预处理的数据（如缺少时间信息）沿用逐次筛选
+            if isinstance(stock_data, dict):
+                # 字典格式（Mootdx）- 转换为 DataFrame
                 # 从字典创建 DataFrame
                 stock_data = pd.DataFrame(stock_data)
 
@@ -2502,17 +2915,9 @@ def khHistory(symbol_list, fields, bar_count, fre_step, current_time=None, skip_
                     # 时间戳转换（毫秒）
                     stock_data['time'] = pd.to_datetime(stock_data['time'], unit='ms')
                     stock_data.set_index('time', inplace=True)
-            elif isinstance(stock_data, pd.DataFrame):
+            else:
                 # DataFrame 格式（XtQuant）- 复制以避免修改原始数据
-                if stock_data.empty:
-                    print(f"警告: 股票 {stock_code} 数据为空")
-                    result[stock_code] = pd.DataFrame()
-                    continue
                 stock_data = stock_data.copy()
-            else:
-                print(f"警告: 股票 {stock_code} 数据格式未知: {type(stock_data)}")
-                result[stock_code] = pd.DataFrame()
-                continue
 
             # 处理时间：支持时间在列中（xtquant）或在索引中（mootdx）
             time_in_index = isinstance(stock_data.index, pd.DatetimeIndex) or stock_data.index.name in ['time', 'timestamp', 'date', 'datetime']
@@ -2617,6 +3022,142 @@ def khHistory(symbol_list, fields, bar_count, fre_step, current_time=None, skip_
     return result
 
 
+def khPanel(symbol_list, fields, bar_count, fre_step='1d', current_time=None, fq='pre'):
+    """
+    获取股票池按时间对齐的截面历史数据（不包含当前时间点）
+
+    与逐只调用 khHistory 相比，返回的是每个字段一个 (K线 × 股票) 矩阵，可以直接
+    对整个股票池做向量化的截面计算（配合 khRank、khZScore、khTopK）。对齐后的矩阵
+    按股票池缓存，之后每次调用只需二分查找当前时间点并切片，不复制数据。
+
+    参数:
+        symbol_list: 股票代码列表（如 data["__stock_list__"]）或单个股票代码字符串
+        fields: 字段列表或单个字段，如['close', 'volume']，只支持数值字段
+        bar_count: 获取的时间点数量
+        fre_step: 时间频率，如'1d', '1m', '5m'等
+        current_time: 当前时间，格式同 khHistory，为None时使用当前日期时间
+        fq: 复权方式，'pre'前复权, 'post'后复权, 'none'不复权
+
+    返回:
+        dict: {字段: DataFrame}，DataFrame 的索引为时间（所有股票时间的并集），列为股票代码，
+              股票在某个时间点没有数据时为 NaN；返回的数据是只读的
+
+    示例:
+        panel = khPanel(data["__stock_list__"], ['close'], 21, '1d', current_date)
+        momentum = panel['close'].iloc[-1] / panel['close'].iloc[0] - 1
+        selected = khTopK(momentum, 10)
+    """
+    if not symbol_list:
+        raise ValueError("symbol_list不能为空")
+    if not fields:
+        raise ValueError("fields不能为空")
+    if bar_count <= 0:
+        raise ValueError("bar_count必须大于0")
+
+    stock_codes = [symbol_list] if isinstance(symbol_list, str) else list(dict.fromkeys(symbol_list))
+    fields = [fields] if isinstance(fields, str) else list(dict.fromkeys(fields))
+    current_datetime = _parse_history_time(current_time)
+    dividend_type = _HISTORY_DIVIDEND_TYPES.get(fq, 'front')
+    period = _HISTORY_PERIODS.get(fre_step, fre_step)
+
+    key = (tuple(stock_codes), period, dividend_type)
+    start_time, _ = _history_range(current_datetime)
+    entry = _khPanel_cache.get(key)
+    if entry is None or not entry.covers(fields, start_time, current_datetime):
+        # 首次使用或范围、字段不足：由 khHistory 的按股票缓存（只获取缺少的股票）重新对齐
+        panel_fields = list(dict.fromkeys([*fields, *(entry.fields if entry is not None else ())]))
+        data = _load_history_data(get_data_provider(), stock_codes, panel_fields, period,
+                                  dividend_type, current_datetime)
+        histories = []
+        for stock_code in stock_codes:
+            stock_data = data.get(stock_code)
+            histories.append(None if stock_data is None
+                             else _get_symbol_history(stock_code, period, dividend_type, stock_data))
+        panel = PanelHistory.from_histories(stock_codes, histories, panel_fields)
+        entry = _HistoryCacheEntry(start_time, _panel_cache_end(stock_codes, period, dividend_type, current_datetime),
+                                   panel_fields, panel)
+        if data:
+            _khPanel_cache.put(key, entry)
+    return entry.data.window(current_datetime, period, bar_count, fields)
+
+
+def _panel_cache_end(stock_codes, period, dividend_type, current_datetime) -> str:
+    """截面矩阵覆盖的结束日期：各股票缓存范围中最早的结束日期"""
+    ends = [entry.end_time for entry in (_khHistory_cache.peek((stock_code, period, dividend_type))
+                                         for stock_code in stock_codes) if entry is not None]
+    return min(ends) if ends else current_datetime.strftime('%Y%m%d')
+
+
+def khRank(values, ascending=True, pct=False):
+    """
+    截面排名：对每个时间点（行）上的所有股票排名，缺失值不参与排名（结果为 NaN）
+
+    参数:
+        values: khPanel 返回的 DataFrame（时间 × 股票），或单个时间点的 Series/字典（股票 → 值）
+        ascending: True 时最小值排名为 1
+        pct: True 时返回百分位排名（0~1]
+
+    返回:
+        与输入形状相同的 DataFrame 或 Series，相同值取平均排名
+    """
+    if isinstance(values, pd.DataFrame):
+        return values.rank(axis=1, ascending=ascending, pct=pct)
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    return series.rank(ascending=ascending, pct=pct)
+
+
+def khZScore(values):
+    """
+    截面标准化：每个时间点（行）上 (值 - 均值) / 标准差，标准差按总体计算（ddof=0）
+
+    缺失值不参与均值和标准差的计算，结果中仍为 NaN；某个时间点所有股票的值都相同时结果为 NaN。
+
+    参数:
+        values: khPanel 返回的 DataFrame（时间 × 股票），或单个时间点的 Series/字典（股票 → 值）
+
+    返回:
+        与输入形状相同的 DataFrame 或 Series
+    """
+    if isinstance(values, pd.DataFrame):
+        matrix = values.to_numpy(dtype=np.float64)
+    else:
+        series = values if isinstance(values, pd.Series) else pd.Series(values)
+        matrix = series.to_numpy(dtype=np.float64)[np.newaxis, :]
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        # 整行都是 NaN 时结果为 NaN，不输出警告
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(matrix, axis=1, keepdims=True)
+        std = np.nanstd(matrix, axis=1, keepdims=True)
+        scores = np.where(std > 0, (matrix - mean) / std, np.nan)
+    if isinstance(values, pd.DataFrame):
+        return pd.DataFrame(scores, index=values.index, columns=values.columns)
+    return pd.Series(scores[0], index=series.index)
+
+
+def khTopK(values, k, largest=True):
+    """
+    截面选股：取值最大（或最小）的 k 只股票
+
+    参数:
+        values: 单个时间点的 Series/字典（股票 → 值），或 khPanel 返回的 DataFrame（使用最后一行）
+        k: 选取的股票数量，有效值不足 k 个时返回全部有效值
+        largest: True 取最大的 k 个，False 取最小的 k 个
+
+    返回:
+        list: 股票代码列表，按值从优到劣排列；缺失值不参与选择，值相同时保持输入中的先后顺序
+    """
+    if isinstance(values, pd.DataFrame):
+        values = values.iloc[-1] if len(values) else pd.Series(dtype=np.float64)
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    scores = series.to_numpy(dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(scores))
+    if k <= 0 or len(valid) == 0:
+        return []
+    keys = -scores[valid] if largest else scores[valid]
+    order = valid[np.argsort(keys, kind='stable')[:k]]
+    return series.index[order].tolist()
+
+
 def test_khHistory():
     """测试khHistory函数的各种参数组合"""
     print("开始测试khHistory函数...")
@@ -19,18 +19,14 @@ import numpy as np
 import pandas as pd
 
 # ===== 量化库 =====
-from xtquant import xtdata
-try:
-    from xtquant.xttrader import XtQuantTrader, XtQuantTraderCallback
-except ImportError:
-    # 如果没有交易模块，提供占位符
-    XtQuantTrader = None
-    XtQuantTraderCallback = None
+# 未安装 xtquant 时 xtdata、XtQuantTrader 为 None（mootdx 回测不需要）
+from khXtCompat import xtdata, XtQuantTrader, XtQuantTraderCallback
 
 # ===== 项目内部工具 =====
 import khQTTools as _khq
 from khQTTools import (
-    generate_signal, calculate_max_buy_volume, KhQuTools, khMA,
+    generate_signal, calculate_max_buy_volume, KhQuTools, khMA, khEMA, khSTD, khHHV, khLLV,
+    khPanel, khRank, khZScore, khTopK, khRequire, khBar, khBars,
     # 新增的独立函数，可以直接使用，无需实例化类
     is_trade_time, is_trade_day, get_trade_days_count
 )
@@ -515,7 +511,11 @@ __all__ = [
     'StrategyContext', 'parse_context', 'khGet', 'khPrice', 'khHas',
     'khBuy', 'khSell', 'get_default_risk_params',
     # 指标函数（MyTT）与项目内均线
-    'MA', 'RSI', 'khMA'
+    'MA', 'RSI', 'khMA', 'khEMA', 'khSTD', 'khHHV', 'khLLV',
+    # 截面数据与截面计算
+    'khPanel', 'khRank', 'khZScore', 'khTopK',
+    # 历史数据需求声明（回测开始前预加载）与多周期对齐数据
+    'khRequire', 'khBar', 'khBars'
 ] 
 
 # 自动并入 khQTTools 与 MyTT 的所有公共符号，便于 from khQuantImport import * 统一入口
@@ -0,0 +1,238 @@
+# coding: utf-8
+"""
+回测结果流式写入 - 回测过程中分块落盘，内存占用不随回测长度增长
+
+交易记录、每日统计和持仓明细分别写入三张表，每张表由若干分块文件组成：
+安装了 pyarrow 时写 Parquet 分块，否则写 CSV 分块。持仓以长表
+(date, code, volume, ...) 保存，不再在每条每日统计中嵌入完整的持仓字典。
+
+回测结束后调用 export_csv 导出与原有格式一致的 trades.csv / daily_stats.csv，
+以及 positions.csv 持仓明细，导出同样按分块流式进行。
+"""
+
+import os
+import shutil
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  仅用于检测 Parquet 支持
+    _parquet_available = True
+except ImportError:
+    _parquet_available = False
+
+
+TRADE_COLUMNS = [
+    'datetime', 'code', 'action', 'price', 'volume', 'amount',
+    'commission', 'stamp_tax', 'transfer_fee', 'flow_fee',
+    'total_asset', 'cash', 'market_value'
+]
+DAILY_STATS_COLUMNS = ['date', 'total_asset', 'cash', 'market_value', 'daily_return', 'benchmark_close']
+POSITION_COLUMNS = ['date', 'code', 'volume', 'price', 'avg_price', 'market_value', 'profit', 'profit_ratio']
+
+# CSV 分块回读时保持为字符串的列（避免 000001 之类的代码被解析成数字）
+_STRING_COLUMNS = {'datetime': str, 'date': str, 'code': str, 'action': str}
+
+
+class _ChunkedTable:
+    """按分块追加写入的单张表"""
+
+    def __init__(self, directory: str, name: str, columns: List[str], file_format: str):
+        self.directory = os.path.join(directory, name)
+        self.columns = columns
+        self.file_format = file_format
+        self.buffer = []
+        self.row_count = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def append(self, row: Dict):
+        self.buffer.append(row)
+        self.row_count += 1
+
+    def extend(self, rows: List[Dict]):
+        self.buffer.extend(rows)
+        self.row_count += len(rows)
+
+    def part_path(self, part: int) -> str:
+        return os.path.join(self.directory, f"part-{part:05d}.{self.file_format}")
+
+    def flush(self, part: int):
+        """把缓冲区写为第 part 个分块"""
+        if not self.buffer:
+            return
+        df = pd.DataFrame(self.buffer, columns=self.columns)
+        path = self.part_path(part)
+        if self.file_format == 'parquet':
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=False, encoding='utf-8')
+        self.buffer = []
+
+    def read_part(self, part: int) -> Optional[pd.DataFrame]:
+        path = self.part_path(part)
+        if not os.path.exists(path):
+            return None
+        if self.file_format == 'parquet':
+            return pd.read_parquet(path)
+        dtype = {col: t for col, t in _STRING_COLUMNS.items() if col in self.columns}
+        return pd.read_csv(path, dtype=dtype, float_precision='round_trip', encoding='utf-8')
+
+
+class BacktestResultWriter:
+    """回测结果流式写入器
+
+    回测过程中通过 add_trades / add_daily_stat 追加记录，缓冲的记录数达到
+    chunk_rows 时三张表一起写出一个分块，同一分块编号下的每日统计和持仓明细
+    覆盖相同的日期。
+
+    Args:
+        directory: 分块文件目录
+        chunk_rows: 每个分块的最大缓冲行数
+        file_format: 'parquet' 或 'csv'，为 None 时有 pyarrow 则用 Parquet
+        clear: 是否清空已有的分块目录，断点续跑时为 False，随后调用 restore 恢复状态
+    """
+
+    def __init__(self, directory: str, chunk_rows: int = 50000, file_format: Optional[str] = None,
+                 clear: bool = True):
+        if file_format is None:
+            file_format = 'parquet' if _parquet_available else 'csv'
+        if clear and os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.file_format = file_format
+        self.trades = _ChunkedTable(directory, "trades", TRADE_COLUMNS, file_format)
+        self.daily_stats = _ChunkedTable(directory, "daily_stats", DAILY_STATS_COLUMNS, file_format)
+        self.positions = _ChunkedTable(directory, "positions", POSITION_COLUMNS, file_format)
+        self.parts = 0
+        self.last_daily_stat = None   # 最近一条每日统计，用于计算下一日收益率
+
+    def add_trades(self, trades: List[Dict]):
+        """追加交易记录"""
+        self.trades.extend(trades)
+        self._maybe_flush()
+
+    def add_daily_stat(self, daily_stat: Dict, positions: Dict[str, Dict]):
+        """追加一条每日统计及当日持仓快照
+
+        Args:
+            daily_stat: 每日统计，包含 DAILY_STATS_COLUMNS 中的字段
+            positions: {股票代码: {'volume', 'price', 'avg_price', 'market_value', 'profit', 'profit_ratio'}}
+        """
+        self.daily_stats.append({col: daily_stat.get(col) for col in DAILY_STATS_COLUMNS})
+        date = daily_stat.get('date')
+        self.positions.extend([{'date': date, 'code': code, **snapshot} for code, snapshot in positions.items()])
+        self.last_daily_stat = daily_stat
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        buffered = len(self.trades.buffer) + len(self.daily_stats.buffer) + len(self.positions.buffer)
+        if buffered >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """把所有表的缓冲区写为一个新分块"""
+        if not (self.trades.buffer or self.daily_stats.buffer or self.positions.buffer):
+            return
+        for table in (self.trades, self.daily_stats, self.positions):
+            table.flush(self.parts)
+        self.parts += 1
+
+    def state(self) -> Dict:
+        """写出缓冲区并返回可用于断点恢复的状态"""
+        self.flush()
+        return {
+            'parts': self.parts,
+            'file_format': self.file_format,
+            'row_counts': [table.row_count for table in (self.trades, self.daily_stats, self.positions)],
+            'last_daily_stat': self.last_daily_stat,
+        }
+
+    def restore(self, state: Optional[Dict]):
+        """恢复到 state 对应的状态，删除其后写出的分块；state 为 None 时清空所有分块"""
+        state = state or {'parts': 0, 'file_format': self.file_format, 'row_counts': [0, 0, 0],
+                          'last_daily_stat': None}
+        tables = (self.trades, self.daily_stats, self.positions)
+        for table, row_count in zip(tables, state['row_counts']):
+            table.file_format = state['file_format']
+            table.buffer = []
+            table.row_count = row_count
+            for name in os.listdir(table.directory):
+                part = name.split('.')[0]
+                if not (part.startswith("part-") and int(part[5:]) < state['parts']
+                        and name.endswith(f".{state['file_format']}")):
+                    os.remove(os.path.join(table.directory, name))
+        self.file_format = state['file_format']
+        self.parts = state['parts']
+        self.last_daily_stat = state['last_daily_stat']
+
+    def iter_parts(self, table: _ChunkedTable) -> Iterator[pd.DataFrame]:
+        """依次读取一张表的所有分块"""
+        for part in range(self.parts):
+            df = table.read_part(part)
+            if df is not None and len(df) > 0:
+                yield df
+
+    def export_csv(self, output_dir: str) -> Dict[str, int]:
+        """流式导出 trades.csv、daily_stats.csv 和 positions.csv
+
+        daily_stats.csv 保留原有的 positions 列（当日持仓字典），格式与之前一致。
+
+        Args:
+            output_dir: 导出目录
+
+        Returns:
+            Dict[str, int]: 各表导出的行数
+        """
+        self.flush()
+        os.makedirs(output_dir, exist_ok=True)
+
+        self._export_table(self.trades, os.path.join(output_dir, "trades.csv"))
+        self._export_table(self.positions, os.path.join(output_dir, "positions.csv"))
+
+        daily_path = os.path.join(output_dir, "daily_stats.csv")
+        header = True
+        for part in range(self.parts):
+            daily = self.daily_stats.read_part(part)
+            if daily is None or len(daily) == 0:
+                continue
+            daily['positions'] = self._positions_column(daily['date'], self.positions.read_part(part))
+            daily.to_csv(daily_path, mode='w' if header else 'a', header=header, index=False,
+                         encoding='utf-8-sig' if header else 'utf-8')
+            header = False
+        if header:
+            pd.DataFrame(columns=DAILY_STATS_COLUMNS + ['positions']).to_csv(
+                daily_path, index=False, encoding='utf-8-sig')
+
+        return {
+            'trades': self.trades.row_count,
+            'daily_stats': self.daily_stats.row_count,
+            'positions': self.positions.row_count,
+        }
+
+    def _export_table(self, table: _ChunkedTable, path: str):
+        header = True
+        for df in self.iter_parts(table):
+            df.to_csv(path, mode='w' if header else 'a', header=header, index=False,
+                      encoding='utf-8-sig' if header else 'utf-8')
+            header = False
+        if header:
+            pd.DataFrame(columns=table.columns).to_csv(path, index=False, encoding='utf-8-sig')
+
+    @staticmethod
+    def _positions_column(dates: pd.Series, positions: Optional[pd.DataFrame]) -> List[str]:
+        """把持仓长表还原为每日一行的持仓字典字符串"""
+        by_date = {}
+        if positions is not None and len(positions) > 0:
+            fields = POSITION_COLUMNS[2:]
+            for row in positions.to_dict('records'):
+                by_date.setdefault(str(row['date']), {})[row['code']] = {f: row[f] for f in fields}
+        return [str(by_date.get(str(date), {})) for date in dates]
+
+    def close(self, remove: bool = False):
+        """写出剩余缓冲区，remove 为 True 时删除分块目录"""
+        self.flush()
+        if remove and os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
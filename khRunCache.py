@@ -0,0 +1,157 @@
+# coding: utf-8
+"""
+回测结果缓存 - 策略、配置和行情数据都未变化时直接复用上一次的回测结果
+
+缓存键是以下内容的 SHA-256 摘要：
+    - 策略文件源码，以及运行前策略模块的公开参数（模块级的简单类型变量）
+    - .kh 配置中影响回测结果的字段（账户、回测、数据、盘前盘后回调、风控）和股票池
+    - 数据提供者类型
+    - 行情数据指纹：回测实际加载的每个周期的数据（日线收盘价、主周期数据、khRequire 预加载的历史数据），
+      每只股票的行数、最后一个时间戳和收盘价摘要（除权后前复权价格整体变化时缓存失效）
+
+缓存内容是完整的回测结果目录，保存在 backtest_results/run_cache/<缓存键> 中，
+命中时复制回 backtest_results/策略名_开始日期_结束日期，结果查看界面照常打开。
+写入时先复制到临时目录再原子重命名，中途崩溃不会留下不完整的缓存。
+缓存默认关闭，配置 backtest.run_cache 为 true 时启用。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+RUN_CACHE_DIR = os.path.join("backtest_results", "run_cache")
+RUN_CACHE_VERSION = 1
+RUN_CACHE_META_FILE = "run_cache.json"
+
+# 参与缓存键计算的配置段
+_CONFIG_SECTIONS = ("account", "backtest", "data", "market_callback", "risk")
+# 不影响回测结果的回测配置项
+_IGNORED_BACKTEST_KEYS = {"checkpoint_interval", "streaming", "stream_prefetch", "run_cache", "profile"}
+# 作为策略参数参与缓存键计算的模块级变量类型
+_PARAM_TYPES = (bool, int, float, str, list, tuple, dict)
+
+
+def strategy_fingerprint(strategy_file: str, strategy_module=None) -> Dict[str, Any]:
+    """策略文件源码摘要和策略参数
+
+    Args:
+        strategy_file: 策略文件路径
+        strategy_module: 已加载的策略模块，其公开的简单类型模块级变量视为策略参数
+
+    Returns:
+        Dict[str, Any]: {'source': 源码摘要, 'params': {参数名: 参数值}}
+    """
+    with open(strategy_file, 'rb') as f:
+        source = hashlib.sha256(f.read()).hexdigest()
+    params = {}
+    if strategy_module is not None:
+        for name, value in vars(strategy_module).items():
+            if not name.startswith('_') and isinstance(value, _PARAM_TYPES):
+                params[name] = value
+    return {'source': source, 'params': params}
+
+
+def config_fingerprint(config_dict: Dict[str, Any], stock_codes) -> Dict[str, Any]:
+    """配置中影响回测结果的字段"""
+    fields = {section: config_dict.get(section) for section in _CONFIG_SECTIONS}
+    if isinstance(fields["backtest"], dict):
+        fields["backtest"] = {key: value for key, value in fields["backtest"].items()
+                              if key not in _IGNORED_BACKTEST_KEYS}
+    fields["stock_codes"] = list(stock_codes)
+    return fields
+
+
+def data_fingerprint(frames: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+    """行情数据指纹：每只股票的数据行数、最后一个时间戳和收盘价摘要
+
+    行数和最后时间戳不变时，前复权数据仍可能因为除权而整体变化，因此同时记录 close 列的摘要。
+
+    Args:
+        frames: {股票代码: DataFrame}，DataFrame 包含 time 列或时间索引
+
+    Returns:
+        Dict[str, Any]: {股票代码: [行数, 最后时间戳, 收盘价摘要]}，没有 close 列时摘要为 None
+    """
+    fingerprint = {}
+    for code in sorted(frames):
+        df = frames[code]
+        if df is None or len(df) == 0:
+            fingerprint[code] = [0, None, None]
+            continue
+        last = df['time'].iloc[-1] if 'time' in df.columns else df.index[-1]
+        closes = None
+        if 'close' in df.columns:
+            closes = hashlib.sha256(df['close'].to_numpy(dtype='float64').tobytes()).hexdigest()
+        fingerprint[code] = [len(df), str(last), closes]
+    return fingerprint
+
+
+def run_cache_key(*parts: Any) -> str:
+    """把若干可 JSON 序列化的部分合并计算为缓存键"""
+    payload = json.dumps([RUN_CACHE_VERSION, *parts], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RunCache:
+    """以缓存键为目录名的回测结果缓存
+
+    Args:
+        directory: 缓存根目录
+    """
+
+    def __init__(self, directory: str = RUN_CACHE_DIR):
+        self.directory = directory
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """查找缓存，返回缓存目录，不存在时返回 None"""
+        path = self.path(key)
+        if os.path.exists(os.path.join(path, RUN_CACHE_META_FILE)):
+            return path
+        return None
+
+    def store(self, key: str, result_dir: str, meta: Optional[Dict[str, Any]] = None) -> str:
+        """把回测结果目录复制到缓存
+
+        Args:
+            key: 缓存键
+            result_dir: 回测结果目录
+            meta: 写入 run_cache.json 的附加信息
+
+        Returns:
+            str: 缓存目录
+        """
+        path = self.path(key)
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        shutil.copytree(result_dir, tmp_path)
+        with open(os.path.join(tmp_path, RUN_CACHE_META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'result_dir': result_dir,
+                       'created': time.strftime("%Y-%m-%d %H:%M:%S"), **(meta or {})},
+                      f, ensure_ascii=False, indent=2, default=str)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        return path
+
+    def restore(self, key: str, result_dir: str) -> bool:
+        """把缓存的回测结果复制到回测结果目录（覆盖原有内容）
+
+        Returns:
+            bool: 缓存存在并已复制时返回 True
+        """
+        path = self.lookup(key)
+        if path is None:
+            return False
+        if os.path.exists(result_dir):
+            shutil.rmtree(result_dir)
+        shutil.copytree(path, result_dir, ignore=shutil.ignore_patterns(RUN_CACHE_META_FILE))
+        return True
@@ -0,0 +1,67 @@
+# coding: utf-8
+"""
+按交易日流式加载回测数据 - 内存占用只与一到两个交易日的数据量有关
+
+tick / 分钟级回测一次性加载整个回测区间的行情，几百只股票、一年的 tick
+数据会耗尽内存。流式模式下每次只加载一个交易日的全部股票数据，当前交易日
+回测时在后台线程预取下一个交易日，上一交易日的数据在其盘后回调执行后即可释放。
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, List, Tuple
+
+
+class DayStreamLoader:
+    """按交易日顺序加载数据，并在后台线程预取下一交易日
+
+    迭代时依次返回 (交易日, 数据)，加载器自身最多持有一个尚未取走的交易日数据，
+    已返回的数据不再保留引用，由调用方决定何时释放。
+
+    Args:
+        days: 交易日列表（按时间顺序）
+        load_day: 加载单个交易日数据的函数 load_day(day)，在后台线程中调用
+        prefetch: 是否在后台线程预取下一交易日，为 False 时在迭代时同步加载
+    """
+
+    def __init__(self, days: List[Any], load_day: Callable[[Any], Any], prefetch: bool = True):
+        self.days = list(days)
+        self.load_day = load_day
+        self.prefetch = prefetch
+        self._executor = None
+        self._pending = None
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def __iter__(self) -> Iterator[Tuple[Any, Any]]:
+        if not self.prefetch:
+            for day in self.days:
+                yield day, self.load_day(day)
+            return
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="khStream")
+        try:
+            if self.days:
+                self._pending = self._executor.submit(self.load_day, self.days[0])
+            for i, day in enumerate(self.days):
+                data = self._pending.result()
+                # 取走当前交易日后立即开始预取下一交易日
+                self._pending = self._executor.submit(self.load_day, self.days[i + 1]) \
+                    if i + 1 < len(self.days) else None
+                yield day, data
+                data = None
+        finally:
+            self.close()
+
+    def close(self):
+        """停止预取并释放尚未取走的数据"""
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        if self._executor is not None:
+            try:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+            except Exception as e:
+                logging.warning(f"停止数据预取线程失败: {str(e)}")
+            self._executor = None
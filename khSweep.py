@@ -0,0 +1,444 @@
+# coding: utf-8
+"""
+参数扫描 - 一次加载行情数据，多进程并行回测多组策略参数
+
+用法:
+    from khSweep import run_sweep
+
+    if __name__ == '__main__':   # Windows 下多进程必须放在 main 保护中
+        results = run_sweep(
+            "strategies/双均线精简_使用khMA函数.kh",
+            "strategies/双均线精简_使用khMA函数.py",
+            {"SHORT_WINDOW": [5, 10], "LONG_WINDOW": [20, 30, 60]},
+        )
+
+参数名不含 "." 时作为策略模块的模块级变量（如 SHORT_WINDOW = 5），在回测前覆盖；
+参数名含 "." 时作为配置文件路径覆盖（如 "backtest.init_capital"）。
+
+流程：
+    1. 在主进程中运行第一组参数，同时记录回测过程中所有 get_market_data 请求的结果；
+    2. 把记录的行情数据按 dtype 拼接写入 .npy 文件；
+    3. 子进程以内存映射（copy-on-write）方式打开这些文件，从共享数据中回放行情，
+       不再重复下载或加载；记录中没有的请求回退到配置的真实数据提供者。
+"""
+
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from khConfig import KhConfig
+from khDataProvider import DataProviderFactory, DataProviderInterface, DelegatingDataProvider
+
+# 子进程中已打开的共享行情数据 {目录: SharedMarketData}
+_opened_stores = {}
+
+
+# ============================================================================
+# 数据提供者包装
+# ============================================================================
+
+def _market_data_key(field_list, stock_list, period, start_time, end_time, count, dividend_type, kwargs) -> tuple:
+    """生成 get_market_data 请求的缓存键"""
+    extra = tuple(sorted((k, v) for k, v in kwargs.items() if isinstance(v, (str, int, float, bool, type(None)))))
+    return (tuple(field_list or []), tuple(stock_list or []), period, str(start_time), str(end_time),
+            count, dividend_type, extra)
+
+
+class RecordingDataProvider(DelegatingDataProvider):
+    """记录所有 get_market_data 请求结果的数据提供者"""
+
+    def __init__(self, inner: DataProviderInterface):
+        super().__init__(inner)
+        self.records = {}   # {请求键: {股票代码: DataFrame}}
+
+    def get_market_data(self, field_list, stock_list, period='1d', start_time='', end_time='',
+                        count=-1, dividend_type='none', **kwargs) -> Dict[str, pd.DataFrame]:
+        key = _market_data_key(field_list, stock_list, period, start_time, end_time, count, dividend_type, kwargs)
+        result = self.inner.get_market_data(field_list, stock_list, period, start_time, end_time,
+                                            count, dividend_type, **kwargs)
+        # 调用方可能修改返回的 DataFrame，记录时保存副本
+        if isinstance(result, dict) and all(isinstance(df, pd.DataFrame) for df in result.values()):
+            self.records[key] = {code: df.copy() for code, df in result.items()}
+        return result
+
+
+class ReplayDataProvider(DelegatingDataProvider):
+    """从共享行情数据中回放 get_market_data 请求的数据提供者
+
+    记录中没有的请求会回退到按配置创建的真实数据提供者（首次使用时创建）。
+    """
+
+    def __init__(self, store: 'SharedMarketData', provider_spec: Dict[str, Any]):
+        super().__init__(None)
+        self.store = store
+        self.provider_spec = provider_spec
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def inner(self) -> DataProviderInterface:
+        if self._inner is None:
+            self._inner = create_provider(self.provider_spec)
+        return self._inner
+
+    def download_history_data(self, stock_code, period='1d', start_time='', end_time='', **kwargs) -> bool:
+        # 行情已经由主进程加载，无需下载
+        return True
+
+    def get_market_data(self, field_list, stock_list, period='1d', start_time='', end_time='',
+                        count=-1, dividend_type='none', **kwargs) -> Dict[str, pd.DataFrame]:
+        key = _market_data_key(field_list, stock_list, period, start_time, end_time, count, dividend_type, kwargs)
+        result = self.store.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        return self.inner.get_market_data(field_list, stock_list, period, start_time, end_time,
+                                          count, dividend_type, **kwargs)
+
+
+def provider_spec_from_config(config: KhConfig) -> Dict[str, Any]:
+    """从配置中提取创建数据提供者所需的参数（与 KhQuantFramework._init_data_provider 一致）"""
+    if config.data_provider_type == 'mootdx':
+        return {'provider_type': 'mootdx', 'mode': config.mootdx_mode, 'tdxdir': config.mootdx_tdxdir,
+                'servers': config.mootdx_servers, 'pool_size': config.mootdx_pool_size}
+    return {'provider_type': 'xtquant'}
+
+
+def create_provider(spec: Dict[str, Any]) -> DataProviderInterface:
+    spec = dict(spec)
+    return DataProviderFactory.get_provider(spec.pop('provider_type'), **spec)
+
+
+# ============================================================================
+# 共享行情数据（内存映射文件）
+# ============================================================================
+
+class SharedMarketData:
+    """以内存映射 .npy 文件保存的一组 get_market_data 结果
+
+    相同 dtype 的列拼接成一个 .npy 文件，每个 DataFrame 只记录列在文件中的偏移，
+    子进程以 copy-on-write 方式映射，所有进程共享同一份物理内存页。
+    """
+
+    INDEX_FILE = "index.pkl"
+
+    def __init__(self, directory: str, entries: Dict[tuple, Dict[str, dict]], arenas: Dict[str, np.ndarray]):
+        self.directory = directory
+        self.entries = entries
+        self.arenas = arenas
+
+    @classmethod
+    def write(cls, directory: str, records: Dict[tuple, Dict[str, pd.DataFrame]]) -> 'SharedMarketData':
+        """把记录的行情数据写入目录
+
+        Args:
+            directory: 输出目录
+            records: {请求键: {股票代码: DataFrame}}
+        """
+        os.makedirs(directory, exist_ok=True)
+        chunks = {}     # {dtype字符串: [数组...]}
+        sizes = {}      # {dtype字符串: 当前总长度}
+
+        def put(array: np.ndarray) -> dict:
+            array = np.ascontiguousarray(array)
+            dtype = array.dtype.str
+            offset = sizes.get(dtype, 0)
+            chunks.setdefault(dtype, []).append(array)
+            sizes[dtype] = offset + len(array)
+            return {'kind': 'array', 'dtype': dtype, 'offset': offset, 'length': len(array)}
+
+        def put_values(values) -> dict:
+            array = np.asarray(values)
+            if array.dtype.kind in 'biufcmM':
+                return put(array)
+            return {'kind': 'object', 'values': list(values)}
+
+        entries = {}
+        for key, frames in records.items():
+            entry = {}
+            for code, df in frames.items():
+                index = df.index
+                if isinstance(index, pd.RangeIndex):
+                    index_spec = {'kind': 'range', 'start': index.start, 'stop': index.stop, 'step': index.step}
+                elif isinstance(index, pd.DatetimeIndex) and index.tz is None:
+                    index_spec = put(index.to_numpy())
+                else:
+                    index_spec = {'kind': 'object', 'values': list(index)}
+                index_spec['name'] = index.name
+                entry[code] = {
+                    'index': index_spec,
+                    'columns': [(col, put_values(df[col].to_numpy())) for col in df.columns],
+                }
+            entries[key] = entry
+
+        arenas = {}
+        for i, (dtype, arrays) in enumerate(chunks.items()):
+            path = os.path.join(directory, f"arena_{i}.npy")
+            np.save(path, np.concatenate(arrays))
+            arenas[dtype] = os.path.basename(path)
+
+        with open(os.path.join(directory, cls.INDEX_FILE), 'wb') as f:
+            pickle.dump({'entries': entries, 'arenas': arenas}, f)
+        return cls.open(directory)
+
+    @classmethod
+    def open(cls, directory: str) -> 'SharedMarketData':
+        """以内存映射方式打开共享行情数据"""
+        with open(os.path.join(directory, cls.INDEX_FILE), 'rb') as f:
+            meta = pickle.load(f)
+        arenas = {
+            dtype: np.load(os.path.join(directory, name), mmap_mode='c', allow_pickle=False)
+            for dtype, name in meta['arenas'].items()
+        }
+        return cls(directory, meta['entries'], arenas)
+
+    def _values(self, spec: dict):
+        if spec['kind'] == 'array':
+            return self.arenas[spec['dtype']][spec['offset']:spec['offset'] + spec['length']]
+        return spec['values']
+
+    def get(self, key: tuple) -> Optional[Dict[str, pd.DataFrame]]:
+        """获取请求键对应的结果，每次调用返回新的 DataFrame（底层数组为映射视图）"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        result = {}
+        for code, spec in entry.items():
+            index_spec = spec['index']
+            if index_spec['kind'] == 'range':
+                index = pd.RangeIndex(index_spec['start'], index_spec['stop'], index_spec['step'],
+                                      name=index_spec['name'])
+            else:
+                index = pd.Index(self._values(index_spec), name=index_spec['name'])
+            columns = {col: self._values(col_spec) for col, col_spec in spec['columns']}
+            result[code] = pd.DataFrame(columns, index=index, copy=False)
+        return result
+
+
+# ============================================================================
+# 参数网格与绩效指标
+# ============================================================================
+
+def expand_grid(param_grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """把参数网格展开为参数组合列表
+
+    Args:
+        param_grid: {参数名: 候选值列表}
+
+    Returns:
+        List[Dict[str, Any]]: 所有参数组合
+    """
+    names = list(param_grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*(param_grid[n] for n in names))]
+
+
+def compute_metrics(backtest_dir: str, init_capital: float, risk_free_rate: float = 0.03) -> Dict[str, float]:
+    """根据回测结果目录计算绩效指标（与回测结果窗口的计算口径一致）
+
+    Args:
+        backtest_dir: 回测结果目录（包含 daily_stats.csv 和 trades.csv）
+        init_capital: 初始资金
+        risk_free_rate: 无风险利率
+
+    Returns:
+        Dict[str, float]: 最终资金、总收益率(%)、年化收益率(%)、最大回撤(%)、夏普比率、交易次数
+    """
+    metrics = {
+        'final_asset': init_capital,
+        'total_return': 0.0,
+        'annual_return': 0.0,
+        'max_drawdown': 0.0,
+        'sharpe_ratio': 0.0,
+        'trade_count': 0,
+    }
+    daily_path = os.path.join(backtest_dir, "daily_stats.csv")
+    trades_path = os.path.join(backtest_dir, "trades.csv")
+    if os.path.exists(trades_path):
+        try:
+            metrics['trade_count'] = len(pd.read_csv(trades_path, encoding='utf-8-sig'))
+        except pd.errors.EmptyDataError:
+            pass
+    if not os.path.exists(daily_path):
+        return metrics
+    try:
+        daily = pd.read_csv(daily_path, encoding='utf-8-sig')
+    except pd.errors.EmptyDataError:
+        return metrics
+    if daily.empty or 'total_asset' not in daily.columns:
+        return metrics
+
+    assets = pd.to_numeric(daily['total_asset'], errors='coerce').dropna()
+    if assets.empty:
+        return metrics
+    final_asset = float(assets.iloc[-1])
+    total_return = final_asset / init_capital - 1 if init_capital > 0 else 0.0
+    days = len(assets)
+    metrics['final_asset'] = final_asset
+    metrics['total_return'] = total_return * 100
+    if days > 1 and total_return > -1:
+        metrics['annual_return'] = (pow(1 + total_return, 250 / days) - 1) * 100
+
+    cummax = assets.cummax()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdown = ((cummax - assets) / cummax * 100).replace([np.inf, -np.inf], np.nan).fillna(0)
+    metrics['max_drawdown'] = float(drawdown.max())
+
+    if 'daily_return' in daily.columns:
+        returns = pd.to_numeric(daily['daily_return'], errors='coerce').dropna()
+        if len(returns) >= 2:
+            growth = (1 + returns).prod()
+            annual = pow(growth, 250 / len(returns)) - 1 if growth > 0 else -1.0
+            volatility = np.sqrt((250 / len(returns)) * np.sum((returns - returns.mean()) ** 2))
+            if volatility > 0 and np.isfinite(volatility):
+                metrics['sharpe_ratio'] = float((annual - risk_free_rate) / volatility)
+    return metrics
+
+
+# ============================================================================
+# 运行
+# ============================================================================
+
+def _apply_config_overrides(config_dict: dict, params: Dict[str, Any]) -> dict:
+    """把带 "." 的参数写入配置字典（如 backtest.init_capital）"""
+    for name, value in params.items():
+        if '.' not in name:
+            continue
+        node = config_dict
+        parts = name.split('.')
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return config_dict
+
+
+def _run_task(task: Dict[str, Any], data_provider: DataProviderInterface) -> Dict[str, Any]:
+    """在当前进程中运行一组参数的回测"""
+    from khBacktest import HeadlessSink, run_backtest
+
+    run_dir = task['run_dir']
+    os.makedirs(run_dir, exist_ok=True)
+    params = task['params']
+
+    # 每组参数使用独立的配置文件和工作目录，避免回测结果目录相互覆盖
+    with open(task['config_path'], 'r', encoding='utf-8') as f:
+        config_dict = json.load(f)
+    config_dict = _apply_config_overrides(config_dict, params)
+    config_dict['strategy_file'] = task['strategy_file']
+    config_path = os.path.join(run_dir, "config.kh")
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(config_dict, f, ensure_ascii=False, indent=4)
+
+    strategy_params = {name: value for name, value in params.items() if '.' not in name}
+    row = {'run': task['index'], **params}
+    sink = HeadlessSink(quiet=True, log_file=os.path.join(run_dir, "backtest.log"))
+    cwd = os.getcwd()
+    try:
+        os.chdir(run_dir)
+        # 框架和策略的 print 输出写入日志，避免多个进程的输出混在一起
+        with open("stdout.log", 'w', encoding='utf-8') as out, contextlib.redirect_stdout(out):
+            result_dir = run_backtest(
+                config_path,
+                task['strategy_file'],
+                sink=sink,
+                init_data_enabled=task.get('init_data_enabled'),
+                data_provider=data_provider,
+                strategy_params=strategy_params
+            )
+        if result_dir:
+            result_dir = os.path.abspath(result_dir)
+            row.update(compute_metrics(result_dir, float(config_dict["backtest"]["init_capital"]),
+                                       task['risk_free_rate']))
+        row['result_dir'] = result_dir
+        row['error'] = "" if result_dir else "回测未完成"
+    except Exception as e:
+        row['result_dir'] = None
+        row['error'] = str(e)
+    finally:
+        os.chdir(cwd)
+        sink.close()
+    return row
+
+
+def _sweep_worker(task: Dict[str, Any]) -> Dict[str, Any]:
+    """子进程入口：打开共享行情数据并运行一组参数"""
+    store = _opened_stores.get(task['store_dir'])
+    if store is None:
+        store = SharedMarketData.open(task['store_dir'])
+        _opened_stores[task['store_dir']] = store
+    provider = ReplayDataProvider(store, task['provider_spec'])
+    row = _run_task(task, provider)
+    row['replay_misses'] = provider.misses
+    return row
+
+
+def run_sweep(config_path: str, strategy_file: str, param_grid: Dict[str, List[Any]],
+              max_workers: Optional[int] = None, output_dir: str = "sweep_results",
+              risk_free_rate: float = 0.03, progress_callback=None) -> pd.DataFrame:
+    """并行运行参数扫描
+
+    Args:
+        config_path: 基础 .kh 配置文件
+        strategy_file: 策略文件
+        param_grid: {参数名: 候选值列表}，参数名含 "." 时覆盖配置项
+        max_workers: 进程数，None 表示使用 CPU 核数
+        output_dir: 扫描结果根目录
+        risk_free_rate: 计算夏普比率使用的无风险利率
+        progress_callback: 进度回调 progress_callback(已完成数, 总数, 结果行)
+
+    Returns:
+        pd.DataFrame: 每组参数一行，包含参数、绩效指标和回测结果目录；同时保存为 results.csv
+    """
+    config_path = os.path.abspath(config_path)
+    strategy_file = os.path.abspath(strategy_file)
+    combos = expand_grid(param_grid)
+    if not combos:
+        return pd.DataFrame()
+
+    strategy_name = os.path.splitext(os.path.basename(strategy_file))[0]
+    sweep_dir = os.path.abspath(os.path.join(
+        output_dir, f"{strategy_name}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"))
+    store_dir = os.path.join(sweep_dir, "market_data")
+    provider_spec = provider_spec_from_config(KhConfig(config_path))
+
+    tasks = [{
+        'index': i,
+        'params': params,
+        'config_path': config_path,
+        'strategy_file': strategy_file,
+        'run_dir': os.path.join(sweep_dir, f"run_{i:04d}"),
+        'store_dir': store_dir,
+        'provider_spec': provider_spec,
+        'risk_free_rate': risk_free_rate,
+        'init_data_enabled': False,
+    } for i, params in enumerate(combos)]
+
+    # 1. 主进程运行第一组参数并记录行情请求
+    recorder = RecordingDataProvider(create_provider(provider_spec))
+    first_task = dict(tasks[0], init_data_enabled=None)
+    rows = [_run_task(first_task, recorder)]
+    if progress_callback:
+        progress_callback(1, len(tasks), rows[0])
+
+    # 2. 写入共享行情数据，3. 子进程并行回放
+    if len(tasks) > 1:
+        SharedMarketData.write(store_dir, recorder.records)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_sweep_worker, task) for task in tasks[1:]]
+            for future in as_completed(futures):
+                row = future.result()
+                rows.append(row)
+                if progress_callback:
+                    progress_callback(len(rows), len(tasks), row)
+
+    results = pd.DataFrame(rows).sort_values('run').reset_index(drop=True)
+    results.to_csv(os.path.join(sweep_dir, "results.csv"), index=False, encoding='utf-8-sig')
+    return results
@@ -0,0 +1,47 @@
+# coding: utf-8
+"""
+xtquant 可选导入 - 没有安装 xtquant 时（Linux 服务器、定时任务、子进程中使用 mootdx 回测）
+提供回测需要的常量和账户对象
+
+安装了 xtquant 时直接导出 xtquant 的 xtdata、xtconstant、XtQuantTrader、XtQuantTraderCallback、
+StockAccount；未安装时 xtdata、XtQuantTrader 为 None，xtconstant 只包含回测用到的常量
+（取值与 xtquant 一致），XtQuantTraderCallback 为空基类，StockAccount 只保存账户 ID 和类型。
+实盘/模拟交易仍然需要安装 xtquant。
+"""
+
+from types import SimpleNamespace
+
+try:
+    from xtquant import xtdata
+    from xtquant import xtconstant
+    from xtquant.xttrader import XtQuantTrader, XtQuantTraderCallback
+    from xtquant.xttype import StockAccount
+    HAS_XTQUANT = True
+except ImportError:
+    HAS_XTQUANT = False
+    xtdata = None
+    XtQuantTrader = None
+
+    # 回测使用的委托、账户常量（取值与 xtquant.xtconstant 一致）
+    xtconstant = SimpleNamespace(
+        SECURITY_ACCOUNT=2,
+        STOCK_BUY=23,
+        STOCK_SELL=24,
+        FIX_PRICE=11,
+        LATEST_PRICE=5,
+        ORDER_SUCCEEDED=56,
+        DIRECTION_FLAG_LONG=48,
+        DIRECTION_FLAG_SHORT=49,
+        OFFSET_FLAG_OPEN=48,
+        OFFSET_FLAG_CLOSE=49,
+    )
+
+    class XtQuantTraderCallback:
+        """未安装 xtquant 时的交易回调基类（回测不会触发回调）"""
+
+    class StockAccount:
+        """未安装 xtquant 时的账户对象，只保存账户 ID 和账户类型"""
+
+        def __init__(self, account_id: str, account_type: str = 'STOCK'):
+            self.account_id = account_id
+            self.account_type = account_type
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+命令行回测启动脚本（khquant-backtest）
+
+示例:
+    python khquant_backtest.py strategies/RSI策略.kh strategies/RSI策略.py
+"""
+
+import sys
+import os
+
+# 确保从正确的目录导入模块
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from khBacktest import main
+
+if __name__ == "__main__":
+    sys.exit(main())